@@ -49,7 +49,7 @@ export const documentsAPI = {
 // Query APIs
 export const queryAPI = {
   query: (question) => api.post('/query/', { question }),
-  queryStream: async (question, onChunk, onComplete, onError) => {
+  queryStream: async (question, onChunk, onComplete, onError, onSources) => {
     try {
       const response = await fetch(`${API_BASE_URL}/query/stream`, {
         method: 'POST',
@@ -66,27 +66,45 @@ export const queryAPI = {
 
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      let buffer = '';
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
-        
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n');
-        
-        for (const line of lines) {
-          if (line.startsWith('data: ')) {
-            const data = line.slice(6);
-            if (data === '[DONE]') {
-              onComplete && onComplete();
+
+        // SSE frames end with a blank line; keep any partial frame for the next read
+        buffer += decoder.decode(value, { stream: true });
+        const frames = buffer.split('\n\n');
+        buffer = frames.pop();
+
+        for (const frame of frames) {
+          let event = 'message';
+          let data = null;
+          for (const line of frame.split('\n')) {
+            if (line.startsWith('event: ')) {
+              event = line.slice(7);
+            } else if (line.startsWith('data: ')) {
+              data = line.slice(6);
+            }
+          }
+          if (data === null) continue;
+
+          if (data === '[DONE]') {
+            onComplete && onComplete();
+            continue;
+          }
+
+          try {
+            const parsed = JSON.parse(data);
+            if (event === 'sources') {
+              onSources && onSources(parsed);
+            } else if (event === 'error') {
+              onError && onError(new Error(parsed));
             } else {
-              try {
-                const parsed = JSON.parse(data);
-                onChunk && onChunk(parsed);
-              } catch (e) {
-                console.error('Error parsing chunk:', e);
-              }
+              onChunk && onChunk(parsed);
             }
+          } catch (e) {
+            console.error('Error parsing chunk:', e);
           }
         }
       }
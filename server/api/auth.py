@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
-from db.mongo import users_col
+from db.async_mongo import get_user_by_email, insert_user
 from auth.auth_utils import hash_password, verify_password
 from auth.jwt_handler import create_access_token
 import uuid
@@ -17,23 +18,24 @@ class LoginRequest(BaseModel):
     password: str
 
 @router.post("/register")
-def register(data: RegisterRequest):
-    if users_col.find_one({"email": data.email}):
+async def register(data: RegisterRequest):
+    if await get_user_by_email(data.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
+    # Password hashing is CPU-bound: keep it off the event loop
     user = {
         "user_id": str(uuid.uuid4()),
         "email": data.email,
-        "password": hash_password(data.password)
+        "password": await run_in_threadpool(hash_password, data.password)
     }
-    users_col.insert_one(user)
+    await insert_user(user)
 
     return {"message": "User registered successfully"}
 
 @router.post("/login")
-def login(data: LoginRequest):
-    user = users_col.find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["password"]):
+async def login(data: LoginRequest):
+    user = await get_user_by_email(data.email)
+    if not user or not await run_in_threadpool(verify_password, data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     token = create_access_token({"user_id": user["user_id"]})
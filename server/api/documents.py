@@ -1,21 +1,28 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
 from typing import List
+from pymongo.errors import DuplicateKeyError
 import os
-import shutil
 import uuid
 
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from auth.dependencies import get_current_user_id
 
-from db.mongo import (
+from db.async_mongo import (
     insert_document,
     get_user_documents,
+    get_document_by_job_id,
+    get_document_by_id,
+    get_document_by_hash,
+    fail_stale_hash_holder,
     delete_document,
-    delete_chunks_by_file
+    delete_document_records,
+    get_faiss_ids_by_file
 )
-from rag.ingest import ingest_new_document
+from api.upload import save_upload_stream, UploadTooLarge, UploadTypeMismatch
+from rag.loaders import is_supported_file
 from rag.reindex import rebuild_user_faiss_index
-from rag.parallel_ingest import parallel_ingest_document
+from rag.index_writer import delete_document_vectors
+from rag.ingest_jobs import ingest_queue, new_job_id, stale_before, IngestQueueFull, INTERRUPTED
 
 
 # Router
@@ -29,108 +36,128 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
 
-# LOAD DOCUMENT USING LANGCHAIN
-
-def load_document_with_langchain(file_path: str, filename: str):
-    """
-    Uses LangChain loaders to extract text.
-    Returns tuple of (pages, file_type):
-    pages = [{"page": int, "text": str}]
-    """
-    filename_lower = filename.lower()
-    
-    if filename_lower.endswith(".pdf"):
-        loader = PyPDFLoader(file_path)
-        docs = loader.load()
-        file_type = "pdf"
-
-        pages = [
-            {
-                "page": doc.metadata.get("page", i) + 1,
-                "text": doc.page_content
-            }
-            for i, doc in enumerate(docs)
-        ]
-
-    elif filename_lower.endswith(".docx"):
-        loader = Docx2txtLoader(file_path)
-        docs = loader.load()
-        file_type = "docx"
-
-        # DOCX usually has no pages
-        if docs:
-            pages = [
-                {
-                    "page": 1,
-                    "text": docs[0].page_content
-                }
-            ]
-        else:
-            pages = [{"page": 1, "text": ""}]
-
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="Unsupported file type. Only PDF and DOCX files are supported."
-        )
-
-    return pages, file_type
+def _duplicate_response(existing: dict) -> dict:
+    return {
+        "message": "Document already uploaded",
+        "job_id": existing.get("job_id"),
+        "file_id": existing["file_id"],
+        "filename": existing["filename"],
+        "status": existing["status"],
+        "duplicate": True
+    }
 
 
 
-# UPLOAD DOCUMENT
+# UPLOAD DOCUMENT (QUEUED INGESTION)
 
-@router.post("/upload")
+@router.post("/upload", status_code=202)
 async def upload_document(
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user_id)
 ):
-    filename_lower = file.filename.lower()
-    if not (filename_lower.endswith(".pdf") or filename_lower.endswith(".docx")):
+    if not is_supported_file(file.filename):
         raise HTTPException(
             status_code=400,
             detail="Only PDF and DOCX files are supported"
         )
 
-    # Save file
+    # Stream to disk off the event loop (hash + size + type check in one pass)
     temp_file_id = str(uuid.uuid4())
     file_path = os.path.join(UPLOAD_DIR, f"{temp_file_id}_{file.filename}")
 
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
     try:
-        # 🔥 Load using LangChain
-        pages, file_type = load_document_with_langchain(file_path, file.filename)
-    except Exception as e:
-        # Clean up file on error
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to process document: {str(e)}"
+        saved = await save_upload_stream(
+            file,
+            file_path,
+            expected_type=file.filename.lower().rsplit(".", 1)[-1]
         )
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadTypeMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    content_hash = saved["content_hash"]
+
+    # Same file already uploaded by this user: reuse it, skip parsing/embedding.
+    # A job orphaned by a dead process does not count: this upload redoes it.
+    existing = await get_document_by_hash(user_id, content_hash, stale_before())
+    if existing is not None:
+        os.remove(file_path)
+        return _duplicate_response(existing)
+
+    # Save document metadata (not searchable until the job marks it indexed).
+    # The insert claims the file content (unique live_hash), so of two
+    # uploads of the same file racing past the lookup only one is indexed.
+    job_id = new_job_id()
+    doc = None
+    for _ in range(2):
+        try:
+            doc = await insert_document(
+                user_id=user_id,
+                filename=file.filename,
+                file_type=saved["file_type"],
+                num_pages=0,
+                status="queued",
+                job_id=job_id,
+                content_hash=content_hash,
+                file_path=file_path
+            )
+            break
+        except DuplicateKeyError:
+            existing = await get_document_by_hash(user_id, content_hash, stale_before())
+            if existing is not None:
+                os.remove(file_path)
+                return _duplicate_response(existing)
+            # Claimed by an orphaned job: fail it and claim again
+            await fail_stale_hash_holder(user_id, content_hash, stale_before(), INTERRUPTED)
+    if doc is None:
+        os.remove(file_path)
+        raise HTTPException(status_code=409, detail="The same file is being uploaded, try again shortly")
+
+    # 🔥 Parse + embed + index on the background pool
+    try:
+        ingest_queue.submit(
+            user_id=user_id,
+            file_id=doc["file_id"],
+            file_path=file_path,
+            filename=file.filename,
+            job_id=job_id
+        )
+    except IngestQueueFull as e:
+        await delete_document(user_id, doc["file_id"])
+        os.remove(file_path)
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "message": "Document queued for indexing",
+        "job_id": job_id,
+        "file_id": doc["file_id"],
+        "filename": file.filename,
+        "status": doc["status"],
+        "duplicate": False
+    }
+
+
 
-    # Save document metadata
-    doc = insert_document(
-        user_id=user_id,
-        filename=file.filename,
-        file_type=file_type,
-        num_pages=len(pages)
-    )
-
-    # 🔥 Incremental ingestion (LangChain + FAISS)
-    parallel_ingest_document(
-        user_id=user_id,
-        file_id=doc["file_id"],
-        filename=file.filename,
-        extracted_pages=pages
-    )
+# INGESTION JOB STATUS
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job_status(
+    job_id: str,
+    user_id: str = Depends(get_current_user_id)
+):
+    doc = await get_document_by_job_id(user_id, job_id)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Job not found")
 
     return {
-        "message": "Document uploaded successfully",
+        "job_id": job_id,
         "file_id": doc["file_id"],
-        "filename": file.filename
+        "filename": doc["filename"],
+        "status": doc["status"],
+        "progress": doc.get("progress", 0),
+        "num_pages": doc.get("num_pages"),
+        "error": doc.get("error"),
+        "ingest": doc.get("ingest")
     }
 
 
@@ -138,22 +165,47 @@ async def upload_document(
 # LIST USER DOCUMENTS
 
 @router.get("/")
-def list_documents(user_id: str = Depends(get_current_user_id)):
-    return get_user_documents(user_id)
+async def list_documents(user_id: str = Depends(get_current_user_id)):
+    return await get_user_documents(user_id)
+
+
+
+# COMPACT INDEX (FULL REBUILD)
+
+@router.post("/compact")
+def compact_user_index(user_id: str = Depends(get_current_user_id)):
+    rebuild_user_faiss_index(user_id)
 
+    return {"message": "Vector index rebuilt"}
 
 
-# DELETE DOCUMENT (WITH RE-INDEX)
+
+# DELETE DOCUMENT (INCREMENTAL)
 
 @router.delete("/{file_id}")
-def delete_user_document(
+async def delete_user_document(
     file_id: str,
     user_id: str = Depends(get_current_user_id)
 ):
-    delete_document(user_id, file_id)
-    delete_chunks_by_file(user_id, file_id)
+    document = await get_document_by_id(user_id, file_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
 
-    # 🔥 Rebuild FAISS index (only on delete)
-    rebuild_user_faiss_index(user_id)
+    faiss_ids = await get_faiss_ids_by_file(user_id, file_id)
+
+    await delete_document_records(user_id, file_id)
+
+    # 🔥 Remove only this document's vectors (no re-embedding); waits for the index writer
+    removed = await run_in_threadpool(delete_document_vectors, user_id, file_id, faiss_ids)
 
-    return {"message": "Document deleted and vector index rebuilt"}
+    # The upload itself (a failed job has removed it already)
+    if document.get("file_path"):
+        try:
+            os.remove(document["file_path"])
+        except FileNotFoundError:
+            pass
+
+    return {
+        "message": "Document deleted",
+        "vectors_removed": removed
+    }
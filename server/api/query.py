@@ -1,11 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
-from typing import Dict
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
-from rag.memory_chain import get_conversational_rag_chain
-from rag.streaming_chain import get_streaming_rag_chain, stream_rag_response
-from db.mongo import save_chat, get_chat_history
+from rag.memory_chain import run_conversational_query
+from rag.streaming_chain import stream_rag_response
+from rag.answer_cache import answer_cache
+from rag.embeddings import get_embedding_model
+from rag.vectorstore import get_index_version
+from rag.single_flight import (
+    query_flights,
+    stream_flights,
+    question_key,
+    history_digest
+)
+from rag.chat_history import build_chat_history
+from rag.batch_query import plan_batch, run_batch_query, ndjson_line, BATCH_QUERY_MAX_QUESTIONS
+from db.chat_writer import chat_writer
+from db import mongo, async_mongo
 from auth.dependencies import get_current_user_id
 
 # -------------------------------------------------
@@ -16,6 +29,31 @@ router = APIRouter(prefix="/query", tags=["Query"])
 # Request model
 class QueryRequest(BaseModel):
     question: str
+    # Only search these documents (omitted or empty: the whole library)
+    file_ids: Optional[List[str]] = None
+
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    file_ids: Optional[List[str]] = None
+
+
+def _scope(request: QueryRequest | BatchQueryRequest) -> tuple | None:
+    # Order and repeats do not change the search
+    return tuple(sorted(set(request.file_ids))) if request.file_ids else None
+
+
+def _check_scope(scope: tuple, statuses: dict[str, str]) -> None:
+    """
+    Every file_id in a scope must be the user's and searchable: 404 for
+    unknown (or someone else's) documents, 400 for ones not indexed yet.
+    """
+    missing = [f for f in scope if f not in statuses]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown file_ids: {missing}")
+    pending = [f for f in scope if statuses[f] != "indexed"]
+    if pending:
+        raise HTTPException(status_code=400, detail=f"Documents not indexed yet: {pending}")
 
 # -------------------------------------------------
 # NORMAL QUERY (WITH MEMORY)
@@ -30,68 +68,195 @@ def query_documents(
     Conversation history is passed explicitly.
     """
     question = request.question
+    scope = _scope(request)
+    file_ids = list(scope) if scope else None
+    if scope:
+        _check_scope(scope, mongo.get_documents_status(user_id, scope))
+
+    chat_history = _load_chat_history(user_id)
+
+    # 0️⃣ Semantic cache: same question against the same index version.
+    # The answer prompt includes the history, so only history-free answers
+    # (the ones /query/batch gives too) are shared.
+    cacheable = not chat_history
+    question_vector = get_embedding_model().embed_query(question) if cacheable else None
+    index_version = get_index_version(user_id)
+    cached = (
+        answer_cache.lookup(user_id, index_version, question_vector, scope)
+        if cacheable else None
+    )
+
+    if cached is not None:
+        answer = cached["answer"]
+        sources = cached["sources"]
+        llm_calls = 0
+        shared = False
+    else:
+        def answer_question():
+            result = _run_conversational_query(user_id, question, chat_history, file_ids)
+            if cacheable:
+                answer_cache.store(
+                    user_id,
+                    index_version,
+                    question,
+                    question_vector,
+                    result["answer"],
+                    result["sources"],
+                    scope
+                )
+            return result
 
-    # 1️⃣ Build stateless chain (NO MEMORY INSIDE)
-    chain = get_conversational_rag_chain(user_id)
+        # Identical questions already in flight wait for that one answer
+        flight_key = (
+            user_id,
+            question_key(question),
+            index_version,
+            history_digest(chat_history),
+            scope
+        )
+        result, shared = query_flights.do(flight_key, answer_question)
+        answer = result["answer"]
+        sources = result["sources"]
+        # Followers share the leader's calls instead of making their own
+        llm_calls = 0 if shared else result["llm_calls"]
 
-    # 2️⃣ Fetch previous chat history from MongoDB
-    previous_chats = get_chat_history(user_id, limit=6)
+    # 5️⃣ Persist this turn (write-behind: batched off the response path)
+    chat_writer.save(
+        user_id=user_id,
+        question=question,
+        answer=answer,
+        sources=sources
+    )
+
+    return {
+        "answer": answer,
+        "sources": sources,
+        "cached": cached is not None,
+        "coalesced": shared,
+        "llm_calls": llm_calls
+    }
 
-    # 3️⃣ Convert DB records → LangChain format
-    chat_history = []
-    for chat in reversed(previous_chats):
-        chat_history.append(("human", chat["question"]))
-        chat_history.append(("ai", chat["answer"]))
 
-    # 4️⃣ Call chain WITH chat_history
+def _load_chat_history(user_id: str) -> list:
+    # 1️⃣ Recent turns verbatim + rolling summary of older ones, within a token budget
+    # 2️⃣ Already in LangChain (role, text) format
+    return build_chat_history(user_id)
+
+
+def _run_conversational_query(
+    user_id: str,
+    question: str,
+    chat_history: list,
+    file_ids: list[str] | None = None
+) -> dict:
+    # 3️⃣ Rewrite (per CONDENSE_STRATEGY), retrieve, answer
     try:
-        response = chain({
-            "question": question,
-            "chat_history": chat_history
-        })
+        response = run_conversational_query(user_id, question, chat_history, file_ids=file_ids)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    answer = response["answer"]
-
     sources = [
         {
             "filename": doc.metadata.get("filename"),
             "page": doc.metadata.get("page")
         }
-        for doc in response.get("source_documents", [])
+        for doc in response["source_documents"]
     ]
-
-    # 5️⃣ Persist this turn
-    save_chat(
-        user_id=user_id,
-        question=question,
-        answer=answer,
-        sources=sources
-    )
-
     return {
-        "answer": answer,
-        "sources": sources
+        "answer": response["answer"],
+        "sources": sources,
+        "llm_calls": response["llm_calls"]
     }
 
+
 # -------------------------------------------------
 # STREAMING QUERY (NO MEMORY)
 # -------------------------------------------------
 @router.post("/stream")
-def query_documents_stream(
+async def query_documents_stream(
     request: QueryRequest,
+    http_request: Request,
     user_id: str = Depends(get_current_user_id)
 ):
     """
-    Streams answer token-by-token using Gemini.
+    Streams answer token-by-token using Gemini (SSE).
+    A "sources" event is sent before the first token.
+    Identical questions in flight share one stream.
     """
+    question = request.question
+    scope = _scope(request)
+    if scope:
+        _check_scope(scope, await async_mongo.get_documents_status(user_id, scope))
+    index_version = await run_in_threadpool(get_index_version, user_id)
+    flight_key = (user_id, question_key(question), index_version, scope)
+
+    async def frames():
+        shared = stream_flights.subscribe(
+            flight_key,
+            lambda: stream_rag_response(user_id, question, file_ids=list(scope) if scope else None)
+        )
+        try:
+            async for frame in shared:
+                if await http_request.is_disconnected():
+                    break
+                yield frame
+        finally:
+            await shared.aclose()
+
     return StreamingResponse(
-        stream_rag_response(user_id, request.question),
-        media_type="text/event-stream"
+        frames(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
     )
 
 
-# This file provides two endpoints:
+# -------------------------------------------------
+# BATCH QUERY (NO MEMORY)
+# -------------------------------------------------
+@router.post("/batch")
+async def query_documents_batch(
+    request: BatchQueryRequest,
+    http_request: Request,
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Many independent questions in one call (evaluation jobs, LMS sync).
+    Streams NDJSON, one line per question in completion order:
+    {"index", "question", "answer", "sources", "cached"} or
+    {"index", "question", "error"}.
+    Not saved to the chat history.
+    """
+    if len(request.questions) > BATCH_QUERY_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BATCH_QUERY_MAX_QUESTIONS} questions per batch"
+        )
+
+    # Embedding + retrieval before the 200 goes out: a failure here is a
+    # plain 500, not an NDJSON stream cut short
+    scope = _scope(request)
+    if scope:
+        _check_scope(scope, await async_mongo.get_documents_status(user_id, scope))
+    file_ids = list(scope) if scope else None
+    version, plans = await run_in_threadpool(plan_batch, user_id, request.questions, file_ids)
+
+    async def lines():
+        results = run_batch_query(user_id, request.questions, version, plans, file_ids)
+        try:
+            async for result in results:
+                if await http_request.is_disconnected():
+                    break
+                yield ndjson_line(result)
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# This file provides three endpoints:
 # POST /query → normal RAG with memory
-# POST /query/stream → streaming response (Gemini)
\ No newline at end of file
+# POST /query/stream → streaming response (Gemini)
+# POST /query/batch → many questions, NDJSON in completion order
\ No newline at end of file
@@ -0,0 +1,82 @@
+import os
+import hashlib
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+load_dotenv()
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Leading bytes of each supported format (DOCX is a ZIP container)
+FILE_SIGNATURES = {
+    "pdf": b"%PDF-",
+    "docx": b"PK\x03\x04"
+}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadTypeMismatch(Exception):
+    pass
+
+
+def sniff_file_type(head: bytes) -> str | None:
+    for file_type, signature in FILE_SIGNATURES.items():
+        if head.startswith(signature):
+            return file_type
+    return None
+
+
+def _write_chunk(f, hasher, chunk: bytes) -> None:
+    hasher.update(chunk)
+    f.write(chunk)
+
+
+async def save_upload_stream(
+    file: UploadFile,
+    dest_path: str,
+    expected_type: str,
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> dict:
+    """
+    Copy an upload to disk in chunks without blocking the event loop.
+    Hash, byte count and file-type sniffing happen in the same pass.
+    The partial file is removed if the upload is rejected.
+    Returns {"content_hash", "size", "file_type"}.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+
+    f = await run_in_threadpool(open, dest_path, "wb")
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            if size == 0 and sniff_file_type(chunk) != expected_type:
+                raise UploadTypeMismatch(
+                    f"File content is not a valid {expected_type.upper()} document"
+                )
+
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(
+                    f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit"
+                )
+
+            await run_in_threadpool(_write_chunk, f, hasher, chunk)
+
+        if size == 0:
+            raise UploadTypeMismatch("Uploaded file is empty")
+
+    except Exception:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, dest_path)
+        raise
+
+    await run_in_threadpool(f.close)
+    return {
+        "content_hash": hasher.hexdigest(),
+        "size": size,
+        "file_type": expected_type
+    }
@@ -0,0 +1,123 @@
+"""
+Recall@k, latency and memory of the index types rag.ann_index can pick,
+measured against exact (flat) search on the same vectors.
+
+Uses a user's archived vectors when --user-id is given, otherwise a
+synthetic clustered set shaped like sentence embeddings.
+
+    cd server && python benchmarks/bench_ann_index.py --n 50000 --k 10
+    cd server && python benchmarks/bench_ann_index.py --user-id <id> --nprobe 8,16,32 --ef 32,64,128
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import faiss
+from rag import ann_index
+from rag.ann_index import build_index, index_bytes, ivf_nlist, _pq_subquantizers
+from rag.vector_archive import _archive_paths, _read_header
+
+
+def synthetic_vectors(n: int, d: int, seed: int = 0) -> np.ndarray:
+    # Topic clusters + noise, unit length: closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, n // 500), d)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n)] + 0.6 * rng.normal(size=(n, d)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def archived_vectors(user_id: str) -> np.ndarray:
+    header = _read_header(user_id)
+    if header is None:
+        sys.exit(f"No vector archive for user {user_id}")
+    vec_path, ids_path, _ = _archive_paths(user_id)
+    rows = np.fromfile(vec_path, dtype=header["dtype"]).reshape(-1, header["dim"])
+    ids = np.fromfile(ids_path, dtype=np.int64)[:len(rows)]
+    # Later rows win for re-used ids, as in load_vectors
+    _, last = np.unique(ids[::-1], return_index=True)
+    return rows[len(ids) - 1 - last].astype(np.float32)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def time_queries(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, float, float]:
+    """
+    One query per search call, as the retriever does.
+    Returns (labels, p50 ms, p95 ms).
+    """
+    labels, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, found = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        labels.append(found[0])
+    return np.array(labels), float(np.percentile(latencies, 50)), float(np.percentile(latencies, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--d", type=int, default=384)
+    parser.add_argument("--user-id", help="benchmark this user's archived vectors instead")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", default="8,16,32")
+    parser.add_argument("--ef", default="32,64,128")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(1)  # the server searches one query per thread
+    vectors = archived_vectors(args.user_id) if args.user_id else synthetic_vectors(args.n, args.d)
+    n, d = vectors.shape
+
+    # Queries: perturbed library vectors (questions land near their passages)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(n, size=args.queries)] + 0.1 * rng.normal(size=(args.queries, d)).astype(np.float32)
+
+    print(f"{n} vectors, d={d}, {args.queries} queries, k={args.k}, ANN_FLAT_MAX={ann_index.ANN_FLAT_MAX}")
+    print(f"{'index':<28}{'param':>12}{'build s':>9}{'MB':>9}{'p50 ms':>9}{'p95 ms':>9}{'recall':>8}")
+
+    nlist = ivf_nlist(n)
+    pq = f"PQ{_pq_subquantizers(d)}"
+    m = ann_index.ANN_HNSW_M
+    configs = [
+        ("Flat", None, []),
+        (f"IVF{nlist},Flat", "nprobe", args.nprobe),
+        (f"IVF{nlist},SQ8", "nprobe", args.nprobe),
+        (f"IVF{nlist},{pq}", "nprobe", args.nprobe),
+        (f"HNSW{m}", "efSearch", args.ef),
+        (f"HNSW{m}_SQ8", "efSearch", args.ef),
+        (f"HNSW{m}_{pq}", "efSearch", args.ef),
+    ]
+
+    truth = None
+    for spec, param, values in configs:
+        start = time.perf_counter()
+        index = build_index(vectors, spec)
+        build_seconds = time.perf_counter() - start
+        mb = index_bytes(index) / 1e6
+
+        for value in ([int(v) for v in values.split(",")] if values else [None]):
+            if param == "nprobe":
+                index.nprobe = value
+            elif param == "efSearch":
+                index.hnsw.efSearch = value
+
+            labels, p50, p95 = time_queries(index, queries, args.k)
+            if truth is None:
+                truth = labels  # the first config is exact search
+            print(
+                f"{spec:<28}{(f'{param}={value}' if param else '-'):>12}"
+                f"{build_seconds:>9.2f}{mb:>9.1f}{p50:>9.3f}{p95:>9.3f}"
+                f"{recall_at_k(labels, truth):>8.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+/query/batch vs. looping over single questions.
+
+Retrieval is measured for real (embedding model + FAISS + BM25 + packing)
+on a throwaway user index: one embed_query + retriever.invoke per question
+vs. plan_batch (one embedding call, one batched search). The Gemini phase
+is simulated with a fixed latency per call (--llm-ms), sequential for the
+loop and BATCH_QUERY_CONCURRENCY at a time for the batch, so no API key
+is needed.
+
+    cd server && python benchmarks/bench_batch_query.py --chunks 2000 --questions 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+
+from langchain_community.vectorstores import FAISS
+from rag.embeddings import get_embedding_model
+from rag.vectorstore import save_user_vectorstore
+from rag.retriever import get_retriever
+from rag.batch_query import plan_batch, BATCH_QUERY_CONCURRENCY
+
+USER_ID = "bench-batch-query"
+TOPICS = ["thermodynamics", "linked lists", "photosynthesis", "matrix rank", "tcp handshake",
+          "supply and demand", "mitosis", "binary search", "ohm's law", "the french revolution"]
+
+
+def build_library(chunks: int, seed: int = 0) -> list[str]:
+    rng = np.random.default_rng(seed)
+    return [
+        f"Lecture {i // 20}, section {i % 20}: notes on {TOPICS[i % len(TOPICS)]}, "
+        f"example {int(rng.integers(1000))} and exercise CS-{int(rng.integers(100, 999))}."
+        for i in range(chunks)
+    ]
+
+
+async def simulated_llm_phase(calls: int, llm_seconds: float, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call():
+        async with semaphore:
+            await asyncio.sleep(llm_seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call() for _ in range(calls)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--llm-ms", type=float, default=800)
+    parser.add_argument("--concurrency", type=int, default=BATCH_QUERY_CONCURRENCY)
+    args = parser.parse_args()
+
+    # Index, lexical and embedding-cache files go to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="bench-batch-"))
+    embeddings = get_embedding_model()
+    texts = build_library(args.chunks)
+    vectors = embeddings.embed_documents(texts)
+    save_user_vectorstore(FAISS.from_embeddings(
+        zip(texts, vectors),
+        embeddings,
+        [{"file_id": f"f{i // 200}", "page": i % 20, "faiss_index_id": i} for i in range(len(texts))],
+        ids=[str(i) for i in range(len(texts))]
+    ), USER_ID)
+
+    rng = np.random.default_rng(1)
+    # Distinct questions for each side: neither may hit the embedding cache
+    questions = [
+        f"What does lecture {int(rng.integers(100))} say about {TOPICS[int(rng.integers(len(TOPICS)))]} (q{i})?"
+        for i in range(2 * args.questions)
+    ]
+    looped, batched = questions[:args.questions], questions[args.questions:]
+    llm = args.llm_ms / 1000
+
+    start = time.perf_counter()
+    for question in looped:
+        get_retriever(USER_ID).invoke(question)
+    loop_retrieval = time.perf_counter() - start
+
+    start = time.perf_counter()
+    plan_batch(USER_ID, batched)
+    batch_retrieval = time.perf_counter() - start
+
+    loop_llm = asyncio.run(simulated_llm_phase(args.questions, llm, 1))
+    batch_llm = asyncio.run(simulated_llm_phase(args.questions, llm, args.concurrency))
+
+    loop_total = loop_retrieval + loop_llm
+    batch_total = batch_retrieval + batch_llm
+    print(f"{args.chunks} chunks, {args.questions} questions, LLM {args.llm_ms:.0f} ms/call, concurrency {args.concurrency}")
+    print(f"{'':<16}{'retrieval s':>12}{'llm s':>10}{'total s':>10}{'q/s':>8}")
+    print(f"{'loop /query':<16}{loop_retrieval:>12.2f}{loop_llm:>10.2f}{loop_total:>10.2f}{args.questions / loop_total:>8.1f}")
+    print(f"{'/query/batch':<16}{batch_retrieval:>12.2f}{batch_llm:>10.2f}{batch_total:>10.2f}{args.questions / batch_total:>8.1f}")
+    print(f"speedup {loop_total / batch_total:.1f}x (retrieval alone {loop_retrieval / batch_retrieval:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
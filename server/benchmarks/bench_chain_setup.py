@@ -0,0 +1,110 @@
+"""
+Per-request chain construction: building a fresh Gemini client, prompt and
+chain on every request vs. binding a retriever to prebuilt pooled chains.
+
+Measures construction only (no LLM calls, no network), so it needs no
+valid API key.
+
+    cd server && python benchmarks/bench_chain_setup.py --requests 500
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-placeholder")
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.prompts import PromptTemplate
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.output_parsers import StrOutputParser
+from langchain_classic.chains.retrieval_qa.base import RetrievalQA
+from rag.llm import MODEL, get_text_chain, get_stuff_chain, llm_pool
+
+TEMPLATE = """
+Answer using ONLY the context.
+
+Context:
+{context}
+
+Question:
+{question}
+"""
+PROMPT = PromptTemplate(input_variables=["context", "question"], template=TEMPLATE)
+
+
+class EmptyRetriever(BaseRetriever):
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return []
+
+
+def per_request_retrieval_qa():
+    llm = ChatGoogleGenerativeAI(
+        model=MODEL,
+        temperature=0,
+        google_api_key=os.environ["GOOGLE_API_KEY"]
+    )
+    prompt = PromptTemplate(input_variables=["context", "question"], template=TEMPLATE)
+    return RetrievalQA.from_chain_type(
+        llm=llm,
+        retriever=EmptyRetriever(),
+        chain_type="stuff",
+        chain_type_kwargs={"prompt": prompt}
+    )
+
+
+def pooled_retrieval_qa():
+    return RetrievalQA(
+        combine_documents_chain=get_stuff_chain(PROMPT),
+        retriever=EmptyRetriever()
+    )
+
+
+def per_request_lcel():
+    llm = ChatGoogleGenerativeAI(
+        model=MODEL,
+        temperature=0,
+        google_api_key=os.environ["GOOGLE_API_KEY"]
+    )
+    prompt = PromptTemplate(input_variables=["context", "question"], template=TEMPLATE)
+    return prompt | llm | StrOutputParser()
+
+
+def pooled_lcel():
+    return get_text_chain(PROMPT)
+
+
+def bench(fn, requests: int) -> float:
+    fn()  # warm imports / pool slots
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    # Fill every pool slot first: steady state, as in a running server
+    for _ in range(llm_pool.size):
+        pooled_retrieval_qa()
+        pooled_lcel()
+
+    print(f"{'chain':<14}{'per request':>14}{'pooled':>12}{'saved':>12}{'speedup':>10}")
+    for name, old, new in (
+        ("RetrievalQA", per_request_retrieval_qa, pooled_retrieval_qa),
+        ("prompt|llm", per_request_lcel, pooled_lcel),
+    ):
+        old_s = bench(old, args.requests)
+        new_s = bench(new, args.requests)
+        print(
+            f"{name:<14}{old_s * 1e3:>11.3f} ms{new_s * 1e3:>9.3f} ms"
+            f"{(old_s - new_s) * 1e3:>9.3f} ms{old_s / new_s:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Sync helpers called from async handlers vs. the async data-access layer,
+per-row vs. bulk writes, and the time /query spends saving its turn
+(save_chat vs. the write-behind chat writer).
+
+Runs on the in-memory backend (DB_BACKEND=memory) with an emulated round
+trip per operation (--latency-ms), so no MongoDB is needed. Each simulated
+request does the upload handler's database work: duplicate lookup, insert,
+then a document listing.
+
+    cd server && python benchmarks/bench_db_layer.py --requests 200 --latency-ms 2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=2)
+    parser.add_argument("--turns", type=int, default=500)
+    return parser.parse_args()
+
+
+args = parse_args()
+# Must be set before db.mongo is imported
+os.environ["DB_BACKEND"] = "memory"
+os.environ["MEMORY_DB_LATENCY_MS"] = str(args.latency_ms)
+
+from db import mongo, async_mongo
+from db.chat_writer import chat_writer
+
+
+async def blocking_request(i: int) -> None:
+    # What the handlers did: sync pymongo calls on the event loop thread
+    mongo.get_document_by_hash(f"user-{i % 10}", f"hash-{i}")
+    mongo.insert_document(f"user-{i % 10}", f"doc-{i}.pdf", "pdf", 0, status="queued", content_hash=f"hash-{i}")
+    mongo.get_user_documents(f"user-{i % 10}")
+
+
+async def async_request(i: int) -> None:
+    await async_mongo.get_document_by_hash(f"user-{i % 10}", f"hash-{i}")
+    await async_mongo.insert_document(f"user-{i % 10}", f"doc-{i}.pdf", "pdf", 0, status="queued", content_hash=f"hash-{i}")
+    await async_mongo.get_user_documents(f"user-{i % 10}")
+
+
+async def run_concurrently(request, count: int) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(request(i) for i in range(count)))
+    return time.perf_counter() - start
+
+
+def main():
+    n = args.requests
+    blocking = asyncio.run(run_concurrently(blocking_request, n))
+    mongo.documents_col.delete_many({})
+    non_blocking = asyncio.run(run_concurrently(async_request, n))
+
+    turns = [
+        {"user_id": f"user-{i % 10}", "question": f"q{i}", "answer": f"a{i}", "sources": []}
+        for i in range(args.turns)
+    ]
+    start = time.perf_counter()
+    for turn in turns:
+        mongo.save_chat(**turn)
+    per_row = time.perf_counter() - start
+    start = time.perf_counter()
+    mongo.insert_chat_records([mongo._chat_record(**turn) for turn in turns])
+    bulk = time.perf_counter() - start
+
+    # What a /query response waits for after the answer is ready
+    start = time.perf_counter()
+    for turn in turns:
+        mongo.save_chat(**turn)
+    inline = (time.perf_counter() - start) / len(turns)
+    start = time.perf_counter()
+    for turn in turns:
+        chat_writer.save(**turn)
+    behind = (time.perf_counter() - start) / len(turns)
+    chat_writer.shutdown()
+    writer = chat_writer.stats()
+
+    print(f"memory backend, {args.latency_ms:.1f} ms per round trip")
+    print(f"{n} concurrent upload-handler requests (3 round trips each)")
+    print(f"  sync helpers on the loop   {blocking:>8.2f} s  {n / blocking:>8.0f} req/s")
+    print(f"  async layer                {non_blocking:>8.2f} s  {n / non_blocking:>8.0f} req/s")
+    print(f"  speedup {blocking / non_blocking:.1f}x")
+    print(f"{args.turns} chat turns")
+    print(f"  save_chat per turn         {per_row:>8.2f} s")
+    print(f"  insert_chat_records        {bulk:>8.2f} s")
+    print(f"  speedup {per_row / bulk:.1f}x")
+    print("per /query turn (on the response path)")
+    print(f"  save_chat                  {inline * 1000:>8.3f} ms")
+    print(f"  chat_writer.save           {behind * 1000:>8.3f} ms  ({writer['flushes']} insert_many for {writer['saved']} turns)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import asyncio
+from datetime import datetime
+from pymongo import AsyncMongoClient
+from db.memory import AsyncMemoryDatabase, memory_database
+from db.mongo import (
+    DB_BACKEND,
+    DB_NAME,
+    MONGO_URI,
+    MEMORY_DB_LATENCY_MS,
+    client_options,
+    _document_record,
+    _live_hash_query,
+    _stale_query,
+    _failed_update
+)
+
+
+# Non-blocking counterparts of db/mongo.py for request handlers.
+# Background threads (ingest jobs, index writer, reindex) keep using the
+# sync module; both see the same data, with DB_BACKEND=memory too. Chat
+# turns go through db/chat_writer.py (write-behind) instead.
+
+
+# MongoDB Connection
+
+if DB_BACKEND == "memory":
+    client = None
+    db = AsyncMemoryDatabase(memory_database(MEMORY_DB_LATENCY_MS))
+else:
+    # Connects lazily, on the first operation (inside the server's event loop)
+    client = AsyncMongoClient(MONGO_URI, **client_options())
+    db = client[DB_NAME]
+
+
+# Collections
+
+users_col = db["users"]
+documents_col = db["documents"]
+chunks_col = db["chunks"]
+
+
+async def close_client() -> None:
+    """
+    Close the connection pool (server shutdown).
+    """
+    if client is not None:
+        await client.close()
+
+
+
+# USER OPERATIONS
+
+async def get_user_by_email(email: str) -> dict | None:
+    """
+    Fetch user by email.
+    """
+    return await users_col.find_one({"email": email}, {"_id": 0})
+
+
+async def insert_user(user: dict) -> None:
+    """
+    Insert a user record (user_id, email, password hash).
+    """
+    await users_col.insert_one(user)
+    user.pop("_id", None)
+
+
+
+# DOCUMENT OPERATIONS
+
+async def insert_document(
+    user_id: str,
+    filename: str,
+    file_type: str,
+    num_pages: int,
+    status: str = "indexed",
+    job_id: str | None = None,
+    content_hash: str | None = None,
+    file_path: str | None = None
+) -> dict:
+    """
+    Insert document metadata.
+    status: queued | parsing | embedding | indexed | failed
+    file_path: the uploaded file, removed with the document
+    """
+    document = _document_record(
+        user_id, filename, file_type, num_pages, status, job_id, content_hash, file_path
+    )
+    await documents_col.insert_one(document)
+    document.pop("_id", None)
+    return document
+
+
+async def get_document_by_job_id(user_id: str, job_id: str) -> dict | None:
+    """
+    Fetch the document created by an ingestion job.
+    """
+    return await documents_col.find_one(
+        {"user_id": user_id, "job_id": job_id},
+        {"_id": 0}
+    )
+
+
+async def get_document_by_id(user_id: str, file_id: str) -> dict | None:
+    """
+    Fetch a single document.
+    """
+    return await documents_col.find_one(
+        {"user_id": user_id, "file_id": file_id},
+        {"_id": 0}
+    )
+
+
+async def get_document_by_hash(
+    user_id: str,
+    content_hash: str,
+    stale_before: datetime | None = None
+) -> dict | None:
+    """
+    Fetch a user's live document with identical file content: indexed, or
+    in progress and heard from since stale_before.
+    """
+    return await documents_col.find_one(
+        _live_hash_query(user_id, content_hash, stale_before),
+        {"_id": 0}
+    )
+
+
+async def fail_stale_hash_holder(
+    user_id: str,
+    content_hash: str,
+    stale_before: datetime,
+    error: str
+) -> bool:
+    """
+    Fail the user's document that claims this content if its job died
+    (not heard from since stale_before), so a new upload can claim it.
+    """
+    result = await documents_col.update_one(
+        {"user_id": user_id, "live_hash": content_hash, **_stale_query(stale_before)},
+        _failed_update(error)
+    )
+    return result.modified_count > 0
+
+
+async def get_user_documents(user_id: str) -> list:
+    """
+    Get all documents uploaded by a user.
+    """
+    return await documents_col.find(
+        {"user_id": user_id},
+        {"_id": 0}
+    ).to_list(None)
+
+
+async def get_documents_status(user_id: str, file_ids: list[str]) -> dict[str, str]:
+    """
+    file_id -> status for those of file_ids the user owns.
+    """
+    return {
+        d["file_id"]: d["status"]
+        for d in await documents_col.find(
+            {"user_id": user_id, "file_id": {"$in": list(file_ids)}},
+            {"_id": 0, "file_id": 1, "status": 1}
+        ).to_list(None)
+    }
+
+
+async def delete_document(user_id: str, file_id: str) -> None:
+    """
+    Delete document metadata.
+    """
+    await documents_col.delete_one(
+        {"user_id": user_id, "file_id": file_id}
+    )
+
+
+
+# CHUNK OPERATIONS
+
+async def get_faiss_ids_by_file(user_id: str, file_id: str) -> list[int]:
+    """
+    FAISS ids of all chunks belonging to a document.
+    """
+    return [
+        c["faiss_index_id"]
+        for c in await chunks_col.find(
+            {"user_id": user_id, "file_id": file_id},
+            {"_id": 0, "faiss_index_id": 1}
+        ).to_list(None)
+    ]
+
+
+async def delete_document_records(user_id: str, file_id: str) -> None:
+    """
+    Delete a document's metadata and its chunks, both round trips at once.
+    """
+    await asyncio.gather(
+        documents_col.delete_one({"user_id": user_id, "file_id": file_id}),
+        chunks_col.delete_many({"user_id": user_id, "file_id": file_id})
+    )
@@ -0,0 +1,200 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from bson import ObjectId
+from db.mongo import _chat_record, insert_chat_records
+from db.mongo import get_chat_history_after as get_stored_chat_history_after
+from db.mongo import get_oldest_chat_history as get_stored_oldest_chat_history
+from dotenv import load_dotenv
+
+load_dotenv()
+# Flush as soon as this many turns are waiting...
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+# ...or once the oldest has waited this long
+CHAT_WRITE_INTERVAL_MS = int(os.getenv("CHAT_WRITE_INTERVAL_MS", "200"))
+# While MongoDB is unreachable, keep at most this many (oldest dropped first)
+CHAT_WRITE_MAX_PENDING = int(os.getenv("CHAT_WRITE_MAX_PENDING", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _bson_now() -> datetime:
+    # BSON dates keep milliseconds: a buffered turn must look the same once stored
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond - now.microsecond % 1000)
+
+
+class ChatWriter:
+    """
+    Write-behind buffer for chat turns. save() returns immediately; a
+    background thread stores waiting turns with one insert_many per batch.
+    Turns not stored yet are served from memory (pending), so this
+    process's next read sees them. Other worker processes see a turn once
+    it is flushed, at most CHAT_WRITE_INTERVAL_MS later.
+    """
+
+    def __init__(self, batch_size: int, interval_ms: int, max_pending: int):
+        self._batch_size = max(1, batch_size)
+        self._interval = interval_ms / 1000
+        self._max_pending = max_pending
+        self._buffer = []    # waiting
+        self._inflight = []  # being inserted
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._stats = {"saved": 0, "flushes": 0, "failed_flushes": 0, "dropped": 0}
+
+    def save(
+        self,
+        user_id: str,
+        question: str,
+        answer: str,
+        sources: list
+    ) -> None:
+        record = _chat_record(user_id, question, answer, sources, _bson_now())
+        # Chosen here, so a retried batch cannot store a turn twice
+        record["_id"] = ObjectId()
+
+        with self._cond:
+            if not self._stopping:
+                self._buffer.append(record)
+                if len(self._buffer) > self._max_pending:
+                    del self._buffer[0]
+                    self._stats["dropped"] += 1
+                    logger.warning("Chat write buffer full: dropped the oldest unsaved turn")
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+                    self._thread.start()
+                if len(self._buffer) >= self._batch_size:
+                    self._cond.notify_all()
+                return
+
+        # Shut down already: write through
+        insert_chat_records([record])
+
+    def pending(self, user_id: str, after: datetime | None = None) -> list:
+        """
+        A user's turns not stored yet, newer than `after` (newest first).
+        """
+        with self._cond:
+            turns = [
+                t for t in self._inflight + self._buffer
+                if t["user_id"] == user_id and (after is None or t["timestamp"] > after)
+            ]
+        return [{k: v for k, v in t.items() if k != "_id"} for t in reversed(turns)]
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._buffer or self._stopping)
+                if not self._buffer:
+                    return
+                # A partial batch waits up to the interval for company
+                self._cond.wait_for(
+                    lambda: len(self._buffer) >= self._batch_size or self._stopping,
+                    timeout=self._interval
+                )
+                batch = self._buffer[:self._batch_size]
+                del self._buffer[:len(batch)]
+                self._inflight = batch
+
+            try:
+                insert_chat_records(batch)
+            except Exception:
+                logger.exception(f"Chat write of {len(batch)} turns failed")
+                with self._cond:
+                    self._stats["failed_flushes"] += 1
+                    self._inflight = []
+                    if self._stopping:
+                        self._stats["dropped"] += len(batch)
+                        self._cond.notify_all()
+                        continue
+                    # Back in front, readers never lose sight of them; retry after a pause
+                    self._buffer[:0] = batch
+                    self._cond.wait(self._interval)
+                continue
+
+            with self._cond:
+                self._inflight = []
+                self._stats["saved"] += len(batch)
+                self._stats["flushes"] += 1
+                self._cond.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every turn saved so far is stored (or dropped).
+        """
+        with self._cond:
+            self._cond.notify_all()
+            return self._cond.wait_for(
+                lambda: not self._buffer and not self._inflight,
+                timeout=timeout
+            )
+
+    def shutdown(self, timeout: float | None = 10) -> None:
+        """
+        Store what is waiting and stop the thread. Later saves write through.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self._stats,
+                "pending": len(self._buffer) + len(self._inflight),
+                "batch_size": self._batch_size,
+                "interval_ms": int(self._interval * 1000)
+            }
+
+
+chat_writer = ChatWriter(CHAT_WRITE_BATCH_SIZE, CHAT_WRITE_INTERVAL_MS, CHAT_WRITE_MAX_PENDING)
+
+
+def merge_pending(pending: list, stored: list, limit: int) -> list:
+    """
+    Stored turns plus buffered ones, newest first. A turn flushed while
+    being read shows up in both lists; it is kept once.
+    """
+    if not pending:
+        return stored
+
+    seen = {(t["timestamp"], t["question"]) for t in stored}
+    turns = stored + [t for t in pending if (t["timestamp"], t["question"]) not in seen]
+    turns.sort(key=lambda t: t["timestamp"], reverse=True)
+    return turns[:limit]
+
+
+# Read-through versions of db/mongo.py's chat history reads
+
+def get_chat_history_after(user_id: str, after: datetime | None, limit: int = 20) -> list:
+    """
+    Get recent chat history newer than `after` (newest first), including
+    turns not stored yet.
+    """
+    # Buffer first: a turn flushed in between is then found in the collection
+    pending = chat_writer.pending(user_id, after)
+    return merge_pending(pending, get_stored_chat_history_after(user_id, after, limit), limit)
+
+
+def get_oldest_chat_history(
+    user_id: str,
+    after: datetime | None,
+    before: datetime,
+    limit: int = 20
+) -> list:
+    """
+    Get the oldest chat turns between `after` and `before` (oldest first),
+    including turns not stored yet.
+    """
+    pending = [t for t in chat_writer.pending(user_id, after) if t["timestamp"] < before]
+    stored = get_stored_oldest_chat_history(user_id, after, before, limit)
+    if not pending:
+        return stored
+    # Newest first in, oldest first out
+    return list(reversed(merge_pending(pending, list(reversed(stored)), len(stored) + len(pending))))[:limit]
@@ -0,0 +1,446 @@
+import time
+import copy
+import asyncio
+import threading
+from bson import ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+
+# In-process stand-in for the MongoDB collections (DB_BACKEND=memory).
+# Covers the subset of the pymongo API this server uses: equality, $in,
+# $ne, $gt, $gte, $lt, $lte, $exists, $type and top-level $or filters,
+# $set updates with upsert, unique (and partial unique) indexes,
+# projections, sort and limit. Data lives as long as the process.
+
+_BSON_TYPES = {"string": str}
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, arg in condition.items():
+            if op == "$in":
+                if value not in arg:
+                    return False
+            elif op == "$ne":
+                if value == arg:
+                    return False
+            elif op == "$gt":
+                if value is None or not value > arg:
+                    return False
+            elif op == "$lt":
+                if value is None or not value < arg:
+                    return False
+            elif op == "$gte":
+                if value is None or not value >= arg:
+                    return False
+            elif op == "$lte":
+                if value is None or not value <= arg:
+                    return False
+            elif op == "$exists":
+                if (value is not _MISSING) != bool(arg):
+                    return False
+            elif op == "$type":
+                if arg not in _BSON_TYPES:
+                    raise NotImplementedError(f"Unsupported $type {arg}")
+                if not isinstance(value, _BSON_TYPES[arg]):
+                    return False
+            else:
+                raise NotImplementedError(f"Unsupported query operator {op}")
+        return True
+    return value == condition
+
+
+_MISSING = object()
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, clause) for clause in condition):
+                return False
+            continue
+        value = doc.get(key, _MISSING)
+        if isinstance(condition, dict) and "$exists" in condition:
+            if not _matches_condition(value, condition):
+                return False
+            continue
+        if not _matches_condition(None if value is _MISSING else value, condition):
+            return False
+    return True
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    if included:
+        keep = set(included)
+        if projection.get("_id", 1):
+            keep.add("_id")
+        return {k: v for k, v in doc.items() if k in keep}
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _sort_spec(key_or_list, direction=None) -> list[tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    return list(key_or_list)
+
+
+def _sorted(docs: list[dict], spec: list[tuple[str, int]]) -> list[dict]:
+    # Stable sorts, least significant key first; missing/None sorts lowest
+    for key, direction in reversed(spec):
+        docs = sorted(
+            docs,
+            key=lambda d: (d.get(key) is not None, d.get(key) if d.get(key) is not None else 0),
+            reverse=direction == DESCENDING
+        )
+    return docs
+
+
+class MemoryCursor:
+    """
+    Result of MemoryCollection.find: sort/limit chain like a pymongo cursor.
+    """
+
+    def __init__(self, collection: "MemoryCollection", query: dict, projection: dict | None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int) -> "MemoryCursor":
+        self._limit = limit
+        return self
+
+    def _results(self) -> list[dict]:
+        with self._collection.lock:
+            docs = [d for d in self._collection.docs if _matches(d, self._query)]
+            if self._sort:
+                docs = _sorted(docs, self._sort)
+            if self._limit:
+                docs = docs[:self._limit]
+            return [_project(d, self._projection) for d in docs]
+
+    def __iter__(self):
+        self._collection.round_trip()
+        return iter(self._results())
+
+
+class MemoryCollection:
+    """
+    A list of documents behind a lock, with pymongo's method names.
+    """
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.docs = []
+        self.unique = []  # (field names, partial filter or None)
+        self.ids = set()
+        self.lock = threading.RLock()
+
+    def round_trip(self) -> None:
+        # Emulated network latency, for benchmarks
+        if self.latency:
+            time.sleep(self.latency)
+
+    def create_index(self, keys, unique: bool = False, partialFilterExpression: dict | None = None, **kwargs) -> str:
+        fields = tuple(k for k, _ in _sort_spec(keys))
+        if unique and (fields, partialFilterExpression) not in self.unique:
+            self.unique.append((fields, partialFilterExpression))
+        return "_".join(fields)
+
+    def _check_unique(self, doc: dict, ignore: dict | None = None) -> None:
+        if ignore is None and doc["_id"] in self.ids:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} _id")
+        for fields, partial in self.unique:
+            # A partial index only holds the documents matching its filter
+            if partial is not None and not _matches(doc, partial):
+                continue
+            key = tuple(doc.get(f) for f in fields)
+            for other in self.docs:
+                if other is ignore or (partial is not None and not _matches(other, partial)):
+                    continue
+                if tuple(other.get(f) for f in fields) == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} {fields}")
+
+    def _insert(self, document: dict) -> ObjectId:
+        # pymongo adds _id to the caller's dict; so do we
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        self.docs.append(copy.deepcopy(document))
+        self.ids.add(document["_id"])
+        return document["_id"]
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool) -> UpdateResult:
+        unsupported = set(update) - {"$set"}
+        if unsupported:
+            raise NotImplementedError(f"Unsupported update operators {unsupported}")
+        fields = update.get("$set", {})
+
+        matched = [d for d in self.docs if _matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            updated = {**doc, **copy.deepcopy(fields)}
+            self._check_unique(updated, ignore=doc)
+            doc.update(updated)
+
+        upserted_id = None
+        if not matched and upsert:
+            seed = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            upserted_id = self._insert({**seed, **copy.deepcopy(fields)})
+        return UpdateResult(
+            {"n": len(matched) or int(upserted_id is not None), "nModified": len(matched), "upserted": upserted_id},
+            True
+        )
+
+    def _delete(self, query: dict, many: bool) -> DeleteResult:
+        matched = [d for d in self.docs if _matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        ids = {id(d) for d in matched}
+        self.docs = [d for d in self.docs if id(d) not in ids]
+        self.ids.difference_update(d["_id"] for d in matched)
+        return DeleteResult({"n": len(matched)}, True)
+
+    def find(self, filter: dict | None = None, projection: dict | None = None) -> MemoryCursor:
+        return MemoryCursor(self, filter or {}, projection)
+
+    def find_one(self, filter: dict | None = None, projection: dict | None = None, sort=None) -> dict | None:
+        cursor = self.find(filter, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        return next(iter(cursor), None)
+
+    def run(self, op: str, *args, **kwargs):
+        """
+        One operation under the lock, without the emulated round trip.
+        """
+        with self.lock:
+            return getattr(self, "_" + op)(*args, **kwargs)
+
+    def _insert_one(self, document: dict) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    def _insert_many(self, documents: list[dict], ordered: bool = True) -> InsertManyResult:
+        ids, errors = [], []
+        for i, document in enumerate(documents):
+            try:
+                ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": i, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors,
+                "writeConcernErrors": [],
+                "nInserted": len(ids),
+                "nUpserted": 0,
+                "nMatched": 0,
+                "nModified": 0,
+                "nRemoved": 0,
+                "upserted": []
+            })
+        return InsertManyResult(ids, True)
+
+    def _update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return self._update(filter, update, upsert, many=False)
+
+    def _update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return self._update(filter, update, upsert, many=True)
+
+    def _delete_one(self, filter: dict) -> DeleteResult:
+        return self._delete(filter, many=False)
+
+    def _delete_many(self, filter: dict) -> DeleteResult:
+        return self._delete(filter, many=True)
+
+    def _bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "nUpserted": 0, "upserted": []}
+        for request in requests:
+            kind = type(request).__name__
+            # pymongo keeps the operation's arguments in private slots
+            if kind in ("UpdateOne", "UpdateMany"):
+                result = self._update(request._filter, request._doc, bool(request._upsert), kind == "UpdateMany")
+                counts["nMatched"] += result.matched_count
+                counts["nModified"] += result.modified_count
+                counts["nUpserted"] += int(result.upserted_id is not None)
+            elif kind == "InsertOne":
+                self._insert(request._doc)
+                counts["nInserted"] += 1
+            elif kind in ("DeleteOne", "DeleteMany"):
+                counts["nRemoved"] += self._delete(request._filter, kind == "DeleteMany").deleted_count
+            else:
+                raise NotImplementedError(f"Unsupported bulk operation {kind}")
+        return BulkWriteResult(counts, True)
+
+    def _count_documents(self, filter: dict) -> int:
+        return sum(1 for d in self.docs if _matches(d, filter))
+
+    # pymongo's synchronous API: one emulated round trip per call
+
+    def insert_one(self, document: dict) -> InsertOneResult:
+        self.round_trip()
+        return self.run("insert_one", document)
+
+    def insert_many(self, documents: list[dict], ordered: bool = True) -> InsertManyResult:
+        self.round_trip()
+        return self.run("insert_many", documents, ordered)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        self.round_trip()
+        return self.run("update_one", filter, update, upsert)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        self.round_trip()
+        return self.run("update_many", filter, update, upsert)
+
+    def delete_one(self, filter: dict) -> DeleteResult:
+        self.round_trip()
+        return self.run("delete_one", filter)
+
+    def delete_many(self, filter: dict) -> DeleteResult:
+        self.round_trip()
+        return self.run("delete_many", filter)
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        self.round_trip()
+        return self.run("bulk_write", requests, ordered)
+
+    def count_documents(self, filter: dict) -> int:
+        self.round_trip()
+        return self.run("count_documents", filter)
+
+
+class MemoryDatabase:
+    """
+    Collections by name, created on first use.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(name, self.latency)
+            return self._collections[name]
+
+    def command(self, name: str) -> dict:
+        return {"ok": 1.0}
+
+
+# ----------------------------
+# Async facade
+# ----------------------------
+# Same data as the sync collections (one store per process); every call
+# still runs inline, only the emulated latency is awaited instead of slept.
+
+class AsyncMemoryCursor:
+    def __init__(self, cursor: MemoryCursor):
+        self._cursor = cursor
+
+    def sort(self, key_or_list, direction=None) -> "AsyncMemoryCursor":
+        self._cursor.sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int) -> "AsyncMemoryCursor":
+        self._cursor.limit(limit)
+        return self
+
+    async def to_list(self, length: int | None = None) -> list[dict]:
+        latency = self._cursor._collection.latency
+        if latency:
+            await asyncio.sleep(latency)
+        results = self._cursor._results()
+        return results[:length] if length else results
+
+    async def __aiter__(self):
+        for doc in await self.to_list():
+            yield doc
+
+
+class AsyncMemoryCollection:
+    def __init__(self, collection: MemoryCollection):
+        self._collection = collection
+
+    async def _call(self, op: str, *args, **kwargs):
+        if self._collection.latency:
+            await asyncio.sleep(self._collection.latency)
+        return self._collection.run(op, *args, **kwargs)
+
+    def find(self, filter: dict | None = None, projection: dict | None = None) -> AsyncMemoryCursor:
+        return AsyncMemoryCursor(self._collection.find(filter, projection))
+
+    async def find_one(self, filter: dict | None = None, projection: dict | None = None, sort=None) -> dict | None:
+        cursor = self.find(filter, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        found = await cursor.to_list()
+        return found[0] if found else None
+
+    async def create_index(self, keys, unique: bool = False, **kwargs) -> str:
+        return self._collection.create_index(keys, unique=unique, **kwargs)
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        return await self._call("insert_one", document)
+
+    async def insert_many(self, documents: list[dict], ordered: bool = True) -> InsertManyResult:
+        return await self._call("insert_many", documents, ordered=ordered)
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return await self._call("update_one", filter, update, upsert=upsert)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        return await self._call("update_many", filter, update, upsert=upsert)
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        return await self._call("delete_one", filter)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        return await self._call("delete_many", filter)
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        return await self._call("bulk_write", requests, ordered=ordered)
+
+    async def count_documents(self, filter: dict) -> int:
+        return await self._call("count_documents", filter)
+
+
+class AsyncMemoryDatabase:
+    def __init__(self, database: MemoryDatabase):
+        self._database = database
+
+    def __getitem__(self, name: str) -> AsyncMemoryCollection:
+        return AsyncMemoryCollection(self._database[name])
+
+    async def command(self, name: str) -> dict:
+        return self._database.command(name)
+
+
+_database = None
+_database_lock = threading.Lock()
+
+
+def memory_database(latency_ms: float = 0.0) -> MemoryDatabase:
+    """
+    The process-wide in-memory database (created on first call).
+    """
+    global _database
+    with _database_lock:
+        if _database is None:
+            _database = MemoryDatabase(latency_ms / 1000)
+        return _database
@@ -2,7 +2,9 @@ import os
 import uuid
 from datetime import datetime
 from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import certifi
+from db.memory import memory_database
 from dotenv import load_dotenv
 
 
@@ -12,15 +14,48 @@ load_dotenv()
 
 MONGO_URI = os.getenv("MONGODB_URI")
 DB_NAME = os.getenv("MONGODB_DB_NAME", "DOCTALK")
-
-if not MONGO_URI:
+# mongo | memory (in-process collections, no server: local runs and benchmarks)
+DB_BACKEND = os.getenv("DB_BACKEND", "mongo").lower()
+# Connection pool, per client (this module's sync client and db/async_mongo.py's)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+# Emulated round trip of the memory backend, for benchmarks
+MEMORY_DB_LATENCY_MS = float(os.getenv("MEMORY_DB_LATENCY_MS", "0"))
+
+if DB_BACKEND not in ("mongo", "memory"):
+    raise ValueError(f"Unknown DB_BACKEND {DB_BACKEND!r} (expected mongo or memory)")
+
+if DB_BACKEND == "mongo" and not MONGO_URI:
     raise ValueError("MONGODB_URI not set in environment variables")
 
 
+def client_options() -> dict:
+    """
+    Keyword arguments shared by the sync and async MongoDB clients.
+    0 leaves a timeout at the driver default (none).
+    """
+    options = {
+        "tlsCAFile": certifi.where(),
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = MONGO_MAX_IDLE_TIME_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+
 # MongoDB Connection
 
-client = MongoClient(MONGO_URI, tlsCAFile=certifi.where())
-db = client[DB_NAME]
+if DB_BACKEND == "memory":
+    client = None
+    db = memory_database(MEMORY_DB_LATENCY_MS)
+else:
+    client = MongoClient(MONGO_URI, **client_options())
+    db = client[DB_NAME]
 
 
 # Collections
@@ -29,6 +64,7 @@ users_col = db["users"]
 documents_col = db["documents"]
 chunks_col = db["chunks"]
 chat_history_col = db["chat_history"]
+chat_summaries_col = db["chat_summaries"]
 
 
 # Database & Index Initialization
@@ -42,17 +78,35 @@ def init_db():
 
     documents_col.create_index([("user_id", ASCENDING)])
     documents_col.create_index([("file_id", ASCENDING)], unique=True)
+    documents_col.create_index([("job_id", ASCENDING)])
+    documents_col.create_index([
+        ("user_id", ASCENDING),
+        ("content_hash", ASCENDING)
+    ])
+    # At most one live document per file content: concurrent uploads of the
+    # same file race on this instead of both passing a lookup
+    documents_col.create_index(
+        [("user_id", ASCENDING), ("live_hash", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"live_hash": {"$type": "string"}}
+    )
 
     chunks_col.create_index([
         ("user_id", ASCENDING),
         ("faiss_index_id", ASCENDING)
     ])
+    chunks_col.create_index([
+        ("user_id", ASCENDING),
+        ("text_hash", ASCENDING)
+    ])
 
     chat_history_col.create_index([
         ("user_id", ASCENDING),
         ("timestamp", DESCENDING)
     ])
 
+    chat_summaries_col.create_index([("user_id", ASCENDING)], unique=True)
+
 
 # USER OPERATIONS
 
@@ -86,28 +140,166 @@ def get_user_by_id(user_id: str) -> dict | None:
 
 # DOCUMENT OPERATIONS
 
-def insert_document(
+# Statuses of a document whose ingestion job has not finished
+IN_PROGRESS_STATUSES = ["queued", "parsing", "embedding"]
+
+
+def _document_record(
     user_id: str,
     filename: str,
     file_type: str,
-    num_pages: int
+    num_pages: int,
+    status: str,
+    job_id: str | None,
+    content_hash: str | None,
+    file_path: str | None = None
 ) -> dict:
-    """
-    Insert document metadata.
-    """
-    document = {
+    now = datetime.utcnow()
+    return {
         "file_id": str(uuid.uuid4()),
         "user_id": user_id,
         "filename": filename,
         "file_type": file_type,
         "num_pages": num_pages,
-        "uploaded_at": datetime.utcnow(),
-        "status": "indexed"
+        "uploaded_at": now,
+        "updated_at": now,
+        "status": status,
+        "progress": 100 if status == "indexed" else 0,
+        "job_id": job_id,
+        "content_hash": content_hash,
+        "file_path": file_path,
+        # Cleared when the document fails: only live documents claim their content
+        "live_hash": None if status == "failed" else content_hash
     }
+
+
+def insert_document(
+    user_id: str,
+    filename: str,
+    file_type: str,
+    num_pages: int,
+    status: str = "indexed",
+    job_id: str | None = None,
+    content_hash: str | None = None,
+    file_path: str | None = None
+) -> dict:
+    """
+    Insert document metadata.
+    status: queued | parsing | embedding | indexed | failed
+    file_path: the uploaded file, removed with the document
+    """
+    document = _document_record(
+        user_id, filename, file_type, num_pages, status, job_id, content_hash, file_path
+    )
     documents_col.insert_one(document)
+    document.pop("_id", None)
     return document
 
 
+def update_document_status(
+    file_id: str,
+    status: str,
+    progress: int | None = None,
+    **fields
+) -> None:
+    """
+    Record ingestion state for a document.
+    Extra keyword fields (num_pages, error, ingest, ...) are stored as-is.
+    """
+    update = {"status": status, "updated_at": datetime.utcnow(), **fields}
+    if status == "failed":
+        update["live_hash"] = None
+    if progress is not None:
+        update["progress"] = progress
+    documents_col.update_one({"file_id": file_id}, {"$set": update})
+
+
+def touch_documents(file_ids: list[str]) -> None:
+    """
+    Heartbeat for documents whose ingestion job is queued or running here.
+    """
+    if not file_ids:
+        return
+    documents_col.update_many(
+        {"file_id": {"$in": list(file_ids)}, "status": {"$in": IN_PROGRESS_STATUSES}},
+        {"$set": {"updated_at": datetime.utcnow()}}
+    )
+
+
+def _stale_query(stale_before: datetime) -> dict:
+    # Unfinished and not heard from since stale_before: its job died
+    return {
+        "status": {"$in": IN_PROGRESS_STATUSES},
+        "$or": [
+            {"updated_at": {"$lt": stale_before}},
+            {"updated_at": {"$exists": False}}
+        ]
+    }
+
+
+def _failed_update(error: str) -> dict:
+    return {"$set": {"status": "failed", "error": error, "live_hash": None, "updated_at": datetime.utcnow()}}
+
+
+def fail_documents(file_ids: list[str], error: str) -> None:
+    """
+    Mark unfinished documents as failed.
+    """
+    if not file_ids:
+        return
+    documents_col.update_many(
+        {"file_id": {"$in": list(file_ids)}, "status": {"$in": IN_PROGRESS_STATUSES}},
+        _failed_update(error)
+    )
+
+
+def fail_stale_documents(stale_before: datetime, error: str) -> int:
+    """
+    Mark unfinished documents not heard from since stale_before as failed:
+    their job died with its process. Returns how many.
+    """
+    result = documents_col.update_many(_stale_query(stale_before), _failed_update(error))
+    return result.modified_count
+
+
+def _live_hash_query(user_id: str, content_hash: str, stale_before: datetime | None) -> dict:
+    # Indexed, or still being ingested by a live job
+    in_progress = {"status": {"$in": IN_PROGRESS_STATUSES}}
+    if stale_before is not None:
+        in_progress["updated_at"] = {"$gte": stale_before}
+    return {
+        "user_id": user_id,
+        "content_hash": content_hash,
+        "$or": [{"status": "indexed"}, in_progress]
+    }
+
+
+def get_document_by_job_id(user_id: str, job_id: str) -> dict | None:
+    """
+    Fetch the document created by an ingestion job.
+    """
+    return documents_col.find_one(
+        {"user_id": user_id, "job_id": job_id},
+        {"_id": 0}
+    )
+
+
+def get_document_by_hash(
+    user_id: str,
+    content_hash: str,
+    stale_before: datetime | None = None
+) -> dict | None:
+    """
+    Fetch a user's live document with identical file content: indexed, or
+    in progress and heard from since stale_before (not left behind by a
+    process that died).
+    """
+    return documents_col.find_one(
+        _live_hash_query(user_id, content_hash, stale_before),
+        {"_id": 0}
+    )
+
+
 def get_user_documents(user_id: str) -> list:
     """
     Get all documents uploaded by a user.
@@ -118,6 +310,19 @@ def get_user_documents(user_id: str) -> list:
     ))
 
 
+def get_documents_status(user_id: str, file_ids: list[str]) -> dict[str, str]:
+    """
+    file_id -> status for those of file_ids the user owns.
+    """
+    return {
+        d["file_id"]: d["status"]
+        for d in documents_col.find(
+            {"user_id": user_id, "file_id": {"$in": list(file_ids)}},
+            {"_id": 0, "file_id": 1, "status": 1}
+        )
+    }
+
+
 def get_document_by_id(user_id: str, file_id: str) -> dict | None:
     """
     Fetch a single document.
@@ -138,29 +343,62 @@ def delete_document(user_id: str, file_id: str) -> None:
 
 
 
-# CHUNK OPERATIONS (METADATA ONLY)
+# CHUNK OPERATIONS (METADATA + FULL TEXT)
 
-def insert_chunk(
+def _chunk_record(
     user_id: str,
     file_id: str,
+    filename: str,
     page_number: int,
-    text_preview: str,
-    faiss_index_id: int
-) -> str:
-    """
-    Insert chunk metadata.
-    """
-    chunk_id = str(uuid.uuid4())
-    chunk = {
-        "chunk_id": chunk_id,
+    text: str,
+    faiss_index_id: int,
+    text_hash: str | None = None,
+    archive_generation: int = 0
+) -> dict:
+    return {
+        "chunk_id": str(uuid.uuid4()),
         "user_id": user_id,
         "file_id": file_id,
+        "filename": filename,
         "page_number": page_number,
-        "text_preview": text_preview[:200],
-        "faiss_index_id": faiss_index_id
+        "text_preview": text[:200],
+        "text": text,
+        "text_hash": text_hash,
+        "faiss_index_id": faiss_index_id,
+        # Vector archive generation faiss_index_id refers to (rag/vector_archive.py)
+        "archive_generation": archive_generation
     }
-    chunks_col.insert_one(chunk)
-    return chunk_id
+
+
+def insert_chunks(
+    user_id: str,
+    file_id: str,
+    filename: str,
+    chunks: list[dict],
+    archive_generation: int = 0
+) -> int:
+    """
+    Bulk insert chunk metadata in a single round trip.
+    chunks = [{"page_number": int, "text": str, "faiss_index_id": int, "text_hash": str}]
+    """
+    if not chunks:
+        return 0
+
+    records = [
+        _chunk_record(
+            user_id,
+            file_id,
+            filename,
+            c["page_number"],
+            c["text"],
+            c["faiss_index_id"],
+            c.get("text_hash"),
+            archive_generation
+        )
+        for c in chunks
+    ]
+    chunks_col.insert_many(records, ordered=False)
+    return len(records)
 
 
 def get_chunks_by_faiss_ids(user_id: str, faiss_ids: list[int]) -> list:
@@ -176,6 +414,72 @@ def get_chunks_by_faiss_ids(user_id: str, faiss_ids: list[int]) -> list:
     ))
 
 
+def get_faiss_ids_by_file(user_id: str, file_id: str) -> list[int]:
+    """
+    FAISS ids of all chunks belonging to a document.
+    """
+    return [
+        c["faiss_index_id"]
+        for c in chunks_col.find(
+            {"user_id": user_id, "file_id": file_id},
+            {"_id": 0, "faiss_index_id": 1}
+        )
+    ]
+
+
+def get_faiss_ids_by_user_files(user_id: str) -> dict[str, list[int]]:
+    """
+    FAISS ids of every document's chunks, by file_id.
+    A vector shared by deduplicated chunks is listed under each document.
+    """
+    ids_by_file = {}
+    for c in chunks_col.find(
+        {"user_id": user_id},
+        {"_id": 0, "file_id": 1, "faiss_index_id": 1}
+    ):
+        ids_by_file.setdefault(c["file_id"], []).append(c["faiss_index_id"])
+    return ids_by_file
+
+
+def get_faiss_ids_by_text_hash(user_id: str, text_hashes: list[str]) -> dict[str, int]:
+    """
+    Map chunk text hashes already indexed for a user to their FAISS id.
+    """
+    return {
+        c["text_hash"]: c["faiss_index_id"]
+        for c in chunks_col.find(
+            {"user_id": user_id, "text_hash": {"$in": list(text_hashes)}},
+            {"_id": 0, "text_hash": 1, "faiss_index_id": 1}
+        )
+    }
+
+
+def get_chunk_owners(user_id: str, faiss_ids: list[int]) -> dict[int, dict]:
+    """
+    For each FAISS id still referenced by a chunk, one chunk that references it.
+    Deduplicated chunks of different documents share one vector.
+    """
+    return {
+        c["faiss_index_id"]: c
+        for c in chunks_col.find(
+            {"user_id": user_id, "faiss_index_id": {"$in": list(faiss_ids)}},
+            {"_id": 0, "faiss_index_id": 1, "file_id": 1, "filename": 1, "page_number": 1}
+        )
+    }
+
+
+def get_max_faiss_id(user_id: str) -> int:
+    """
+    Highest FAISS id recorded for a user (-1 if none).
+    """
+    chunk = chunks_col.find_one(
+        {"user_id": user_id},
+        {"_id": 0, "faiss_index_id": 1},
+        sort=[("faiss_index_id", DESCENDING)]
+    )
+    return chunk["faiss_index_id"] if chunk else -1
+
+
 def delete_chunks_by_file(user_id: str, file_id: str) -> None:
     """
     Delete all chunks for a document.
@@ -188,6 +492,22 @@ def delete_chunks_by_file(user_id: str, file_id: str) -> None:
 
 # CHAT HISTORY OPERATIONS
 
+def _chat_record(
+    user_id: str,
+    question: str,
+    answer: str,
+    sources: list,
+    timestamp: datetime | None = None
+) -> dict:
+    return {
+        "user_id": user_id,
+        "question": question,
+        "answer": answer,
+        "sources": sources,
+        "timestamp": timestamp or datetime.utcnow()
+    }
+
+
 def save_chat(
     user_id: str,
     question: str,
@@ -197,31 +517,101 @@ def save_chat(
     """
     Save chat interaction.
     """
-    chat = {
-        "user_id": user_id,
-        "question": question,
-        "answer": answer,
-        "sources": sources,
-        "timestamp": datetime.utcnow()
-    }
-    chat_history_col.insert_one(chat)
+    chat_history_col.insert_one(_chat_record(user_id, question, answer, sources))
+
+
+def insert_chat_records(records: list[dict]) -> int:
+    """
+    Bulk insert prebuilt chat records (see _chat_record) that carry their own _id.
+    Records already stored by an earlier, partly failed attempt are skipped.
+    Returns how many were new.
+    """
+    if not records:
+        return 0
 
+    try:
+        chat_history_col.insert_many(records, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if e.details.get("writeConcernErrors") or any(err["code"] != 11000 for err in errors):
+            raise
+        return len(records) - len(errors)
+    return len(records)
 
-def get_chat_history(user_id: str, limit: int = 20) -> list:
+
+def get_chat_history_after(user_id: str, after: datetime | None, limit: int = 20) -> list:
     """
-    Get recent chat history.
+    Get recent chat history newer than `after` (newest first).
     """
+    query = {"user_id": user_id}
+    if after is not None:
+        query["timestamp"] = {"$gt": after}
+
     return list(chat_history_col.find(
-        {"user_id": user_id},
+        query,
         {"_id": 0}
     ).sort("timestamp", DESCENDING).limit(limit))
 
 
+def get_oldest_chat_history(
+    user_id: str,
+    after: datetime | None,
+    before: datetime,
+    limit: int = 20
+) -> list:
+    """
+    Get the oldest chat turns newer than `after` and older than `before`
+    (oldest first).
+    """
+    timestamp = {"$lt": before}
+    if after is not None:
+        timestamp["$gt"] = after
+
+    return list(chat_history_col.find(
+        {"user_id": user_id, "timestamp": timestamp},
+        {"_id": 0}
+    ).sort("timestamp", ASCENDING).limit(limit))
+
+
+def get_chat_summary(user_id: str) -> dict | None:
+    """
+    Rolling summary of the turns up to covered_until.
+    """
+    return chat_summaries_col.find_one({"user_id": user_id}, {"_id": 0})
+
+
+def save_chat_summary(user_id: str, summary: str, covered_until: datetime) -> None:
+    """
+    Upsert the user's rolling summary.
+    Never moves covered_until backwards (two folds racing).
+    """
+    try:
+        chat_summaries_col.update_one(
+            {
+                "user_id": user_id,
+                "$or": [
+                    {"covered_until": {"$lt": covered_until}},
+                    {"covered_until": {"$exists": False}}
+                ]
+            },
+            {"$set": {
+                "summary": summary,
+                "covered_until": covered_until,
+                "updated_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A newer summary is already stored
+        pass
+
+
 def delete_chat_history(user_id: str) -> None:
     """
     Delete user's chat history.
     """
     chat_history_col.delete_many({"user_id": user_id})
+    chat_summaries_col.delete_many({"user_id": user_id})
 
 
 
@@ -234,6 +624,7 @@ def delete_user_data(user_id: str) -> None:
     documents_col.delete_many({"user_id": user_id})
     chunks_col.delete_many({"user_id": user_id})
     chat_history_col.delete_many({"user_id": user_id})
+    chat_summaries_col.delete_many({"user_id": user_id})
     users_col.delete_one({"user_id": user_id})
 
 
@@ -244,6 +635,8 @@ def ping_db() -> bool:
     """
     Check database connection.
     """
+    if client is None:
+        return True
     try:
         client.admin.command("ping")
         return True
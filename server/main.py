@@ -4,15 +4,28 @@ from middleware.cors import add_cors_middleware
 from middleware.logging import logging_middleware
 from middleware.timing import timing_middleware
 from middleware.error_handler import error_handling_middleware
+from middleware.upload_limit import add_upload_limit_middleware
 
 from api.documents import router as documents_router
 from api.query import router as query_router
+from rag.embeddings import start_embedding_warmup, get_embedding_status
+from rag.vectorstore import get_vectorstore_cache_stats
+from rag.ingest_jobs import ingest_queue
+from rag.loaders import shutdown_extract_pool
+from rag.answer_cache import answer_cache
+from rag.single_flight import query_flights, stream_flights
+from rag.llm import llm_pool
+from db.mongo import init_db
+from db.async_mongo import close_client
+from db.chat_writer import chat_writer
 
 app = FastAPI(title="DocTalk API")
 
 # ----------------------------
 # Middleware registration
 # ----------------------------
+# Registered before CORS so CORS wraps (and headers) its 413 responses
+add_upload_limit_middleware(app)
 add_cors_middleware(app)
 
 app.middleware("http")(error_handling_middleware)
@@ -29,15 +42,57 @@ app.include_router(auth_router)
 app.include_router(documents_router)
 app.include_router(query_router)
 
+# ----------------------------
+# Startup
+# ----------------------------
+@app.on_event("startup")
+def create_indexes():
+    # Unique indexes back upload dedup and the chat summary upsert
+    init_db()
+
+
+@app.on_event("startup")
+def warm_up_models():
+    # Load the shared embedding model once, off the request path
+    start_embedding_warmup()
+    # Fail uploads a previous process left unfinished, heartbeat ours
+    ingest_queue.start()
+
+
+@app.on_event("shutdown")
+def stop_ingest_workers():
+    ingest_queue.shutdown()
+    # Store buffered chat turns before the process exits
+    chat_writer.shutdown()
+    shutdown_extract_pool()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    await close_client()
+
 # ----------------------------
 # Health check
 # ----------------------------
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "embedding_model": get_embedding_status(),
+        "vectorstore_cache": get_vectorstore_cache_stats(),
+        "answer_cache": answer_cache.stats(),
+        "query_flights": query_flights.stats(),
+        "stream_flights": stream_flights.stats(),
+        "llm_pool": llm_pool.stats(),
+        "chat_writer": chat_writer.stats()
+    }
 
-# this is the api flow for reindexing 
+# this is the api flow for deleting a document
+# get_document_by_id(user_id, file_id) -> 404 if missing
+# get_faiss_ids_by_file(user_id, file_id)
 # delete_document(user_id, file_id)
 # delete_chunks_by_file(user_id, file_id)
-# rebuild_user_index(user_id)
+# delete_document_vectors(user_id, file_id, faiss_ids) -> hides the vectors, no index rewrite
+# remove the uploaded file
+# full rebuild only via POST /documents/compact
 
@@ -0,0 +1,53 @@
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from api.upload import MAX_UPLOAD_BYTES
+
+# Room for multipart boundaries and headers around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+UPLOAD_PATH = "/documents/upload"
+
+
+def _too_large_detail() -> str:
+    return f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+
+
+class UploadLimitMiddleware:
+    """
+    Caps the upload request body. A Content-Length over the limit is
+    rejected before anything is read; otherwise (chunked uploads) the
+    bytes are counted as they arrive and the request fails with 413 the
+    moment it goes over, while the form parser is still spooling it.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != UPLOAD_PATH:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length", b"").decode("latin-1")
+        if content_length.isdigit() and int(content_length) > self.max_body_bytes:
+            response = JSONResponse(status_code=413, content={"detail": _too_large_detail()})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    # FastAPI re-raises HTTPExceptions from body parsing as is
+                    raise HTTPException(status_code=413, detail=_too_large_detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def add_upload_limit_middleware(app):
+    app.add_middleware(UploadLimitMiddleware)
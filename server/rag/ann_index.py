@@ -0,0 +1,290 @@
+import os
+import math
+import logging
+import numpy as np
+import faiss
+from rag.vector_archive import load_vectors
+from dotenv import load_dotenv
+
+load_dotenv()
+ANN_FLAT_MAX = int(os.getenv("ANN_FLAT_MAX", "20000"))
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "ivf").lower()        # ivf | hnsw
+ANN_COMPRESSION = os.getenv("ANN_COMPRESSION", "none").lower()     # none | sq8 | pq
+ANN_IVF_NPROBE = int(os.getenv("ANN_IVF_NPROBE", "16"))
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+ANN_HNSW_EF_CONSTRUCTION = int(os.getenv("ANN_HNSW_EF_CONSTRUCTION", "80"))
+
+# IVF training sample per centroid (FAISS wants roughly 30-256);
+# PQ / SQ codebooks need ~40 points per code (256 codes)
+TRAIN_POINTS_PER_LIST = 64
+TRAIN_MIN_POINTS = 10000
+# Below these, training fails (or FAISS warns the clustering is meaningless):
+# k-means wants 39 points per list, an 8-bit codebook one point per code
+MIN_POINTS_PER_LIST = 39
+MIN_IVF_LISTS = 16
+CODEBOOK_POINTS = 256
+
+logger = logging.getLogger(__name__)
+
+# How each index family stores vectors:
+#   flat  exact search; langchain's FAISS.delete works (ids are compacted)
+#   ivf   remove_ids is native, labels are renumbered afterwards
+#   hnsw  no removal: rebuilt from the vector archive on delete (prefer ivf
+#         if users delete often)
+
+
+def index_kind(index) -> str:
+    # index_factory / read_index / clone_index already return the concrete type
+    name = type(index).__name__
+    if name.startswith("IndexIVF"):
+        return "ivf"
+    if name.startswith("IndexHNSW"):
+        return "hnsw"
+    return "flat"
+
+
+def ivf_nlist(ntotal: int) -> int:
+    # ~4 sqrt(n) lists, but never fewer than MIN_POINTS_PER_LIST points each
+    return max(MIN_IVF_LISTS, min(65536, int(4 * math.sqrt(ntotal)), ntotal // MIN_POINTS_PER_LIST))
+
+
+def min_ann_vectors(index_type: str = ANN_INDEX_TYPE, compression: str = ANN_COMPRESSION) -> int:
+    """
+    Smallest library an ANN index of this type can be trained on.
+    """
+    needed = MIN_IVF_LISTS * MIN_POINTS_PER_LIST if index_type == "ivf" else 0
+    if compression != "none":
+        needed = max(needed, CODEBOOK_POINTS)
+    return needed
+
+
+if ANN_INDEX_TYPE not in ("ivf", "hnsw"):
+    raise ValueError(f"Unknown ANN_INDEX_TYPE {ANN_INDEX_TYPE!r} (expected ivf or hnsw)")
+if ANN_COMPRESSION not in ("none", "sq8", "pq"):
+    raise ValueError(f"Unknown ANN_COMPRESSION {ANN_COMPRESSION!r} (expected none, sq8 or pq)")
+if ANN_FLAT_MAX < min_ann_vectors():
+    raise ValueError(
+        f"ANN_FLAT_MAX={ANN_FLAT_MAX} is too small to train a {ANN_INDEX_TYPE}/{ANN_COMPRESSION} "
+        f"index (needs at least {min_ann_vectors()} vectors)"
+    )
+
+
+def _pq_subquantizers(d: int) -> int:
+    # About 4 dimensions per 8-bit code, and m must divide d
+    for m in range(max(1, d // 4), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def index_spec(ntotal: int, d: int, index_type: str = ANN_INDEX_TYPE,
+               compression: str = ANN_COMPRESSION) -> str:
+    """
+    FAISS factory string for a library of ntotal vectors.
+    """
+    if ntotal < max(ANN_FLAT_MAX, min_ann_vectors(index_type, compression)):
+        return "Flat"
+
+    codec = {
+        "none": "Flat",
+        "sq8": "SQ8",
+        "pq": f"PQ{_pq_subquantizers(d)}"
+    }[compression]
+
+    if index_type == "hnsw":
+        return f"HNSW{ANN_HNSW_M}" if codec == "Flat" else f"HNSW{ANN_HNSW_M}_{codec}"
+    return f"IVF{ivf_nlist(ntotal)},{codec}"
+
+
+def configure_index(index):
+    """
+    Apply search-time parameters (and the IVF direct map, which
+    reconstruct() needs) to a freshly built or loaded index.
+    """
+    kind = index_kind(index)
+    if kind == "ivf":
+        index.nprobe = ANN_IVF_NPROBE
+        if index.direct_map.type == faiss.DirectMap.NoMap:
+            index.make_direct_map(True)
+    elif kind == "hnsw":
+        index.hnsw.efSearch = ANN_HNSW_EF_SEARCH
+    return index
+
+
+def search_params(index, selector, selectivity: float = 1.0):
+    """
+    SearchParameters restricting a search to selector's ids, carrying the
+    index's own nprobe / efSearch (per-call parameters replace them).
+    HNSW gets a larger beam for selective filters: most neighbours it walks
+    are filtered out.
+    """
+    kind = index_kind(index)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if kind == "hnsw":
+        ef = index.hnsw.efSearch
+        boost = min(4.0, 1.0 / max(selectivity, 1e-6))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=int(ef * boost))
+    return faiss.SearchParameters(sel=selector)
+
+
+def build_index(vectors: np.ndarray, spec: str):
+    """
+    Build (train + add) an index from vectors, in row order.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], spec, faiss.METRIC_L2)
+    if index_kind(index) == "hnsw":
+        index.hnsw.efConstruction = ANN_HNSW_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        # Training cost grows with the sample, quality stops improving early
+        limit = TRAIN_MIN_POINTS
+        if index_kind(index) == "ivf":
+            limit = max(limit, faiss.extract_index_ivf(index).nlist * TRAIN_POINTS_PER_LIST)
+        sample = vectors
+        if len(vectors) > limit:
+            rows = np.random.default_rng(0).choice(len(vectors), limit, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+
+    index.add(vectors)
+    return configure_index(index)
+
+
+def index_bytes(index) -> int:
+    """
+    Approximate RAM held by the index.
+    """
+    kind = index_kind(index)
+    if kind == "ivf":
+        return index.ntotal * (index.code_size + 8) + index.nlist * index.d * 4
+    if kind == "hnsw":
+        links = index.ntotal * index.hnsw.nb_neighbors(0) * 4 * 1.1
+        return int(index.ntotal * index.storage.sa_code_size() + links)
+    return index.ntotal * index.d * 4
+
+
+def stored_vectors(vectorstore, user_id: str, positions: list[int]) -> np.ndarray:
+    """
+    Full-precision vectors at these FAISS positions.
+    Flat indexes hold them exactly; otherwise they come from the vector
+    archive (compressed codes would lose precision on every migration).
+    """
+    index = vectorstore.index
+    if not positions:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if index_kind(index) == "flat":
+        return np.vstack([index.reconstruct(int(p)) for p in positions])
+
+    doc_ids = [vectorstore.index_to_docstore_id[p] for p in positions]
+    archived = load_vectors(user_id, [int(i) for i in doc_ids if i.isdigit()], dim=index.d)
+    return np.vstack([
+        archived[int(doc_id)] if doc_id.isdigit() and int(doc_id) in archived
+        else index.reconstruct(int(p))  # not archived (pre-archive chunk): best effort
+        for p, doc_id in zip(positions, doc_ids)
+    ])
+
+
+def maybe_migrate(vectorstore, user_id: str) -> str | None:
+    """
+    Switch the index type when the library size calls for it.
+    Flat -> ANN at ANN_FLAT_MAX vectors, back to flat below half of that
+    (hysteresis), IVF re-trained once the library outgrows its lists 4x.
+    Positions are preserved, so index_to_docstore_id stays valid.
+    Returns the new factory spec, or None if nothing changed.
+    """
+    index = vectorstore.index
+    n, d = index.ntotal, index.d
+    kind = index_kind(index)
+    wanted = index_spec(n, d)
+    wanted_kind = "flat" if wanted == "Flat" else ANN_INDEX_TYPE
+
+    if kind == "flat":
+        migrate = wanted_kind != "flat"
+    elif n < ANN_FLAT_MAX // 2:
+        wanted, migrate = "Flat", True
+    elif n < ANN_FLAT_MAX:
+        migrate = False
+    elif kind != wanted_kind:
+        migrate = True
+    elif kind == "ivf":
+        migrate = ivf_nlist(n) >= 4 * faiss.extract_index_ivf(index).nlist
+    else:
+        migrate = False
+
+    if not migrate:
+        return None
+
+    vectors = stored_vectors(vectorstore, user_id, list(range(n)))
+    vectorstore.index = build_index(vectors, wanted)
+    logger.info(f"Index for user {user_id} migrated to {wanted} ({n} vectors)")
+    return wanted
+
+
+def _ivf_remove(index, positions: list[int]) -> None:
+    ivf = faiss.extract_index_ivf(index)
+    before = ivf.ntotal
+    ivf.make_direct_map(False)
+    ivf.remove_ids(np.asarray(positions, dtype=np.int64))
+
+    # IVF keeps the old labels; renumber them 0..n-1 like a flat index would
+    keep = np.ones(before, dtype=bool)
+    keep[positions] = False
+    relabel = np.full(before, -1, dtype=np.int64)
+    relabel[keep] = np.arange(int(keep.sum()), dtype=np.int64)
+
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            ids[:] = relabel[ids]
+    ivf.make_direct_map(True)
+
+
+def remove_vectors(vectorstore, user_id: str, doc_ids: list[str]) -> None:
+    """
+    Delete docstore ids from the index, whatever its type.
+    Remaining vectors keep their relative order (positions are compacted).
+    """
+    targets = set(doc_ids)
+    drop = sorted(p for p, doc_id in vectorstore.index_to_docstore_id.items() if doc_id in targets)
+    _remove_positions(vectorstore, user_id, drop)
+    vectorstore.docstore.delete(doc_ids)
+
+
+def purge_deleted_vectors(vectorstore, user_id: str) -> int:
+    """
+    Drop the vectors hidden by vectorstore.mark_deleted from a writable
+    copy, before it is changed and saved. Returns how many.
+    """
+    deleted = getattr(vectorstore.index_to_docstore_id, "deleted", None)
+    if deleted is None or not len(deleted):
+        return 0
+    # Already hidden in the docstore too
+    _remove_positions(vectorstore, user_id, deleted.tolist())
+    return len(deleted)
+
+
+def _remove_positions(vectorstore, user_id: str, drop: list[int]) -> None:
+    index = vectorstore.index
+    keep_mask = np.ones(index.ntotal, dtype=bool)
+    keep_mask[drop] = False
+    keep = np.flatnonzero(keep_mask).tolist()
+
+    kind = index_kind(index)
+    if kind == "flat":
+        index.remove_ids(np.asarray(drop, dtype=np.int64))
+    elif kind == "ivf":
+        _ivf_remove(index, drop)
+    else:
+        vectors = stored_vectors(vectorstore, user_id, keep)
+        rebuilt = faiss.clone_index(index)
+        rebuilt.reset()
+        rebuilt.add(vectors)
+        vectorstore.index = configure_index(rebuilt)
+
+    id_map = vectorstore.index_to_docstore_id
+    vectorstore.index_to_docstore_id = {i: id_map[p] for i, p in enumerate(keep)}
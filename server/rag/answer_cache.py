@@ -0,0 +1,153 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_PER_USER", "256"))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# Users with cached answers; the least recently active are dropped first
+ANSWER_CACHE_MAX_USERS = int(os.getenv("ANSWER_CACHE_MAX_USERS", "256"))
+
+
+def _unit(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class _UserAnswers:
+    def __init__(self, version):
+        self.version = version
+        self.vectors = []   # unit question embeddings
+        self.entries = []   # {"question", "answer", "sources", "created_at"}
+        self.matrix = None  # stacked vectors, rebuilt lazily
+
+    def drop_expired(self, cutoff: float) -> None:
+        # Entries are appended in time order: the expired ones are a prefix
+        expired = 0
+        while expired < len(self.entries) and self.entries[expired]["created_at"] < cutoff:
+            expired += 1
+        if expired:
+            del self.vectors[:expired]
+            del self.entries[:expired]
+            self.matrix = None
+
+
+class SemanticAnswerCache:
+    """
+    Per-user cache of answers keyed by question embedding.
+
+    A lookup hits when cosine similarity with a stored question is at least
+    the threshold. Every user's entries are tied to their index version
+    (rag.vectorstore.get_index_version): an upload or delete changes the
+    version, so stale answers are dropped on the next lookup.
+    A scope (the file_ids of a document-scoped query) must match as well.
+    Expired entries are dropped as the user's cache is used, and at most
+    max_users users are kept (least recently used dropped first).
+    """
+
+    def __init__(self, threshold: float, max_per_user: int, ttl_seconds: int, max_users: int):
+        self.threshold = threshold
+        self.max_per_user = max_per_user
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> _UserAnswers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, user_id: str, version, question_vector, scope=None) -> dict | None:
+        query = _unit(question_vector)
+
+        with self._lock:
+            answers = self._users.get(user_id)
+            if answers is not None:
+                answers.drop_expired(time.time() - self.ttl_seconds)
+                if answers.version != version or not answers.entries:
+                    del self._users[user_id]
+                    answers = None
+            if answers is None:
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+
+            if answers.matrix is None:
+                answers.matrix = np.vstack(answers.vectors)
+            scores = answers.matrix @ query
+            # Answers from other document scopes never match
+            scores[np.array([e["scope"] != scope for e in answers.entries])] = -1.0
+            best = int(np.argmax(scores))
+            entry = answers.entries[best]
+
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return {**entry, "similarity": round(float(scores[best]), 4)}
+
+    def store(
+        self,
+        user_id: str,
+        version,
+        question: str,
+        question_vector,
+        answer: str,
+        sources: list,
+        scope=None
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            answers = self._users.get(user_id)
+            if answers is None or answers.version != version:
+                answers = self._users[user_id] = _UserAnswers(version)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+
+            answers.drop_expired(now - self.ttl_seconds)
+            answers.vectors.append(_unit(question_vector))
+            answers.entries.append({
+                "question": question,
+                "answer": answer,
+                "sources": sources,
+                "scope": scope,
+                "created_at": now
+            })
+            # Oldest first: drop from the front once over the per-user cap
+            if len(answers.entries) > self.max_per_user:
+                del answers.vectors[0]
+                del answers.entries[0]
+            answers.matrix = None
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "max_users": self.max_users,
+                "entries": sum(len(a.entries) for a in self._users.values()),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+answer_cache = SemanticAnswerCache(
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_MAX_PER_USER,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_MAX_USERS
+)
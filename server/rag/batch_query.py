@@ -0,0 +1,126 @@
+import os
+import json
+import asyncio
+import numpy as np
+from typing import AsyncIterator
+from rag.embeddings import get_embedding_model
+from rag.retriever import get_retriever
+from rag.memory_chain import ANSWER_PROMPT
+from rag.llm import get_text_chain
+from rag.answer_cache import answer_cache
+from rag.vectorstore import get_index_version
+from rag.single_flight import question_key
+from dotenv import load_dotenv
+
+load_dotenv()
+BATCH_QUERY_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", "8"))
+BATCH_QUERY_MAX_QUESTIONS = int(os.getenv("BATCH_QUERY_MAX_QUESTIONS", "500"))
+
+
+def _sources(docs) -> list[dict]:
+    return [
+        {
+            "filename": doc.metadata.get("filename"),
+            "page": doc.metadata.get("page")
+        }
+        for doc in docs
+    ]
+
+
+def plan_batch(
+    user_id: str,
+    questions: list[str],
+    file_ids: list[str] | None = None
+) -> tuple[int | None, list[dict]]:
+    """
+    Blocking half of a batch: one embedding call and one FAISS search for
+    all distinct questions, answer-cache lookups included.
+    Returns the index version searched and one plan per distinct question:
+    {"question", "indices", "vector", "cached", "docs"}.
+    """
+    plans = {}
+    for i, question in enumerate(questions):
+        key = question_key(question)
+        if key not in plans:
+            plans[key] = {"question": question, "indices": [], "cached": None, "docs": None}
+        plans[key]["indices"].append(i)
+    plans = list(plans.values())
+
+    # 1️⃣ All questions through the model at once
+    vectors = np.array(
+        get_embedding_model().embed_queries([p["question"] for p in plans]),
+        dtype=np.float32
+    )
+    version = get_index_version(user_id)
+    scope = tuple(sorted(set(file_ids))) if file_ids else None
+    for plan, vector in zip(plans, vectors):
+        plan["vector"] = vector
+        plan["cached"] = answer_cache.lookup(user_id, version, vector, scope)
+
+    # 2️⃣ One batched search for everything the cache did not answer
+    todo = [p for p in plans if p["cached"] is None]
+    if todo:
+        retriever = get_retriever(user_id, file_ids=file_ids)
+        found = retriever.retrieve_batch(
+            [p["question"] for p in todo],
+            np.vstack([p["vector"] for p in todo])
+        )
+        for plan, docs in zip(todo, found):
+            plan["docs"] = docs
+    return version, plans
+
+
+async def run_batch_query(
+    user_id: str,
+    questions: list[str],
+    version: int | None,
+    plans: list[dict],
+    file_ids: list[str] | None = None,
+    concurrency: int = BATCH_QUERY_CONCURRENCY
+) -> AsyncIterator[dict]:
+    """
+    Answer independent questions (no chat history) from plan_batch's
+    plans, yielding one result per question as soon as its answer is
+    ready: completion order, not input order. At most `concurrency`
+    Gemini calls run at once; repeated questions are answered once.
+    """
+    scope = tuple(sorted(set(file_ids))) if file_ids else None
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(plan: dict) -> tuple[dict, dict]:
+        if plan["cached"] is not None:
+            return plan, {
+                "answer": plan["cached"]["answer"],
+                "sources": plan["cached"]["sources"],
+                "cached": True
+            }
+
+        # 3️⃣ Same prompt as /query, without history
+        try:
+            async with semaphore:
+                text = await get_text_chain(ANSWER_PROMPT).ainvoke({
+                    "context": "\n\n".join(doc.page_content for doc in plan["docs"]),
+                    "chat_history": "",
+                    "question": plan["question"]
+                })
+        except Exception as e:
+            return plan, {"error": str(e)}
+
+        sources = _sources(plan["docs"])
+        answer_cache.store(user_id, version, plan["question"], plan["vector"], text, sources, scope)
+        return plan, {"answer": text, "sources": sources, "cached": False}
+
+    tasks = [asyncio.create_task(answer(plan)) for plan in plans]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            plan, result = await next_done
+            for index in plan["indices"]:
+                yield {"index": index, "question": questions[index], **result}
+    finally:
+        # Client gone or generator closed: drop the calls still waiting
+        for task in tasks:
+            task.cancel()
+
+
+def ndjson_line(result: dict) -> str:
+    return json.dumps(result) + "\n"
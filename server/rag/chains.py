@@ -1,25 +1,11 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from rag.retriever import get_retriever
-import os
-from dotenv import load_dotenv
-load_dotenv()
+from rag.llm import get_stuff_chain
 
-MODEL = os.getenv("GEMINI_MODEL")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-
-def get_rag_chain(user_id: str):
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL,
-        temperature=0,
-        google_api_key=GOOGLE_API_KEY
-    )
-
-    prompt = PromptTemplate(
-        input_variables=["context", "question"],
-        template="""
+RAG_PROMPT = PromptTemplate(
+    input_variables=["context", "question"],
+    template="""
 You are an AI assistant.
 Answer ONLY using the provided context.
 
@@ -32,15 +18,16 @@ Question:
 If the answer is not in the context, say:
 "Answer not found in uploaded documents."
 """
-    )
+)
 
+
+def get_rag_chain(user_id: str):
+    # LLM client and stuff chain are shared; only the retriever is per user
     retriever = get_retriever(user_id)
 
-    chain = RetrievalQA.from_chain_type(
-        llm=llm,
+    chain = RetrievalQA(
+        combine_documents_chain=get_stuff_chain(RAG_PROMPT),
         retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt},
         return_source_documents=True
     )
 
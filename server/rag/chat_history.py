@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.prompts import PromptTemplate
+from rag.llm import get_text_chain
+from rag.tokens import CHARS_PER_TOKEN, estimate_tokens
+from db.mongo import get_chat_summary, save_chat_summary
+from db.chat_writer import get_chat_history_after, get_oldest_chat_history
+from dotenv import load_dotenv
+
+load_dotenv()
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "1500"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "300"))
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))
+
+SUMMARY_PROMPT = PromptTemplate(
+    input_variables=["summary", "turns", "max_words"],
+    template="""
+Progressively summarize the conversation between a user and an assistant
+answering questions about the user's documents. Keep names, numbers and
+what each question was about. Reply with the new summary only, at most
+{max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+New summary:"""
+)
+
+logger = logging.getLogger(__name__)
+
+# One background fold at a time per user; folds are cheap and rare
+_fold_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+_folding = set()
+_folding_lock = threading.Lock()
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    return text if len(text) <= max_chars else text[:max_chars] + " …"
+
+
+def build_chat_history(user_id: str, token_budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> list:
+    """
+    Chat history for the prompt, within token_budget.
+
+    The most recent turns are kept verbatim; older turns are represented by
+    a rolling summary stored in Mongo. Turns that no longer fit are folded
+    into that summary in the background, oldest first, so prompt size stays
+    flat however long the conversation runs.
+
+    Returns [(role, text)] with role "summary", "human" or "ai".
+    """
+    summary = get_chat_summary(user_id)
+    covered_until = summary["covered_until"] if summary else None
+    summary_text = summary["summary"] if summary else ""
+
+    # Newest first, only turns the summary does not cover yet; one extra
+    # tells whether anything older than the window is waiting
+    turns = get_chat_history_after(user_id, covered_until, limit=CHAT_HISTORY_MAX_TURNS + 1)
+
+    remaining = token_budget - (estimate_tokens(summary_text) if summary_text else 0)
+    kept = []
+    for turn in turns[:CHAT_HISTORY_MAX_TURNS]:
+        cost = estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+        if cost > remaining:
+            if not kept:
+                # Always keep the latest turn; shorten its answer instead
+                kept.append({
+                    **turn,
+                    "answer": _truncate(turn["answer"], max(remaining - estimate_tokens(turn["question"]), 32))
+                })
+            break
+        kept.append(turn)
+        remaining -= cost
+
+    if len(turns) > len(kept):
+        # Everything older than the oldest kept turn goes into the summary
+        _schedule_fold(user_id, summary_text, covered_until, kept[-1]["timestamp"])
+
+    chat_history = [("summary", summary_text)] if summary_text else []
+    for turn in reversed(kept):
+        chat_history.append(("human", turn["question"]))
+        chat_history.append(("ai", turn["answer"]))
+    return chat_history
+
+
+def _schedule_fold(user_id: str, summary_text: str, covered_until, before) -> None:
+    with _folding_lock:
+        if user_id in _folding:
+            return
+        _folding.add(user_id)
+    _fold_pool.submit(_fold_into_summary, user_id, summary_text, covered_until, before)
+
+
+def _fold_into_summary(user_id: str, summary_text: str, covered_until, before) -> None:
+    """
+    Merge the turns between covered_until and before into the user's
+    rolling summary, oldest first, CHAT_HISTORY_MAX_TURNS per LLM call.
+    """
+    try:
+        while True:
+            turns = get_oldest_chat_history(user_id, covered_until, before, limit=CHAT_HISTORY_MAX_TURNS)
+            if not turns:
+                break
+
+            summary_text = _truncate(get_text_chain(SUMMARY_PROMPT).invoke({
+                "summary": summary_text or "(none)",
+                "turns": "\n".join(
+                    f"Human: {t['question']}\nAssistant: {t['answer']}" for t in turns
+                ),
+                "max_words": CHAT_SUMMARY_MAX_TOKENS * 3 // 4
+            }).strip(), CHAT_SUMMARY_MAX_TOKENS)
+
+            covered_until = turns[-1]["timestamp"]
+            save_chat_summary(user_id, summary_text, covered_until)
+            if len(turns) < CHAT_HISTORY_MAX_TURNS:
+                break
+    except Exception:
+        # The turns stay unsummarized; the next query retries the fold
+        logger.exception(f"Chat summary fold for user {user_id} failed")
+    finally:
+        with _folding_lock:
+            _folding.discard(user_id)
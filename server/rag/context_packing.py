@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from langchain_core.documents import Document
+from rag.tokens import CHARS_PER_TOKEN, estimate_tokens
+from dotenv import load_dotenv
+
+load_dotenv()
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "on").lower() != "off"
+# Unset (0): as many chunks as the retriever's k, and as many tokens as
+# that many full chunks, i.e. no bigger a prompt than plain top-k
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "0"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+
+# Cosine similarity above which two chunks count as the same passage
+NEAR_DUPLICATE_SIMILARITY = 0.97
+
+# Splitter overlap is 100 chars; allow for whitespace trimmed at chunk edges
+MAX_OVERLAP_CHARS = 200
+MIN_OVERLAP_CHARS = 20
+
+# Tokens in one full chunk (splitter chunk_size is 700 chars)
+CHUNK_TOKENS = 700 // CHARS_PER_TOKEN + 1
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def mmr_select(
+    relevance: list[float],
+    vectors: np.ndarray | None,
+    costs: list[int],
+    max_chunks: int,
+    token_budget: int,
+    lambda_mult: float = MMR_LAMBDA
+) -> list[int]:
+    """
+    Maximal marginal relevance under a token budget.
+    relevance is in [0, 1]; vectors (one row per candidate) give the
+    redundancy term, None falls back to plain relevance order.
+    Returns indices of the chosen candidates, in selection order.
+    """
+    n = len(relevance)
+    rel = np.asarray(relevance, dtype=np.float32)
+    sims = None
+    if vectors is not None:
+        unit = _unit_rows(np.asarray(vectors, dtype=np.float32))
+        sims = unit @ unit.T
+
+    selected = []
+    remaining = set(range(n))
+    used = 0
+    while remaining and len(selected) < max_chunks:
+        if sims is not None and selected:
+            redundancy = sims[:, selected].max(axis=1)
+        else:
+            redundancy = np.zeros(n, dtype=np.float32)
+
+        for i in [i for i in remaining if redundancy[i] >= NEAR_DUPLICATE_SIMILARITY]:
+            remaining.discard(i)  # same passage again (e.g. a re-uploaded file)
+        if not remaining:
+            break
+
+        scores = lambda_mult * rel - (1 - lambda_mult) * redundancy
+        best = max(remaining, key=lambda i: scores[i])
+        remaining.discard(best)
+
+        # Over budget: a smaller candidate may still fit
+        if selected and used + costs[best] > token_budget:
+            continue
+        selected.append(best)
+        used += costs[best]
+    return selected
+
+
+def _overlap(a: str, b: str) -> int:
+    """
+    Length of the longest suffix of a that is a prefix of b.
+    """
+    for length in range(min(MAX_OVERLAP_CHARS, len(a), len(b)), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:length]):
+            return length
+    return 0
+
+
+def merge_adjacent(docs: list[Document]) -> list[Document]:
+    """
+    Join neighbouring chunks of the same page, dropping the text the
+    splitter repeated between them, and drop chunks contained in another.
+    Keeps the order in which each passage first appears.
+    """
+    # A merge can make a passage adjacent to one seen earlier: repeat until stable
+    while True:
+        merged = _merge_pass(docs)
+        if len(merged) == len(docs):
+            return merged
+        docs = merged
+
+
+def _merge_pass(docs: list[Document]) -> list[Document]:
+    merged = []
+    for doc in docs:
+        text = doc.page_content
+        for i, other in enumerate(merged):
+            if (other.metadata.get("file_id"), other.metadata.get("page")) != \
+                    (doc.metadata.get("file_id"), doc.metadata.get("page")):
+                continue
+            if text in other.page_content:
+                break
+            if other.page_content in text:
+                merged[i] = Document(page_content=text, metadata=other.metadata)
+                break
+            after = _overlap(other.page_content, text)
+            if after:
+                merged[i] = Document(page_content=other.page_content + text[after:], metadata=other.metadata)
+                break
+            before = _overlap(text, other.page_content)
+            if before:
+                merged[i] = Document(page_content=text + other.page_content[before:], metadata=other.metadata)
+                break
+        else:
+            merged.append(doc)
+    return merged
+
+
+def pack_context(
+    docs: list[Document],
+    relevance: list[float],
+    vectors: np.ndarray | None,
+    max_chunks: int,
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+) -> list[Document]:
+    """
+    Candidates (best first) -> the passages to stuff into the prompt:
+    diverse (MMR), de-duplicated, overlap-merged and within token_budget
+    (0: max_chunks full chunks).
+    """
+    if not docs:
+        return []
+    token_budget = token_budget or max_chunks * CHUNK_TOKENS
+
+    costs = [estimate_tokens(doc.page_content) for doc in docs]
+    chosen = mmr_select(relevance, vectors, costs, max_chunks, token_budget)
+    return merge_adjacent([docs[i] for i in chosen])
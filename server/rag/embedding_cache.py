@@ -0,0 +1,144 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# SQLite caps the number of bound parameters per statement
+SQL_BATCH = 500
+
+# last_used only drives eviction: hits refresh it when it is older than
+# this, and the refreshes are written with the next put (or once this
+# many are pending) instead of a commit per lookup
+LAST_USED_RESOLUTION_SECONDS = 3600
+MAX_PENDING_TOUCHES = 10000
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace so layout-only differences share a cache entry.
+    """
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, normalized text hash).
+
+    Backed by SQLite (WAL mode, so several worker processes can share it).
+    Least recently used rows are evicted once the table exceeds max_entries
+    (recency is tracked to within LAST_USED_RESOLUTION_SECONDS).
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}  # key -> last hit, not written yet
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(
+            f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if not keys:
+            return {}
+
+        found = {}
+        now = time.time()
+        stale = now - LAST_USED_RESOLUTION_SECONDS
+        with self._lock:
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i:i + SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})",
+                    batch
+                ).fetchall()
+                for key, blob, last_used in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                    if last_used < stale:
+                        self._touched[key] = now
+
+            if len(self._touched) >= MAX_PENDING_TOUCHES:
+                self._flush_touched()
+                self._conn.commit()
+
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def _flush_touched(self) -> None:
+        # Caller holds the lock and commits
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()]
+            )
+            self._touched = {}
+
+    def put_many(self, items: dict[str, list[float]]) -> None:
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            # Recency first, so eviction below sees it
+            self._flush_touched()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                    for key, vector in items.items()
+                ]
+            )
+            self._count += len(items)
+
+            # Evict in bulk (5% headroom) rather than on every insert
+            if self._count > self.max_entries:
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                excess = self._count - int(self.max_entries * 0.95)
+                if excess > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN ("
+                        " SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (excess,)
+                    )
+                    self._count -= excess
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
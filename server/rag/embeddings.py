@@ -0,0 +1,163 @@
+import os
+import time
+import logging
+import threading
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface import HuggingFaceEmbeddings
+from rag.embedding_cache import (
+    EmbeddingCache,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingEngine(Embeddings):
+    """
+    One sentence-transformers model shared by the whole process.
+
+    The model is loaded lazily (or eagerly via warm_up) exactly once.
+    Inference is serialized with a lock because the HuggingFace fast
+    tokenizer is not safe to use from several threads at the same time.
+    A persistent EmbeddingCache sits in front of the model, so text that
+    was embedded before (re-uploads, rebuilds, repeated questions) is free.
+    """
+
+    def __init__(self, model_name: str, cache: EmbeddingCache | None = None):
+        self.model_name = model_name
+        self.cache = cache
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._infer_lock = threading.Lock()
+        self.dimension = None
+        self.status = "not_loaded"
+        self.load_seconds = None
+        self.error = None
+
+    def _get_model(self) -> HuggingFaceEmbeddings:
+        if self._model is not None:
+            return self._model
+
+        with self._load_lock:
+            if self._model is None:
+                self.status = "loading"
+                start = time.perf_counter()
+                try:
+                    model = HuggingFaceEmbeddings(model_name=self.model_name)
+                    # Run one tiny inference so lazy weights/kernels are ready
+                    self.dimension = len(model.embed_query("warm-up"))
+                except Exception as e:
+                    self.status = "failed"
+                    self.error = str(e)
+                    raise
+                self.load_seconds = round(time.perf_counter() - start, 3)
+                self.error = None
+                self.status = "ready"
+                self._model = model
+                logger.info(
+                    f"Embedding model {self.model_name} ready in {self.load_seconds}s"
+                )
+        return self._model
+
+    def warm_up(self) -> None:
+        try:
+            self._get_model()
+        except Exception:
+            logger.exception("Embedding model warm-up failed")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_cached(texts, "document")
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_cached([text], "query")[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Query embeddings for many questions in one model call.
+        """
+        return self._embed_cached(texts, "query")
+
+    def _embed_cached(self, texts: list[str], kind: str) -> list[list[float]]:
+        if self.cache is None:
+            return self._run_model(texts, kind)
+
+        namespace = f"{self.model_name}|{kind}"
+        keys = [EmbeddingCache.make_key(namespace, t) for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+
+        if missing:
+            fresh = dict(zip(missing, self._run_model(list(missing.values()), kind)))
+            self.cache.put_many(fresh)
+            found.update(fresh)
+
+        return [found[key] for key in keys]
+
+    def _run_model(self, texts: list[str], kind: str) -> list[list[float]]:
+        if not texts:
+            return []
+        model = self._get_model()
+        with self._infer_lock:
+            # Without query-specific encode kwargs a query embeds exactly
+            # like a document, so a batch of queries is one encode call
+            if kind == "query" and getattr(model, "query_encode_kwargs", None):
+                return [model.embed_query(t) for t in texts]
+            return model.embed_documents(texts)
+
+    def get_dimension(self) -> int:
+        self._get_model()
+        return self.dimension
+
+    def get_status(self) -> dict:
+        return {
+            "model": self.model_name,
+            "status": self.status,
+            "dimension": self.dimension,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+            "cache": self.cache.stats() if self.cache else None
+        }
+
+
+_engine = EmbeddingEngine(
+    EMBEDDING_MODEL,
+    cache=(
+        EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+        if EMBEDDING_CACHE_MAX_ENTRIES > 0 else None
+    )
+)
+
+
+def get_embedding_model() -> EmbeddingEngine:
+    """
+    Return the process-wide embedding engine.
+    """
+    return _engine
+
+
+def start_embedding_warmup() -> threading.Thread:
+    """
+    Load the model in a background thread so the app can answer /health
+    while warming up. Requests that need embeddings wait for the load.
+    """
+    thread = threading.Thread(
+        target=_engine.warm_up,
+        name="embedding-warmup",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def get_embedding_status() -> dict:
+    return _engine.get_status()
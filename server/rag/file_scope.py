@@ -0,0 +1,252 @@
+import os
+import json
+import weakref
+import threading
+import numpy as np
+import faiss
+from collections import OrderedDict
+from rag.vectorstore import get_user_index_path, get_index_version, positions_of_ids
+from rag.ann_index import search_params
+from db.mongo import get_faiss_ids_by_user_files
+from dotenv import load_dotenv
+
+load_dotenv()
+# Scopes up to this many vectors are searched exactly (faster than a
+# filtered ANN search, which also misses results for very selective filters)
+SCOPE_EXACT_MAX = int(os.getenv("SCOPE_EXACT_MAX", "2048"))
+FILE_TABLE_CACHE_MAX_USERS = int(os.getenv("FILE_TABLE_CACHE_MAX_USERS", "64"))
+
+FILE_TABLE = "files.json"
+FILE_TABLE_IDS = "files.ids.npy"
+
+# Selectors kept per user (distinct file_id combinations)
+SCOPES_PER_USER = 16
+
+
+class FileScope:
+    """
+    A query restricted to some documents: their FAISS positions, as a
+    range selector when contiguous (a document added in one batch) or a
+    bitmap, plus the docstore ids for the lexical leg.
+    """
+
+    def __init__(self, positions: np.ndarray, doc_ids: set[str], ntotal: int):
+        self.positions = positions
+        self.doc_ids = doc_ids
+        self.ntotal = ntotal
+        self._bitmap = None  # the selector reads this buffer: keep it alive
+        if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+            self.selector = faiss.IDSelectorRange(int(positions[0]), int(positions[-1]) + 1)
+        else:
+            mask = np.zeros(ntotal, dtype=bool)
+            mask[positions] = True
+            self._bitmap = np.packbits(mask, bitorder="little")
+            self.selector = faiss.IDSelectorBitmap(ntotal, faiss.swig_ptr(self._bitmap))
+
+    def search(self, index, queries: np.ndarray, k: int) -> np.ndarray:
+        """
+        Top-k positions inside the scope for each query row, nearest first
+        (-1 pads rows of a filtered ANN search that found fewer).
+        """
+        k = min(k, len(self.positions))
+        if not k:
+            return np.zeros((len(queries), 0), dtype=np.int64)
+
+        if len(self.positions) <= SCOPE_EXACT_MAX:
+            vectors = index.reconstruct_batch(self.positions)
+            # Squared L2 for every (query, vector) pair in one product
+            distances = (
+                (queries ** 2).sum(axis=1, keepdims=True)
+                - 2 * queries @ vectors.T
+                + (vectors ** 2).sum(axis=1)
+            )
+            best = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(distances, best, axis=1).argsort(axis=1)
+            return self.positions[np.take_along_axis(best, order, axis=1)]
+
+        params = search_params(index, self.selector, len(self.positions) / self.ntotal)
+        _, labels = index.search(queries, k, params=params)
+        return labels
+
+
+class FileTable:
+    """
+    Stable FAISS ids of each document's chunks, kept up to date by the
+    index writer. Ids (unlike positions) survive deletes, so the table
+    only changes for the documents that changed.
+    """
+
+    def __init__(self, members: dict[str, np.ndarray] | None = None):
+        self.members = members or {}  # file_id -> sorted int64 ids
+        # Table file and index version this copy was read (or rebuilt) for
+        self.mtime = None
+        self.version = None
+        self.lock = threading.Lock()
+        self._scopes = OrderedDict()  # file_ids -> (vectorstore ref, FileScope)
+
+    def add(self, file_id: str, ids) -> None:
+        current = self.members.get(file_id, np.zeros(0, dtype=np.int64))
+        self.members[file_id] = np.union1d(current, np.asarray(ids, dtype=np.int64))
+        self._scopes.clear()
+
+    def remove_file(self, file_id: str) -> None:
+        self.members.pop(file_id, None)
+        self._scopes.clear()
+
+    def scope(self, vectorstore, user_id: str, file_ids: list[str]) -> FileScope:
+        """
+        Selector for these documents over this vectorstore's positions.
+        Built once per loaded index (positions move when vectors are deleted).
+        """
+        key = tuple(sorted(set(file_ids)))
+        with self.lock:
+            cached = self._scopes.get(key)
+            if cached is not None and cached[0]() is vectorstore:
+                self._scopes.move_to_end(key)
+                return cached[1]
+
+            parts = [self.members[f] for f in key if f in self.members]
+            ids = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+            scope = FileScope(
+                positions_of_ids(vectorstore, user_id, ids),
+                {str(i) for i in ids.tolist()},
+                vectorstore.index.ntotal
+            )
+            self._scopes[key] = (weakref.ref(vectorstore), scope)
+            while len(self._scopes) > SCOPES_PER_USER:
+                self._scopes.popitem(last=False)
+            return scope
+
+
+_cache = OrderedDict()  # user_id -> FileTable
+_cache_lock = threading.Lock()
+
+
+def _table_paths(user_id: str) -> tuple[str, str]:
+    base = get_user_index_path(user_id)
+    return os.path.join(base, FILE_TABLE), os.path.join(base, FILE_TABLE_IDS)
+
+
+def _table_mtime(user_id: str) -> int | None:
+    try:
+        return os.stat(_table_paths(user_id)[0]).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load(user_id: str, version) -> FileTable | None:
+    """
+    The saved table, or None if missing or written for another index version.
+    """
+    header_path, ids_path = _table_paths(user_id)
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+        ids = np.load(ids_path)
+    except (FileNotFoundError, ValueError):
+        return None
+    if header["index_version"] != version:
+        return None
+
+    offsets = header["offsets"]
+    return FileTable({
+        file_id: ids[offsets[i]:offsets[i + 1]]
+        for i, file_id in enumerate(header["files"])
+    })
+
+
+def _rebuild(user_id: str) -> FileTable:
+    # MongoDB chunks are the source of truth for which document uses which vector
+    return FileTable({
+        file_id: np.unique(np.asarray(ids, dtype=np.int64))
+        for file_id, ids in get_faiss_ids_by_user_files(user_id).items()
+    })
+
+
+def _save(user_id: str, table: FileTable) -> None:
+    # Only under the index writer's lock (update_file_table): writers share the .tmp names
+    header_path, ids_path = _table_paths(user_id)
+    os.makedirs(os.path.dirname(header_path), exist_ok=True)
+    files = list(table.members)
+    sizes = [len(table.members[f]) for f in files]
+    ids = np.concatenate([table.members[f] for f in files]) if files else np.zeros(0, dtype=np.int64)
+
+    with open(ids_path + ".tmp", "wb") as f:
+        np.save(f, ids.astype(np.int64))
+    os.replace(ids_path + ".tmp", ids_path)
+    # Header last: it names the index version the ids belong to
+    version = get_index_version(user_id)
+    with open(header_path + ".tmp", "w") as f:
+        json.dump({
+            "index_version": version,
+            "files": files,
+            "offsets": [0, *np.cumsum(sizes).tolist()]
+        }, f)
+    os.replace(header_path + ".tmp", header_path)
+    table.mtime = _table_mtime(user_id)
+    table.version = version
+
+
+def _cache_put(user_id: str, table: FileTable) -> None:
+    with _cache_lock:
+        _cache[user_id] = table
+        _cache.move_to_end(user_id)
+        while len(_cache) > FILE_TABLE_CACHE_MAX_USERS:
+            _cache.popitem(last=False)
+
+
+def get_file_table(user_id: str) -> FileTable:
+    """
+    The user's file table as last saved (by any worker). A missing or
+    stale file is rebuilt from MongoDB in memory only: the index writer
+    saves the table (update_file_table) after its next batch.
+    """
+    mtime = _table_mtime(user_id)
+    version = get_index_version(user_id)
+    with _cache_lock:
+        table = _cache.get(user_id)
+        if table is not None and table.mtime == mtime and table.version == version:
+            _cache.move_to_end(user_id)
+            return table
+
+    table = _load(user_id, version)
+    if table is None:
+        table = _rebuild(user_id)
+    table.mtime = mtime
+    table.version = version
+    _cache_put(user_id, table)
+    return table
+
+
+def update_file_table(
+    user_id: str,
+    added: dict[str, list[int]] | None = None,
+    removed: list[str] = (),
+    rebuild: bool = False
+) -> None:
+    """
+    Called by the index writer after a batch: documents indexed (file_id ->
+    ids of their chunks, shared vectors included) and documents deleted.
+    rebuild=True reads everything from MongoDB again (compaction).
+    """
+    table = None
+    if not rebuild:
+        # Caught up (get_file_table) before the batch changed the index version
+        with _cache_lock:
+            table = _cache.get(user_id)
+        if table is not None and table.mtime != _table_mtime(user_id):
+            table = None
+    if table is None:
+        table = _rebuild(user_id)
+    with table.lock:
+        for file_id, ids in (added or {}).items():
+            table.add(file_id, ids)
+        for file_id in removed:
+            table.remove_file(file_id)
+        _save(user_id, table)
+    _cache_put(user_id, table)
+
+
+def invalidate_file_table(user_id: str) -> None:
+    with _cache_lock:
+        _cache.pop(user_id, None)
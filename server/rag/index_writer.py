@@ -0,0 +1,462 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from langchain_core.documents import Document
+from rag.vectorstore import (
+    get_user_vectorstore,
+    get_writable_vectorstore,
+    save_user_vectorstore,
+    invalidate_user_vectorstore,
+    can_mark_deleted,
+    deleted_count,
+    has_legacy_ids,
+    mark_deleted,
+    positions_of_ids,
+    max_stable_id,
+    update_doc_metadata
+)
+from rag.embeddings import get_embedding_model
+from rag.vector_archive import append_vectors, archive_generation, staged_generation
+from rag.ann_index import maybe_migrate, purge_deleted_vectors, remove_vectors
+from rag.lexical_index import (
+    get_lexical_index,
+    update_lexical_index,
+    invalidate_lexical_index
+)
+from rag.file_scope import get_file_table, update_file_table, invalidate_file_table
+from db.mongo import (
+    insert_chunks,
+    get_max_faiss_id,
+    get_document_by_id,
+    get_faiss_ids_by_text_hash,
+    get_chunk_owners,
+    delete_chunks_by_file
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+# Deleted vectors are only hidden (mark_deleted) until they make up this
+# share of the index; then the next delete rewrites it without them
+MAX_DELETED_FRACTION = float(os.getenv("MAX_DELETED_FRACTION", "0.1"))
+if not 0 <= MAX_DELETED_FRACTION < 1:
+    raise ValueError(f"MAX_DELETED_FRACTION must be in [0, 1), got {MAX_DELETED_FRACTION}")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreparedDocument:
+    """
+    A split and embedded document, ready to be written to the user's index.
+    """
+    user_id: str
+    file_id: str
+    filename: str
+    docs: list[Document]
+    vectors: list[list[float] | None]  # None: text already indexed for this user
+    hashes: list[str]
+    pages: int = 0
+    timings: dict = field(default_factory=dict)
+
+
+class _PendingWrite:
+    def __init__(self, kind: str, payload):
+        self.kind = kind  # "ingest" | "delete"
+        self.payload = payload
+        self.future = Future()
+
+
+class IndexWriteCoordinator:
+    """
+    Single writer per user, any number of users in parallel.
+
+    Writes are queued per user. The first thread to find the user's writer
+    idle becomes the writer and drains the queue; every write that piles up
+    meanwhile is applied as one batch: one FAISS add, one delete, one save.
+    Other threads just wait on their future.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}     # user_id -> [_PendingWrite]
+        self._user_locks = {}  # user_id -> threading.Lock
+
+    def user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def submit_ingest(self, prepared: PreparedDocument) -> Future:
+        return self._submit(prepared.user_id, _PendingWrite("ingest", prepared))
+
+    def submit_delete(self, user_id: str, file_id: str, faiss_ids: list[int]) -> Future:
+        return self._submit(user_id, _PendingWrite("delete", (file_id, faiss_ids)))
+
+    def run_exclusive(self, user_id: str, fn, *args, **kwargs):
+        """
+        Run fn while holding the user's writer lock (e.g. a full rebuild).
+        """
+        with self.user_lock(user_id):
+            result = fn(*args, **kwargs)
+        # Writes queued while we held the lock found the writer busy
+        self._drain(user_id)
+        return result
+
+    def _submit(self, user_id: str, write: _PendingWrite) -> Future:
+        with self._lock:
+            self._pending.setdefault(user_id, []).append(write)
+        self._drain(user_id)
+        return write.future
+
+    def _drain(self, user_id: str) -> None:
+        lock = self.user_lock(user_id)
+        while True:
+            # Someone else is writing for this user; they will pick up our write
+            if not lock.acquire(blocking=False):
+                return
+            try:
+                with self._lock:
+                    batch = self._pending.pop(user_id, [])
+                if batch:
+                    self._apply(user_id, batch)
+            finally:
+                lock.release()
+
+            with self._lock:
+                if not self._pending.get(user_id):
+                    return
+
+    def _apply(self, user_id: str, batch: list[_PendingWrite]) -> None:
+        ingests = [w for w in batch if w.kind == "ingest"]
+        deletes = [w for w in batch if w.kind == "delete"]
+        results = {}
+
+        if not ingests and self._mark_deletes(user_id, deletes):
+            return
+
+        try:
+            if staged_generation(user_id) is not None:
+                # A compaction was cut short: ids in MongoDB, the archive and
+                # the index may disagree until it is finished
+                from rag.reindex import _rebuild_user_faiss_index
+                _rebuild_user_faiss_index(user_id)
+            generation = archive_generation(user_id)
+
+            # Queries keep reading the cached store while this copy is changed
+            vectorstore = get_writable_vectorstore(user_id)
+            # Caught up to the on-disk version before this batch changes it
+            get_lexical_index(user_id, vectorstore)
+            table = get_file_table(user_id)
+            # Vectors earlier deletes only hid: this save drops them
+            purged = purge_deleted_vectors(vectorstore, user_id)
+
+            # 1️⃣ Index update: every queued document in one add
+            stage = time.perf_counter()
+            live = []
+            for w in ingests:
+                prepared = w.payload
+                # Deleted while it was being parsed/embedded: nothing to index
+                if get_document_by_id(user_id, prepared.file_id) is None:
+                    results[w] = {"chunks": 0, "new_vectors": 0, "skipped": "document deleted"}
+                elif prepared.docs:
+                    live.append(w)
+                else:
+                    results[w] = {"chunks": 0, "new_vectors": 0}
+
+            id_of_hash, new_ids, new_vectors, new_count = self._add_unique_chunks(
+                vectorstore, user_id, live
+            )
+
+            # Vectors shared with chunks written in this batch must survive deletes
+            keep = set(id_of_hash.values())
+            relabelled = 0
+            for w in deletes:
+                file_id, ids = w.payload
+                ids = _file_vector_ids(table, file_id, ids)
+                removed, changed = delete_file_vectors(vectorstore, user_id, file_id, ids, keep)
+                results[w] = {"vectors_removed": removed}
+                relabelled += changed
+            index_seconds = time.perf_counter() - stage
+
+            # 2️⃣ Persist once: vector archive, then the FAISS files
+            stage = time.perf_counter()
+            if new_ids:
+                # Keep the vectors so a rebuild never has to re-run the model
+                append_vectors(user_id, new_ids, new_vectors)
+
+            # Library crossed a size threshold: switch flat <-> ANN index
+            migrated = maybe_migrate(vectorstore, user_id)
+
+            # Relabelled shared vectors change only the docstore, but must reach disk too
+            saved = bool(
+                new_ids or migrated or relabelled or purged
+                or any(r.get("vectors_removed") for r in results.values())
+            )
+            if saved:
+                save_user_vectorstore(vectorstore, user_id)
+
+            # 3️⃣ Chunk rows only once the index holds their vectors: a
+            # compaction rebuilds from these rows, whatever the document status
+            for w in live:
+                prepared = w.payload
+                insert_chunks(
+                    user_id=user_id,
+                    file_id=prepared.file_id,
+                    filename=prepared.filename,
+                    archive_generation=generation,
+                    chunks=[
+                        {
+                            "page_number": doc.metadata["page"],
+                            "text": doc.page_content,
+                            "text_hash": h,
+                            "faiss_index_id": id_of_hash[h]
+                        }
+                        for doc, h in zip(prepared.docs, prepared.hashes)
+                    ]
+                )
+                results[w] = {"chunks": len(prepared.docs), "new_vectors": new_count[w]}
+
+        except Exception as e:
+            # The save may have stopped halfway through the files; reload from disk next time
+            invalidate_user_vectorstore(user_id)
+            invalidate_lexical_index(user_id)
+            invalidate_file_table(user_id)
+            # Rows of chunks never (or not fully) written must not outlive the write
+            for w in ingests:
+                try:
+                    delete_chunks_by_file(user_id, w.payload.file_id)
+                except Exception:
+                    logger.exception(f"Could not drop chunk rows of {w.payload.file_id}")
+            logger.exception(f"Index write for user {user_id} failed")
+            for w in batch:
+                w.future.set_exception(e)
+            return
+
+        # 4️⃣ Lexical index and file table: both rebuild themselves from the
+        # saved index and MongoDB, so a failure here does not undo the write
+        try:
+            if saved:
+                update_lexical_index(user_id, vectorstore)
+            # Even with no new vectors (all chunks shared): the document now uses them
+            if live or deletes:
+                update_file_table(
+                    user_id,
+                    added={
+                        w.payload.file_id: [id_of_hash[h] for h in w.payload.hashes]
+                        for w in live
+                    },
+                    removed=[w.payload[0] for w in deletes]
+                )
+        except Exception:
+            logger.exception(f"Lexical index / file table update for user {user_id} failed")
+            invalidate_lexical_index(user_id)
+            invalidate_file_table(user_id)
+        persist_seconds = time.perf_counter() - stage
+        _set_results(batch, results, index_seconds, persist_seconds)
+
+    def _mark_deletes(self, user_id: str, deletes: list[_PendingWrite]) -> bool:
+        """
+        Deletes-only batch: hide the documents' vectors (mark_deleted)
+        instead of copying and saving the whole index. Not possible, and
+        False is returned, when a vector is shared with another document
+        (it is re-labelled), the index has older ids or a cut-short
+        compaction, or hidden vectors would pass MAX_DELETED_FRACTION.
+        """
+        stage = time.perf_counter()
+        try:
+            if staged_generation(user_id) is not None:
+                return False
+            vectorstore = get_user_vectorstore(user_id)
+            if not can_mark_deleted(user_id, vectorstore):
+                return False
+            get_lexical_index(user_id, vectorstore)
+            table = get_file_table(user_id)
+
+            ids = {w: _file_vector_ids(table, *w.payload) for w in deletes}
+            all_ids = sorted({i for file_ids in ids.values() for i in file_ids})
+            if all_ids and get_chunk_owners(user_id, all_ids):
+                return False
+            positions = {w: positions_of_ids(vectorstore, user_id, ids[w]) for w in deletes}
+            hidden = deleted_count(vectorstore) + sum(len(p) for p in positions.values())
+            if hidden > MAX_DELETED_FRACTION * vectorstore.index.ntotal:
+                return False
+
+            stage_persist = time.perf_counter()
+            if hidden > deleted_count(vectorstore):
+                vectorstore = mark_deleted(user_id, vectorstore, np.concatenate(list(positions.values())))
+        except Exception as e:
+            invalidate_user_vectorstore(user_id)
+            invalidate_lexical_index(user_id)
+            invalidate_file_table(user_id)
+            logger.exception(f"Index delete for user {user_id} failed")
+            for w in deletes:
+                w.future.set_exception(e)
+            return True
+
+        try:
+            removed_ids = [str(i) for w in deletes for i in ids[w]]
+            update_lexical_index(user_id, vectorstore, removed=removed_ids)
+            update_file_table(user_id, removed=[w.payload[0] for w in deletes])
+        except Exception:
+            logger.exception(f"Lexical index / file table update for user {user_id} failed")
+            invalidate_lexical_index(user_id)
+            invalidate_file_table(user_id)
+
+        results = {w: {"vectors_removed": len(positions[w])} for w in deletes}
+        _set_results(deletes, results, stage_persist - stage, time.perf_counter() - stage_persist)
+        return True
+
+    def _add_unique_chunks(self, vectorstore, user_id: str, live: list[_PendingWrite]):
+        """
+        Add each distinct chunk text once per user.
+        Returns (text_hash -> faiss id, new ids, new vectors, new vectors per write).
+        """
+        all_hashes = {h for w in live for h in w.payload.hashes}
+        id_of_hash = {
+            h: faiss_id
+            for h, faiss_id in get_faiss_ids_by_text_hash(user_id, all_hashes).items()
+            if isinstance(vectorstore.docstore.search(str(faiss_id)), Document)
+        }
+
+        docs, vectors, hashes, missing = [], [], [], []
+        seen = set()
+        new_count = {}
+        for w in live:
+            prepared = w.payload
+            new_count[w] = 0
+            for doc, vector, h in zip(prepared.docs, prepared.vectors, prepared.hashes):
+                if h in id_of_hash or h in seen:
+                    continue
+                seen.add(h)
+                if vector is None:
+                    # Was indexed when prepared, but that vector is gone now
+                    missing.append(len(docs))
+                docs.append(doc)
+                vectors.append(vector)
+                hashes.append(h)
+                new_count[w] += 1
+
+        if missing:
+            fresh = get_embedding_model().embed_documents([docs[i].page_content for i in missing])
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+
+        new_ids = add_to_index(vectorstore, user_id, docs, vectors)
+        id_of_hash.update(zip(hashes, new_ids))
+        return id_of_hash, new_ids, vectors, new_count
+
+
+def _set_results(batch, results: dict, index_seconds: float, persist_seconds: float) -> None:
+    for w in batch:
+        w.future.set_result({
+            **results[w],
+            "coalesced": len(batch),
+            "timings": {
+                "index": round(index_seconds, 4),
+                "persist": round(persist_seconds, 4)
+            }
+        })
+
+
+def _file_vector_ids(table, file_id: str, faiss_ids: list[int]) -> list[int]:
+    """
+    Ids of a document's vectors: its chunk rows as read before they were
+    deleted, plus the file table's (chunks written after that read).
+    """
+    members = table.members.get(file_id)
+    if members is None:
+        return sorted(set(faiss_ids))
+    return sorted(set(faiss_ids) | set(members.tolist()))
+
+
+def next_faiss_index_id(vectorstore, user_id: str) -> int:
+    """
+    First unused stable id for new chunks.
+    Ids are never reused, so a chunk's faiss_index_id keeps pointing
+    at its own vector after other documents are deleted.
+    """
+    return max(
+        vectorstore.index.ntotal,
+        max_stable_id(vectorstore) + 1,
+        get_max_faiss_id(user_id) + 1
+    )
+
+
+def add_to_index(vectorstore, user_id: str, docs: list[Document], vectors) -> list[int]:
+    """
+    Add pre-embedded chunks under stable ids.
+    docstore id == str(chunks.faiss_index_id)
+    """
+    if not docs:
+        return []
+
+    next_id = next_faiss_index_id(vectorstore, user_id)
+    faiss_ids = list(range(next_id, next_id + len(docs)))
+    for doc, faiss_id in zip(docs, faiss_ids):
+        doc.metadata["faiss_index_id"] = faiss_id
+
+    # 🔥 ONLY new docs are added
+    vectorstore.add_embeddings(
+        zip([doc.page_content for doc in docs], vectors),
+        metadatas=[doc.metadata for doc in docs],
+        ids=[str(i) for i in faiss_ids]
+    )
+    return faiss_ids
+
+
+def delete_file_vectors(
+    vectorstore,
+    user_id: str,
+    file_id: str,
+    faiss_ids: list[int],
+    keep: set[int] = frozenset()
+) -> tuple[int, int]:
+    """
+    Remove one document's vectors in place.
+    No re-embedding: cost is proportional to the document, not the library.
+    Vectors still referenced by another document's chunks are kept and
+    re-labelled with that document's metadata.
+    Returns (vectors removed, vectors re-labelled).
+    """
+    docstore = vectorstore.docstore
+    ids_to_delete = {str(i) for i in faiss_ids if isinstance(docstore.search(str(i)), Document)}
+
+    # Indexes built before stable ids used UUIDs: find those by metadata
+    if has_legacy_ids(vectorstore):
+        for doc_id in set(vectorstore.index_to_docstore_id.values()) - ids_to_delete:
+            doc = docstore.search(doc_id)
+            if getattr(doc, "metadata", {}).get("file_id") == file_id:
+                ids_to_delete.add(doc_id)
+
+    numeric = [int(i) for i in ids_to_delete if i.isdigit()]
+    owners = get_chunk_owners(user_id, numeric) if numeric else {}
+    relabelled = 0
+    for faiss_id in numeric:
+        if faiss_id in owners or faiss_id in keep:
+            ids_to_delete.discard(str(faiss_id))
+        owner = owners.get(faiss_id)
+        if owner is not None:
+            relabelled += 1
+            update_doc_metadata(vectorstore, str(faiss_id), {
+                "file_id": owner["file_id"],
+                "filename": owner.get("filename"),
+                "page": owner["page_number"]
+            })
+
+    if ids_to_delete:
+        remove_vectors(vectorstore, user_id, list(ids_to_delete))
+    return len(ids_to_delete), relabelled
+
+
+def delete_document_vectors(user_id: str, file_id: str, faiss_ids: list[int]) -> int:
+    """
+    Queue removal of a document's vectors and wait for it.
+    Returns the number of vectors removed.
+    """
+    return index_writer.submit_delete(user_id, file_id, faiss_ids).result()["vectors_removed"]
+
+
+index_writer = IndexWriteCoordinator()
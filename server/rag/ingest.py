@@ -1,53 +1,164 @@
+import os
+import time
+import hashlib
+from typing import Callable, Iterable
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from rag.vectorstore import get_user_vectorstore, save_user_vectorstore
-from db.mongo import insert_chunk
+from rag.embeddings import get_embedding_model
+from rag.embedding_cache import normalize_text
+from rag.index_writer import index_writer, PreparedDocument
+from db.mongo import get_faiss_ids_by_text_hash
+from dotenv import load_dotenv
+
+load_dotenv()
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+
+splitter = RecursiveCharacterTextSplitter(
+    chunk_size=700,
+    chunk_overlap=100
+)
+
 
 def ingest_new_document(
     user_id: str,
     file_id: str,
     filename: str,
-    extracted_pages: list[dict]
-):
+    extracted_pages: Iterable[dict],
+    num_pages: int | None = None,
+    on_progress: Callable[[float], None] | None = None
+) -> dict:
     """
     extracted_pages = [
         {"page": 1, "text": "..."},
         {"page": 2, "text": "..."}
     ]
+    (any iterable works; a generator lets embedding start on early pages
+    while later pages are still being parsed)
+
+    Pipeline: split and embed in batches as pages arrive, then hand the
+    result to the per-user index writer (one FAISS add, one insert_many,
+    one save, shared with any other document queued for the same user).
+    Returns chunk counts and per-stage timings (seconds).
+    on_progress(fraction of num_pages) is called as pages are consumed.
+    """
+    start = time.perf_counter()
+
+    prepared = prepare_document(user_id, file_id, filename, extracted_pages, num_pages, on_progress)
+    written = index_writer.submit_ingest(prepared).result()
+
+    total = time.perf_counter() - start
+    timings = {**prepared.timings, **written["timings"]}
+    return {
+        "pages": prepared.pages,
+        "chunks": written["chunks"],
+        "new_vectors": written["new_vectors"],
+        "coalesced": written["coalesced"],
+        "timings": {name: round(t, 4) for name, t in timings.items()},
+        "total_seconds": round(total, 4),
+        "pages_per_sec": round(prepared.pages / total, 2) if total > 0 else None
+    }
+
+
+def prepare_document(
+    user_id: str,
+    file_id: str,
+    filename: str,
+    pages: Iterable[dict],
+    num_pages: int | None = None,
+    on_progress: Callable[[float], None] | None = None
+) -> PreparedDocument:
+    """
+    Split and embed a document without touching the index.
+    Safe to run for many documents in parallel.
+
+    Pages are consumed one at a time; a batch is embedded as soon as
+    INGEST_EMBED_BATCH_SIZE new chunks are waiting. Repeated chunk text is
+    dropped, and text the user already has indexed is not embedded.
     """
+    timings = {"parse": 0.0, "split": 0.0, "embed": 0.0}
+    embeddings = get_embedding_model()
+    docs, hashes, vectors = [], [], []
+    seen = set()
+    pending = []  # positions in docs waiting to be embedded
+    pages_done = 0
 
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=700,
-        chunk_overlap=100
+    def embed_pending():
+        stage = time.perf_counter()
+        known = get_faiss_ids_by_text_hash(user_id, [hashes[i] for i in pending])
+        to_embed = [i for i in pending if hashes[i] not in known]
+        fresh = embeddings.embed_documents([docs[i].page_content for i in to_embed]) if to_embed else []
+        for i, vector in zip(to_embed, fresh):
+            vectors[i] = vector
+        pending.clear()
+        timings["embed"] += time.perf_counter() - stage
+
+    page_iter = iter(pages)
+    while True:
+        # 1️⃣ Wait for the next parsed page
+        stage = time.perf_counter()
+        page = next(page_iter, None)
+        timings["parse"] += time.perf_counter() - stage
+        if page is None:
+            break
+        pages_done += 1
+
+        # 2️⃣ Split it, dropping repeated chunks
+        stage = time.perf_counter()
+        for doc in split_pages(user_id, file_id, filename, [page]):
+            h = text_hash(doc.page_content)
+            if h in seen:
+                continue
+            seen.add(h)
+            pending.append(len(docs))
+            docs.append(doc)
+            hashes.append(h)
+            vectors.append(None)
+        timings["split"] += time.perf_counter() - stage
+
+        # 3️⃣ Embed a full batch while later pages are still being parsed
+        if len(pending) >= INGEST_EMBED_BATCH_SIZE:
+            embed_pending()
+
+        if on_progress and num_pages:
+            on_progress(min(pages_done / num_pages, 1.0))
+
+    if pending:
+        embed_pending()
+
+    return PreparedDocument(
+        user_id=user_id,
+        file_id=file_id,
+        filename=filename,
+        docs=docs,
+        vectors=vectors,
+        hashes=hashes,
+        pages=pages_done,
+        timings=timings
     )
 
-    vectorstore = get_user_vectorstore(user_id)
 
-    for page in extracted_pages:
-        docs = splitter.create_documents(
-            [page["text"]],
-            metadatas=[{
+def text_hash(text: str) -> str:
+    """
+    Hash of whitespace-normalized chunk text.
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def split_pages(
+    user_id: str,
+    file_id: str,
+    filename: str,
+    extracted_pages: list[dict]
+) -> list[Document]:
+    return splitter.create_documents(
+        [page["text"] for page in extracted_pages],
+        metadatas=[
+            {
                 "user_id": user_id,
                 "file_id": file_id,
                 "filename": filename,
                 "page": page["page"]
-            }]
-        )
-
-        # Get the current count before adding new docs
-        start_index = vectorstore.index.ntotal
-        
-        # 🔥 ONLY new docs are added
-        vectorstore.add_documents(docs)
-
-        # Store chunk metadata in MongoDB
-        for i, doc in enumerate(docs):
-            insert_chunk(
-                user_id=user_id,
-                file_id=file_id,
-                page_number=page["page"],
-                text_preview=doc.page_content,
-                faiss_index_id=start_index + i
-            )
-
-    save_user_vectorstore(vectorstore, user_id)
+            }
+            for page in extracted_pages
+        ]
+    )
@@ -0,0 +1,183 @@
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from rag.loaders import open_document_pages
+from rag.parallel_ingest import parallel_ingest_document
+from db.mongo import (
+    update_document_status,
+    touch_documents,
+    fail_documents,
+    fail_stale_documents,
+    delete_chunks_by_file
+)
+from dotenv import load_dotenv
+
+load_dotenv()
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "32"))
+# Queued and running jobs refresh their document this often; one not
+# refreshed for INGEST_STALE_SECONDS belongs to a process that died
+INGEST_HEARTBEAT_SECONDS = int(os.getenv("INGEST_HEARTBEAT_SECONDS", "30"))
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "120"))
+
+INTERRUPTED = "Indexing was interrupted by a server restart, upload the file again"
+
+logger = logging.getLogger(__name__)
+
+# Progress (percent) once every page is parsed and embedded
+EMBED_DONE = 95
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestJobQueue:
+    """
+    Bounded background pool that parses, embeds and indexes uploads.
+    State is written to the document record so any worker process can report it.
+    A heartbeat keeps this process's unfinished documents fresh and fails
+    the ones other (dead) processes left behind.
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="ingest"
+        )
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._active = set()  # file_ids queued or running here
+        self._active_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def start(self) -> None:
+        """
+        Fail documents orphaned by an earlier process, then keep ours alive.
+        """
+        if self._heartbeat is not None:
+            return
+        self._sweep()
+        self._heartbeat = threading.Thread(target=self._beat, name="ingest-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _sweep(self) -> None:
+        try:
+            failed = fail_stale_documents(stale_before(), INTERRUPTED)
+            if failed:
+                logger.warning(f"Marked {failed} interrupted ingest jobs as failed")
+        except Exception:
+            logger.exception("Sweep of interrupted ingest jobs failed")
+
+    def _beat(self) -> None:
+        while not self._stop.wait(INGEST_HEARTBEAT_SECONDS):
+            with self._active_lock:
+                active = list(self._active)
+            try:
+                touch_documents(active)
+            except Exception:
+                logger.exception("Ingest heartbeat failed")
+            self._sweep()
+
+    def submit(
+        self,
+        user_id: str,
+        file_id: str,
+        file_path: str,
+        filename: str,
+        job_id: str
+    ) -> None:
+        if not self._slots.acquire(blocking=False):
+            raise IngestQueueFull("Too many documents are being processed, try again shortly")
+
+        with self._active_lock:
+            self._active.add(file_id)
+        future = self._executor.submit(
+            run_ingest_job, user_id, file_id, file_path, filename, job_id
+        )
+        future.add_done_callback(lambda _: self._finished(file_id))
+
+    def _finished(self, file_id: str) -> None:
+        with self._active_lock:
+            self._active.discard(file_id)
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        # Taken first: cancelling runs the done callbacks
+        with self._active_lock:
+            active = list(self._active)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        # Cancelled jobs never run and running ones die with the process:
+        # fail them now instead of leaving them "queued" for good
+        try:
+            fail_documents(active, INTERRUPTED)
+        except Exception:
+            logger.exception("Could not mark interrupted ingest jobs as failed")
+
+
+def stale_before() -> datetime:
+    """
+    Unfinished documents not refreshed since then have no live job.
+    """
+    return datetime.utcnow() - timedelta(seconds=INGEST_STALE_SECONDS)
+
+
+def new_job_id() -> str:
+    return str(uuid.uuid4())
+
+
+def run_ingest_job(
+    user_id: str,
+    file_id: str,
+    file_path: str,
+    filename: str,
+    job_id: str
+) -> None:
+    try:
+        update_document_status(file_id, "parsing", progress=0)
+        file_type, num_pages, pages = open_document_pages(file_path, filename)
+
+        update_document_status(
+            file_id,
+            "parsing",
+            num_pages=num_pages,
+            file_type=file_type
+        )
+
+        # Parsing and embedding overlap, so both are reported as "embedding"
+        # once the first pages come through. Only write when the percent moves.
+        last_progress = -1
+
+        def on_progress(fraction: float):
+            nonlocal last_progress
+            progress = int(fraction * EMBED_DONE)
+            if progress != last_progress:
+                last_progress = progress
+                update_document_status(file_id, "embedding", progress=progress)
+
+        stats = parallel_ingest_document(
+            user_id=user_id,
+            file_id=file_id,
+            filename=filename,
+            extracted_pages=pages,
+            num_pages=num_pages,
+            on_progress=on_progress
+        )
+
+        update_document_status(file_id, "indexed", progress=100, ingest=stats)
+        logger.info(f"Ingest job {job_id} indexed {stats['chunks']} chunks")
+
+    except Exception as e:
+        logger.exception(f"Ingest job {job_id} failed")
+        update_document_status(file_id, "failed", error=str(e))
+        # A failed document must not come back with the next compaction
+        delete_chunks_by_file(user_id, file_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+ingest_queue = IngestJobQueue(INGEST_WORKERS, INGEST_MAX_PENDING)
@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import math
+import time
+import sys
+import threading
+import numpy as np
+from collections import OrderedDict, Counter
+from rag.vectorstore import LOAD_ATTEMPTS, get_user_index_path, get_index_version
+from rag.mmap_store import save_array, save_strings, load_strings
+from dotenv import load_dotenv
+
+load_dotenv()
+LEXICAL_CACHE_MAX_USERS = int(os.getenv("LEXICAL_CACHE_MAX_USERS", "64"))
+
+FORMAT_VERSION = 1
+LEXICAL_HEADER = "lexical.json"
+LEGACY_LEXICAL_FILE = "lexical.pkl"
+SEGMENT_RE = re.compile(r"lexical\.(\d+)\.")
+
+# A save appends one segment (the chunks added and removed since the last
+# save). Past this many segments, or once removed chunks outnumber live
+# ones, they are merged into one.
+LEXICAL_MAX_SEGMENTS = 16
+
+# On-disk index beside the user's FAISS generations:
+#   lexical.json                    header: segments in replay order
+#   lexical.<n>.removed.npy/.off    docstore ids the segment removes (applied first)
+#   lexical.<n>.ids.npy/.off        docstore ids of the chunks it adds (UTF-8 + offsets)
+#   lexical.<n>.vocab.npy/.off      the segment's terms
+#   lexical.<n>.rows.npy            int64 offsets into terms / tf per added chunk
+#   lexical.<n>.terms.npy           int32 codes into vocab
+#   lexical.<n>.tf.npy              int32 term frequencies
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# How often (in postings) the search loop looks at the clock
+DEADLINE_CHECK_EVERY = 256
+
+# Keeps codes like "CS-101", "18CS52" or "x_i" together as one term
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SPLIT_RE = re.compile(r"[-_./]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or "
+    "that the this to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lowercased terms. Compound tokens are indexed both joined ("cs101")
+    and as their parts ("cs", "101") so either spelling matches.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        parts = SPLIT_RE.split(token)
+        if len(parts) > 1:
+            terms.append("".join(parts))
+            terms.extend(p for p in parts if p not in STOPWORDS)
+        elif token not in STOPWORDS:
+            terms.append(token)
+    return terms
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over one user's chunks.
+
+    Keyed by docstore id, so it always mirrors the user's FAISS docstore:
+    sync() adds chunks the docstore has and drops the ones it lost.
+    """
+
+    def __init__(self):
+        self.postings = {}   # term -> {doc_id: term frequency}
+        self.doc_len = {}    # doc_id -> number of terms
+        self.doc_terms = {}  # doc_id -> its distinct terms (postings to touch on removal)
+        self.total_len = 0
+        self.version = None
+        self.lock = threading.Lock()
+        # Changes since the last save, and the header they apply on top of
+        self.added = set()
+        self.removed = []
+        self.saved_next = None
+
+    def _insert(self, doc_id: str, terms: dict[str, int]) -> None:
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(terms.values())
+        self.doc_len[doc_id] = length
+        self.doc_terms[doc_id] = tuple(terms)
+        self.total_len += length
+
+    def add(self, doc_id: str, text: str) -> None:
+        # Interned: each doc's term tuple shares the strings with postings
+        self._insert(doc_id, Counter(sys.intern(term) for term in tokenize(text)))
+        self.added.add(doc_id)
+
+    def remove(self, doc_ids) -> None:
+        """
+        Drop chunks; only the postings of their own terms are touched.
+        """
+        for doc_id in set(doc_ids) & self.doc_len.keys():
+            for term in self.doc_terms.pop(doc_id):
+                posting = self.postings[term]
+                del posting[doc_id]
+                if not posting:
+                    del self.postings[term]
+            self.total_len -= self.doc_len.pop(doc_id)
+            if doc_id in self.added:
+                self.added.discard(doc_id)
+            else:
+                self.removed.append(doc_id)
+
+    def sync(self, vectorstore) -> None:
+        """
+        Make the index match the docstore: index new chunks, drop removed ones.
+        Cost is proportional to the change (plus one set difference).
+        """
+        stored = set(vectorstore.index_to_docstore_id.values())
+        self.remove(self.doc_len.keys() - stored)
+        for doc_id in stored - self.doc_len.keys():
+            doc = vectorstore.docstore.search(doc_id)
+            self.add(doc_id, getattr(doc, "page_content", ""))
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        deadline: float | None = None,
+        allowed: set[str] | None = None
+    ) -> list[str]:
+        """
+        Top-k docstore ids by BM25. Rare terms are scored first; if the
+        deadline (time.perf_counter()) passes, the scores so far are used.
+        allowed restricts scoring to those ids (a document-scoped query).
+        """
+        n = len(self.doc_len)
+        if not n:
+            return []
+        avg_len = self.total_len / n
+
+        terms = [t for t in set(tokenize(query)) if t in self.postings]
+        terms.sort(key=lambda t: len(self.postings[t]))
+
+        scores = {}
+        seen = 0
+        expired = False
+        for term in terms:
+            posting = self.postings[term]
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+                seen += 1
+                if deadline is not None and seen % DEADLINE_CHECK_EVERY == 0:
+                    expired = time.perf_counter() > deadline
+                    if expired:
+                        break
+            if expired:
+                break
+
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+_cache = OrderedDict()  # user_id -> LexicalIndex
+_cache_lock = threading.Lock()
+
+
+def _read_header(base: str) -> dict | None:
+    try:
+        with open(os.path.join(base, LEXICAL_HEADER)) as f:
+            header = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    return header if header.get("format") == FORMAT_VERSION else None
+
+
+def _write_segment(base: str, n: int, index: LexicalIndex, doc_ids: list[str], removed: list[str]) -> None:
+    vocab, code_of = [], {}
+    rows = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    terms, tfs = [], []
+    for i, doc_id in enumerate(doc_ids):
+        for term in index.doc_terms[doc_id]:
+            code = code_of.get(term)
+            if code is None:
+                code = code_of[term] = len(vocab)
+                vocab.append(term)
+            terms.append(code)
+            tfs.append(index.postings[term][doc_id])
+        rows[i + 1] = len(terms)
+
+    name = f"lexical.{n}"
+    save_strings(base, f"{name}.removed", removed)
+    save_strings(base, f"{name}.ids", doc_ids)
+    save_strings(base, f"{name}.vocab", vocab)
+    save_array(os.path.join(base, f"{name}.rows.npy"), rows)
+    save_array(os.path.join(base, f"{name}.terms.npy"), np.array(terms, dtype=np.int32))
+    save_array(os.path.join(base, f"{name}.tf.npy"), np.array(tfs, dtype=np.int32))
+
+
+def _apply_segment(index: LexicalIndex, base: str, n: int) -> None:
+    name = f"lexical.{n}"
+    index.remove(load_strings(base, f"{name}.removed"))
+    doc_ids = load_strings(base, f"{name}.ids")
+    vocab = [sys.intern(term) for term in load_strings(base, f"{name}.vocab")]
+    rows = np.load(os.path.join(base, f"{name}.rows.npy")).tolist()
+    terms = np.load(os.path.join(base, f"{name}.terms.npy")).tolist()
+    tfs = np.load(os.path.join(base, f"{name}.tf.npy")).tolist()
+    for i, doc_id in enumerate(doc_ids):
+        start, end = rows[i], rows[i + 1]
+        index._insert(doc_id, {vocab[code]: tf for code, tf in zip(terms[start:end], tfs[start:end])})
+
+
+def _load(user_id: str) -> LexicalIndex:
+    base = get_user_index_path(user_id)
+    for _ in range(LOAD_ATTEMPTS):
+        index = LexicalIndex()
+        header = _read_header(base)
+        if header is None:
+            return index
+        try:
+            for segment in header["segments"]:
+                _apply_segment(index, base, segment["n"])
+        except FileNotFoundError:
+            # Merged away by the index writer meanwhile: read the new header
+            continue
+        except (KeyError, ValueError):
+            return LexicalIndex()
+        index.added.clear()
+        index.removed.clear()
+        index.saved_next = header["next"]
+        return index
+    return LexicalIndex()
+
+
+def _save(user_id: str, index: LexicalIndex, rebuild: bool) -> None:
+    """
+    Append the changes since the last save as one segment, or merge
+    everything into one. Only the index writer saves (under its lock).
+    """
+    base = get_user_index_path(user_id)
+    os.makedirs(base, exist_ok=True)
+    header = _read_header(base)
+    merge = (
+        rebuild
+        or header is None
+        # Another worker saved since this copy was loaded
+        or header["next"] != index.saved_next
+        or len(header["segments"]) >= LEXICAL_MAX_SEGMENTS
+        or sum(s["removed"] for s in header["segments"]) + len(index.removed) > len(index.doc_len)
+    )
+
+    n = header["next"] if header is not None else 0
+    if merge:
+        doc_ids, removed, segments = list(index.doc_len), [], []
+    else:
+        doc_ids, removed, segments = list(index.added), index.removed, header["segments"]
+    _write_segment(base, n, index, doc_ids, removed)
+    segments = [*segments, {"n": n, "rows": len(doc_ids), "removed": len(removed)}]
+
+    # Header last: readers never see a segment before its files
+    path = os.path.join(base, LEXICAL_HEADER)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"format": FORMAT_VERSION, "next": n + 1, "segments": segments}, f)
+    os.replace(path + ".tmp", path)
+    index.added.clear()
+    index.removed = []
+    index.saved_next = n + 1
+
+    if merge:
+        live = {s["n"] for s in segments}
+        for name in os.listdir(base):
+            match = SEGMENT_RE.match(name)
+            if name == LEGACY_LEXICAL_FILE or (match and int(match.group(1)) not in live):
+                try:
+                    os.remove(os.path.join(base, name))
+                except FileNotFoundError:
+                    pass
+
+
+def _cache_put(user_id: str, index: LexicalIndex) -> None:
+    with _cache_lock:
+        _cache[user_id] = index
+        _cache.move_to_end(user_id)
+        while len(_cache) > LEXICAL_CACHE_MAX_USERS:
+            _cache.popitem(last=False)
+
+
+def get_lexical_index(user_id: str, vectorstore) -> LexicalIndex:
+    """
+    The user's lexical index, matching the current on-disk index version.
+    A missing or stale file is caught up from the docstore.
+    """
+    version = get_index_version(user_id)
+    with _cache_lock:
+        index = _cache.get(user_id)
+        if index is not None and index.version == version:
+            _cache.move_to_end(user_id)
+            return index
+
+    index = _load(user_id)
+    with index.lock:
+        index.sync(vectorstore)
+        index.version = version
+    _cache_put(user_id, index)
+    return index
+
+
+def update_lexical_index(
+    user_id: str,
+    vectorstore,
+    rebuild: bool = False,
+    removed: list[str] | None = None
+) -> None:
+    """
+    Called by the index writer right after the FAISS index is saved.
+    Only the chunks that changed are written (a new segment).
+    rebuild=True starts from scratch (compaction renumbers every id).
+    removed: the only change is that these ids were deleted (no docstore scan).
+    """
+    with _cache_lock:
+        index = None if rebuild else _cache.get(user_id)
+    if index is None:
+        index = LexicalIndex() if rebuild else _load(user_id)
+        removed = None  # may be behind the docstore: catch up in full
+
+    with index.lock:
+        if removed is None:
+            index.sync(vectorstore)
+        else:
+            index.remove(removed)
+        index.version = get_index_version(user_id)
+        _save(user_id, index, rebuild)
+    _cache_put(user_id, index)
+
+
+def invalidate_lexical_index(user_id: str) -> None:
+    with _cache_lock:
+        _cache.pop(user_id, None)
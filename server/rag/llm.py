@@ -0,0 +1,99 @@
+import os
+import itertools
+import threading
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.output_parsers import StrOutputParser
+from langchain_classic.chains.question_answering import load_qa_chain
+from dotenv import load_dotenv
+
+load_dotenv()
+MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "4"))
+
+
+class LLMPool:
+    """
+    A few long-lived Gemini clients shared by every request.
+
+    Each client keeps its HTTP connections alive between calls; requests are
+    spread round-robin over the slots. Chains built on top of a client
+    (prompt | llm | parser, stuff chains, ...) are compiled once per slot
+    and reused, so a request only binds its own retriever.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self._clients = {}  # (streaming, slot) -> client
+        self._chains = {}   # (kind, id(prompt), streaming, slot) -> chain
+        self._prompts = {}  # id(prompt) -> prompt, keeps ids stable
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def _slot(self) -> int:
+        return next(self._next) % self.size
+
+    def client(self, streaming: bool = False, slot: int | None = None) -> ChatGoogleGenerativeAI:
+        slot = self._slot() if slot is None else slot
+        with self._lock:
+            llm = self._clients.get((streaming, slot))
+            if llm is None:
+                llm = self._clients[(streaming, slot)] = ChatGoogleGenerativeAI(
+                    model=MODEL,
+                    temperature=0,
+                    google_api_key=GOOGLE_API_KEY,
+                    **({"streaming": True} if streaming else {})
+                )
+            return llm
+
+    def chain(self, kind: str, prompt, build, streaming: bool = False):
+        slot = self._slot()
+        key = (kind, id(prompt), streaming, slot)
+        with self._lock:
+            chain = self._chains.get(key)
+        if chain is None:
+            chain = build(self.client(streaming, slot), prompt)
+            with self._lock:
+                self._prompts[id(prompt)] = prompt
+                chain = self._chains.setdefault(key, chain)
+        return chain
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "clients": len(self._clients),
+                "chains": len(self._chains)
+            }
+
+
+llm_pool = LLMPool(LLM_POOL_SIZE)
+
+
+def get_llm(streaming: bool = False) -> ChatGoogleGenerativeAI:
+    return llm_pool.client(streaming)
+
+
+def get_text_chain(prompt, streaming: bool = False):
+    """
+    prompt | llm | StrOutputParser, built once per pooled client.
+    """
+    return llm_pool.chain(
+        "text",
+        prompt,
+        lambda llm, p: p | llm | StrOutputParser(),
+        streaming
+    )
+
+
+def get_stuff_chain(prompt=None, streaming: bool = False):
+    """
+    "stuff" combine-documents chain for RetrievalQA.
+    prompt=None uses LangChain's default QA prompt.
+    """
+    return llm_pool.chain(
+        "stuff",
+        prompt,
+        lambda llm, p: load_qa_chain(llm, chain_type="stuff", **({"prompt": p} if p else {})),
+        streaming
+    )
@@ -0,0 +1,109 @@
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+from pypdf import PdfReader
+from langchain_community.document_loaders import Docx2txtLoader
+from dotenv import load_dotenv
+
+load_dotenv()
+PDF_EXTRACT_PROCESSES = int(os.getenv("PDF_EXTRACT_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "20"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+
+# Page ranges submitted ahead of the consumer; bounds memory on huge PDFs
+PDF_MAX_INFLIGHT_TASKS = PDF_EXTRACT_PROCESSES * 2
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_supported_file(filename: str) -> bool:
+    return filename.lower().endswith(SUPPORTED_EXTENSIONS)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded server process is not safe
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_extract_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _extract_pdf_range(file_path: str, start: int, end: int) -> list[dict]:
+    """
+    Runs in a worker process: extract text for pages [start, end).
+    """
+    reader = PdfReader(file_path)
+    return [
+        {"page": i + 1, "text": reader.pages[i].extract_text() or ""}
+        for i in range(start, end)
+    ]
+
+
+def _iter_pdf_pages(file_path: str, num_pages: int) -> Iterator[dict]:
+    if num_pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_PROCESSES <= 1:
+        reader = PdfReader(file_path)
+        for i, page in enumerate(reader.pages):
+            yield {"page": i + 1, "text": page.extract_text() or ""}
+        return
+
+    # Spread page ranges over the process pool, yield them back in page order
+    pool = _get_pool()
+    ranges = deque(
+        (start, min(start + PDF_PAGES_PER_TASK, num_pages))
+        for start in range(0, num_pages, PDF_PAGES_PER_TASK)
+    )
+    inflight = deque()
+    try:
+        while ranges or inflight:
+            while ranges and len(inflight) < PDF_MAX_INFLIGHT_TASKS:
+                start, end = ranges.popleft()
+                inflight.append(pool.submit(_extract_pdf_range, file_path, start, end))
+            yield from inflight.popleft().result()
+    finally:
+        # Consumer stopped early (error or cancellation): drop queued ranges
+        for future in inflight:
+            future.cancel()
+
+
+def _iter_docx_pages(file_path: str) -> Iterator[dict]:
+    docs = Docx2txtLoader(file_path).load()
+    # DOCX usually has no pages
+    yield {"page": 1, "text": docs[0].page_content if docs else ""}
+
+
+# LOAD DOCUMENT AS A PAGE STREAM
+
+def open_document_pages(file_path: str, filename: str) -> tuple[str, int, Iterator[dict]]:
+    """
+    Returns (file_type, num_pages, pages) where pages is a generator of
+    {"page": int, "text": str}. Large PDFs are parsed in a process pool,
+    so callers can split and embed early pages while later ones are parsed.
+    """
+    filename_lower = filename.lower()
+
+    if filename_lower.endswith(".pdf"):
+        num_pages = len(PdfReader(file_path).pages)
+        return "pdf", num_pages, _iter_pdf_pages(file_path, num_pages)
+
+    elif filename_lower.endswith(".docx"):
+        return "docx", 1, _iter_docx_pages(file_path)
+
+    raise ValueError("Unsupported file type. Only PDF and DOCX files are supported.")
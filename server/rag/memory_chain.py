@@ -1,25 +1,133 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_classic.chains.conversational_retrieval.base import ConversationalRetrievalChain
+from langchain_classic.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain_core.prompts import PromptTemplate
+from concurrent.futures import ThreadPoolExecutor
 from rag.retriever import get_retriever
+from rag.llm import get_text_chain
 import os
+import re
 from dotenv import load_dotenv
 load_dotenv()
 
-MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-def get_conversational_rag_chain(user_id: str):
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL,
-        temperature=0,
-        google_api_key=GOOGLE_API_KEY
+# always: rewrite every follow-up
+# auto: rewrite only follow-ups that are not self-contained
+# parallel: rewrite while retrieving on the raw question, merge both results
+# off: never rewrite; the answer prompt still sees the history
+CONDENSE_STRATEGY = os.getenv("CONDENSE_STRATEGY", "auto").lower()
+CONDENSE_STRATEGIES = ("always", "auto", "parallel", "off")
+if CONDENSE_STRATEGY not in CONDENSE_STRATEGIES:
+    raise ValueError(
+        f"Unknown CONDENSE_STRATEGY {CONDENSE_STRATEGY!r} (expected one of {', '.join(CONDENSE_STRATEGIES)})"
     )
 
-    retriever = get_retriever(user_id)
+ANSWER_PROMPT = PromptTemplate(
+    input_variables=["context", "chat_history", "question"],
+    template="""
+Use the following pieces of context to answer the question at the end.
+If you don't know the answer, just say that you don't know, don't try to make up an answer.
 
-    return ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=retriever,
-        return_source_documents=True,
-        verbose=True
-    )
+{context}
+
+Conversation so far:
+{chat_history}
+
+Question: {question}
+Helpful Answer:"""
+)
+
+# Words that only make sense with the previous turns in mind
+FOLLOW_UP_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "him", "his", "she", "her", "there", "above", "previous",
+    "earlier", "former", "latter", "same", "more", "else", "also", "again"
+}
+FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "what about", "how about", "why not", "then ")
+MIN_SELF_CONTAINED_WORDS = 4
+
+_condense_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="condense")
+
+
+def is_self_contained(question: str) -> bool:
+    """
+    Cheap local check: can the question be retrieved on as it is?
+    Short questions and ones with pronouns or follow-up phrasing are not.
+    """
+    text = question.strip().lower()
+    words = re.findall(r"[a-z']+", text)
+    if len(words) < MIN_SELF_CONTAINED_WORDS:
+        return False
+    if text.startswith(FOLLOW_UP_OPENERS):
+        return False
+    return not FOLLOW_UP_WORDS.intersection(words)
+
+
+def format_chat_history(chat_history: list) -> str:
+    lines = []
+    for role, text in chat_history:
+        if role == "summary":
+            lines.append(f"Summary of the earlier conversation: {text}")
+        else:
+            lines.append(f"{'Human' if role == 'human' else 'Assistant'}: {text}")
+    return "\n".join(lines)
+
+
+def run_conversational_query(
+    user_id: str,
+    question: str,
+    chat_history: list,
+    strategy: str = CONDENSE_STRATEGY,
+    file_ids: list[str] | None = None
+) -> dict:
+    """
+    Conversational RAG with a configurable question-rewrite step.
+    file_ids restricts retrieval to those documents.
+    Returns {"answer", "source_documents", "standalone_question", "llm_calls"}.
+    """
+    if strategy not in CONDENSE_STRATEGIES:
+        raise ValueError(f"Unknown condense strategy: {strategy}")
+
+    retriever = get_retriever(user_id, file_ids=file_ids)
+    history = format_chat_history(chat_history)
+    condense = get_text_chain(CONDENSE_QUESTION_PROMPT)
+    llm_calls = 0
+
+    if not chat_history or strategy == "off":
+        rewrite = False
+    elif strategy == "auto":
+        rewrite = not is_self_contained(question)
+    else:
+        rewrite = True
+
+    # 1️⃣ Standalone question + retrieval
+    standalone = question
+    if rewrite and strategy == "parallel":
+        pending = _condense_pool.submit(
+            condense.invoke, {"chat_history": history, "question": question}
+        )
+        rankings = retriever.rankings(question)
+        standalone = pending.result().strip() or question
+        llm_calls += 1
+        if standalone != question:
+            rankings += retriever.rankings(standalone)
+        # One fused, packed context: as many chunks and tokens as any other strategy
+        docs = retriever.fuse(rankings)
+    elif rewrite:
+        standalone = condense.invoke({"chat_history": history, "question": question}).strip() or question
+        llm_calls += 1
+        docs = retriever.invoke(standalone)
+    else:
+        docs = retriever.invoke(question)
+
+    # 2️⃣ Answer (history included when the question was not rewritten)
+    answer = get_text_chain(ANSWER_PROMPT).invoke({
+        "context": "\n\n".join(doc.page_content for doc in docs),
+        "chat_history": "" if rewrite else history,
+        "question": standalone
+    })
+    llm_calls += 1
+
+    return {
+        "answer": answer,
+        "source_documents": docs,
+        "standalone_question": standalone,
+        "llm_calls": llm_calls
+    }
@@ -0,0 +1,337 @@
+import os
+import json
+import threading
+import numpy as np
+from collections.abc import Mapping, MutableMapping
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+
+FORMAT_VERSION = 1
+HEADER_FILE = "docs.json"
+LEGACY_FILE = "index.pkl"
+
+# On-disk docstore next to index.faiss. Row i is FAISS position i.
+#   docs.json            header: row count, index kind, metadata columns
+#   docs.text.npy        UTF-8 page_content of every row, concatenated (uint8)
+#   docs.text.off.npy    int64 byte offsets into it (rows + 1)
+#   docs.ids.npy         docstore ids, same layout
+#   docs.ids.off.npy
+#   docs.num_ids.npy     int64 id per row when the id is numeric, else -1
+#   docs.col<i>.npy      one metadata column: int64 values, or int32 codes
+#                        into the header's category list (-1 = key absent)
+# Everything is opened with mmap: loading costs a few page faults instead
+# of unpickling one Document per chunk.
+
+
+def has_docstore_files(path: str) -> bool:
+    return os.path.exists(os.path.join(path, HEADER_FILE))
+
+
+def read_header(path: str) -> dict:
+    with open(os.path.join(path, HEADER_FILE)) as f:
+        return json.load(f)
+
+
+def save_array(path: str, array: np.ndarray) -> None:
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def save_strings(path: str, name: str, values: list[str]) -> None:
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    save_array(os.path.join(path, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    save_array(os.path.join(path, f"{name}.off.npy"), offsets)
+
+
+def load_strings(path: str, name: str) -> list[str]:
+    """
+    All values written by save_strings, read eagerly.
+    """
+    raw = np.load(os.path.join(path, f"{name}.npy")).tobytes()
+    offsets = np.load(os.path.join(path, f"{name}.off.npy")).tolist()
+    return [raw[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+
+_ABSENT = object()
+
+
+def _encode_column(values: list) -> tuple[dict, np.ndarray]:
+    """
+    Int columns are stored as is; anything else (strings, None, missing
+    keys) is dictionary-encoded: file ids and filenames repeat per chunk.
+    """
+    if all(type(v) is int for v in values):
+        return {"type": "int"}, np.array(values, dtype=np.int64)
+
+    categories, code_of = [], {}
+    codes = np.full(len(values), -1, dtype=np.int32)
+    for row, value in enumerate(values):
+        if value is _ABSENT:
+            continue
+        key = json.dumps(value)
+        if key not in code_of:
+            code_of[key] = len(categories)
+            categories.append(value)
+        codes[row] = code_of[key]
+    return {"type": "category", "categories": categories}, codes
+
+
+def _numeric_id(doc_id: str) -> int:
+    return int(doc_id) if doc_id.isdigit() and str(int(doc_id)) == doc_id else -1
+
+
+def write_docstore(path: str, ids: list[str], docs: list[Document], index_kind: str) -> None:
+    """
+    Write the docstore files for rows in FAISS position order.
+    The header goes last, so a reader never sees it ahead of its columns.
+    """
+    os.makedirs(path, exist_ok=True)
+    save_strings(path, "docs.text", [doc.page_content for doc in docs])
+    save_strings(path, "docs.ids", ids)
+
+    num_ids = np.array([_numeric_id(doc_id) for doc_id in ids], dtype=np.int64)
+    save_array(os.path.join(path, "docs.num_ids.npy"), num_ids)
+
+    names = []
+    for doc in docs:
+        names.extend(key for key in doc.metadata if key not in names)
+    columns = []
+    for i, name in enumerate(names):
+        spec, array = _encode_column([doc.metadata.get(name, _ABSENT) for doc in docs])
+        save_array(os.path.join(path, f"docs.col{i}.npy"), array)
+        columns.append({"name": name, **spec})
+
+    header = {
+        "format": FORMAT_VERSION,
+        "rows": len(ids),
+        "index_kind": index_kind,
+        # Stable ids grow with position, so lookups can bisect
+        "num_ids_sorted": bool(len(num_ids) == 0 or (num_ids.min() >= 0 and np.all(np.diff(num_ids) > 0))),
+        "columns": columns
+    }
+    header_path = os.path.join(path, HEADER_FILE)
+    with open(header_path + ".tmp", "w") as f:
+        json.dump(header, f)
+    os.replace(header_path + ".tmp", header_path)
+
+
+class StoredDocs:
+    """
+    Read-only, memory-mapped view of one user's docstore files.
+    """
+
+    def __init__(self, path: str):
+        self.header = read_header(path)
+        if self.header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported docstore format in {path}: {self.header.get('format')}")
+        self.rows = self.header["rows"]
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self._text, self._text_off = load("docs.text"), load("docs.text.off")
+        self._ids, self._ids_off = load("docs.ids"), load("docs.ids.off")
+        self._num_ids = load("docs.num_ids")
+        self._columns = [(spec, load(f"docs.col{i}")) for i, spec in enumerate(self.header["columns"])]
+        self._row_of = None  # id -> row, only built for non-numeric ids
+        self._lock = threading.Lock()
+
+    def text(self, row: int) -> str:
+        return bytes(self._text[self._text_off[row]:self._text_off[row + 1]]).decode("utf-8")
+
+    def doc_id(self, row: int) -> str:
+        return bytes(self._ids[self._ids_off[row]:self._ids_off[row + 1]]).decode("utf-8")
+
+    def metadata(self, row: int) -> dict:
+        metadata = {}
+        for spec, values in self._columns:
+            if spec["type"] == "int":
+                metadata[spec["name"]] = int(values[row])
+            elif values[row] >= 0:
+                metadata[spec["name"]] = spec["categories"][values[row]]
+        return metadata
+
+    def document(self, row: int) -> Document:
+        doc_id = self.doc_id(row)
+        return Document(id=doc_id, page_content=self.text(row), metadata=self.metadata(row))
+
+    def row_of(self, doc_id: str) -> int | None:
+        numeric = _numeric_id(doc_id)
+        if numeric >= 0 and self.header["num_ids_sorted"]:
+            row = int(np.searchsorted(self._num_ids, numeric))
+            return row if row < self.rows and self._num_ids[row] == numeric else None
+
+        if self._row_of is None:
+            with self._lock:
+                if self._row_of is None:
+                    self._row_of = {self.doc_id(row): row for row in range(self.rows)}
+        return self._row_of.get(doc_id)
+
+    def max_numeric_id(self) -> int:
+        return int(self._num_ids.max()) if self.rows else -1
+
+    def rows_of_numeric(self, ids: np.ndarray) -> np.ndarray | None:
+        """
+        Rows of many numeric ids at once (ids not stored are dropped).
+        None if the id column is not sorted.
+        """
+        if not self.header["num_ids_sorted"]:
+            return None
+        rows = np.searchsorted(self._num_ids, ids)
+        found = rows < self.rows
+        found[found] = self._num_ids[rows[found]] == ids[found]
+        return rows[found]
+
+    def resident_bytes(self) -> int:
+        # Mapped pages belong to the page cache; only the lookup dict is heap
+        return len(self._row_of) * 120 if self._row_of else 0
+
+
+class MmapDocstore(Docstore, AddableMixin):
+    """
+    Docstore over StoredDocs. Documents are built on lookup, never held.
+    Adds and deletes go to a small in-memory overlay (the index writer's
+    private copy); the next save folds them into new files. deleted_rows
+    are hidden the same way, but on disk (see PositionIds.deleted).
+    """
+
+    def __init__(self, stored: StoredDocs, deleted_rows=()):
+        self.stored = stored
+        self._added = {}
+        self._deleted = set()
+        self._deleted_rows = set(deleted_rows)
+
+    def _stored_row(self, doc_id: str) -> int | None:
+        if doc_id in self._deleted:
+            return None
+        row = self.stored.row_of(doc_id)
+        return None if row in self._deleted_rows else row
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._added or self._stored_row(doc_id) is not None
+
+    def search(self, search: str) -> Document | str:
+        if search in self._added:
+            return self._added[search]
+        row = self._stored_row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.stored.document(row)
+
+    def add(self, texts: dict[str, Document]) -> None:
+        overlapping = {doc_id for doc_id in texts if doc_id in self}
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.update(texts)
+
+    def delete(self, ids: list) -> None:
+        if not any(doc_id in self for doc_id in ids):
+            raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+        for doc_id in ids:
+            if self._added.pop(doc_id, None) is None:
+                self._deleted.add(doc_id)
+
+    def copy(self) -> "MmapDocstore":
+        clone = MmapDocstore(self.stored, self._deleted_rows)
+        clone._added = dict(self._added)
+        clone._deleted = set(self._deleted)
+        return clone
+
+    @property
+    def pending(self) -> dict[str, Document]:
+        """
+        Documents added since the files were written.
+        """
+        return self._added
+
+
+class PositionIds(MutableMapping):
+    """
+    index_to_docstore_id (FAISS position -> docstore id) read from the
+    stored id column. Appends (FAISS.add_embeddings) land in an overlay;
+    deletes replace the whole map with a dict, as langchain does.
+    Positions in deleted (sorted) were deleted without rewriting the
+    files: they are still in the index, but hidden here.
+    """
+
+    def __init__(self, stored: StoredDocs, deleted: np.ndarray | None = None):
+        self.stored = stored
+        self._appended = {}
+        self.deleted = np.zeros(0, dtype=np.int64) if deleted is None else deleted
+        self._deleted = set(self.deleted.tolist())
+
+    def __getitem__(self, position: int) -> str:
+        if position in self._appended:
+            return self._appended[position]
+        if isinstance(position, (int, np.integer)) and 0 <= position < self.stored.rows \
+                and position not in self._deleted:
+            return self.stored.doc_id(int(position))
+        raise KeyError(position)
+
+    def __setitem__(self, position: int, doc_id: str) -> None:
+        self._appended[position] = doc_id
+
+    def __delitem__(self, position: int) -> None:
+        raise TypeError("Positions are compacted by rebuilding index_to_docstore_id")
+
+    def __iter__(self):
+        yield from (p for p in range(self.stored.rows) if p not in self._deleted)
+        yield from (p for p in self._appended if not 0 <= p < self.stored.rows)
+
+    def __len__(self) -> int:
+        appended = sum(1 for p in self._appended if not 0 <= p < self.stored.rows)
+        return self.stored.rows - len(self._deleted) + appended
+
+    def copy(self) -> "PositionIds":
+        clone = PositionIds(self.stored, self.deleted)
+        clone._appended = dict(self._appended)
+        return clone
+
+    def doc_id_at(self, position: int) -> str:
+        """
+        Docstore id at a position, deleted or not.
+        """
+        if 0 <= position < self.stored.rows:
+            return self.stored.doc_id(position)
+        return self._appended[position]
+
+    def max_numeric_id(self) -> int:
+        appended = [_numeric_id(doc_id) for doc_id in self._appended.values()]
+        return max([self.stored.max_numeric_id(), *appended])
+
+    def positions_of_numeric(self, ids: np.ndarray) -> np.ndarray | None:
+        if self._appended:
+            return None
+        rows = self.stored.rows_of_numeric(ids)
+        if rows is not None and self._deleted:
+            rows = rows[~np.isin(rows, self.deleted)]
+        return rows
+
+    def positions(self) -> Mapping:
+        """
+        Reverse map (docstore id -> position) without materialising it.
+        """
+        if self._appended:
+            return {doc_id: pos for pos, doc_id in self.items()}
+        return _StoredPositions(self.stored, self._deleted)
+
+
+class _StoredPositions(Mapping):
+    def __init__(self, stored: StoredDocs, deleted: set[int]):
+        self.stored = stored
+        self.deleted = deleted
+
+    def __getitem__(self, doc_id: str) -> int:
+        row = self.stored.row_of(doc_id)
+        if row is None or row in self.deleted:
+            raise KeyError(doc_id)
+        return row
+
+    def __iter__(self):
+        return (self.stored.doc_id(row) for row in range(self.stored.rows) if row not in self.deleted)
+
+    def __len__(self) -> int:
+        return self.stored.rows - len(self.deleted)
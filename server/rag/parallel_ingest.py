@@ -1,16 +1,27 @@
-from concurrent.futures import ThreadPoolExecutor
 from rag.ingest import ingest_new_document
 
 def parallel_ingest_document(
     user_id: str,
     file_id: str,
     filename: str,
-    extracted_pages: list,
-    max_workers: int = 4
+    extracted_pages,
+    num_pages: int | None = None,
+    on_progress=None
 ):
     """
-    Wrapper for ingestion. 
-    NOTE: Parallel ingestion is disabled because FAISS file persistence is not thread-safe.
-    Concurrent writes to the same 'faiss_index/{user_id}' folder result in data loss.
+    Ingest entry point for the background job pool.
+    extracted_pages may be a generator fed by the PDF process pool, so
+    parsing overlaps with splitting and embedding.
+    Splitting and embedding run concurrently across jobs; index writes go
+    through the per-user coordinator (rag.index_writer), which serializes
+    saves to 'faiss_index/{user_id}' and coalesces documents queued for the
+    same user into one update. Different users are written in parallel.
     """
-    ingest_new_document(user_id, file_id, filename, extracted_pages)
+    return ingest_new_document(
+        user_id,
+        file_id,
+        filename,
+        extracted_pages,
+        num_pages=num_pages,
+        on_progress=on_progress
+    )
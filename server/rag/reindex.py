@@ -1,33 +1,129 @@
-import os
 import shutil
+import numpy as np
+from pymongo import UpdateOne
 from langchain_community.vectorstores import FAISS
-from rag.vectorstore import get_embedding_model
+from rag.vectorstore import (
+    get_embedding_model,
+    get_user_index_path,
+    save_user_vectorstore,
+    invalidate_user_vectorstore
+)
+from rag.vector_archive import (
+    load_vectors,
+    stage_vectors,
+    promote_staged_vectors,
+    archive_generation,
+    staged_generation
+)
+from rag.lexical_index import update_lexical_index, invalidate_lexical_index
+from rag.file_scope import update_file_table, invalidate_file_table
+from rag.ann_index import maybe_migrate
+from rag.index_writer import index_writer
 from db.mongo import chunks_col
 
+
 def rebuild_user_faiss_index(user_id: str):
     """
-    Rebuild FAISS index from MongoDB chunks (after deletion).
+    Compaction: rebuild the FAISS index from MongoDB chunks and the vector
+    archive, and renumber faiss_index_id contiguously. Only run on explicit request
+    (or by the index writer, to finish one that was interrupted).
+    Runs under the user's index writer lock so no ingest/delete interleaves.
     """
+    index_writer.run_exclusive(user_id, _rebuild_user_faiss_index, user_id)
+
+
+def _rebuild_user_faiss_index(user_id: str):
     chunks = list(chunks_col.find(
         {"user_id": user_id},
         {"_id": 0}
-    ))
+    ).sort("faiss_index_id", 1))
 
     if not chunks:
-        shutil.rmtree(f"faiss_index/{user_id}", ignore_errors=True)
+        shutil.rmtree(get_user_index_path(user_id), ignore_errors=True)
+        invalidate_user_vectorstore(user_id)
+        invalidate_lexical_index(user_id)
+        invalidate_file_table(user_id)
         return
 
-    texts = [c["text_preview"] for c in chunks]
+    # Deduplicated chunks of different documents share one vector; rebuild
+    # one entry per shared vector. Older chunks have no text_hash and are
+    # never grouped (their faiss_index_id may be stale). After an interrupted
+    # compaction, ids of different archive generations are different vectors.
+    groups = {}
+    for c in chunks:
+        key = (c.get("archive_generation", 0), c["faiss_index_id"], c.get("text_hash") or c["chunk_id"])
+        groups.setdefault(key, []).append(c)
+    members = list(groups.values())
+    chunks = [group[0] for group in members]
+
+    # Older chunks only stored a 200-char preview
+    texts = [c.get("text", c["text_preview"]) for c in chunks]
     metadatas = [
         {
+            "user_id": user_id,
             "file_id": c["file_id"],
-            "page": c["page_number"]
+            "filename": c.get("filename"),
+            "page": c["page_number"],
+            "faiss_index_id": i
         }
-        for c in chunks
+        for i, c in enumerate(chunks)
     ]
 
+    # Reuse archived vectors; only chunks missing from the archive hit the model.
+    # Each id is looked up in the archive generation it was written for.
     embeddings = get_embedding_model()
-    vectorstore = FAISS.from_texts(texts, embeddings, metadatas)
+    dim = embeddings.get_dimension()
+    ids_by_generation = {}
+    for c in chunks:
+        ids_by_generation.setdefault(c.get("archive_generation", 0), []).append(c["faiss_index_id"])
+    archived = {
+        (generation, faiss_id): vector
+        for generation, ids in ids_by_generation.items()
+        for faiss_id, vector in load_vectors(user_id, ids, generation, dim).items()
+    }
+    keys = [(c.get("archive_generation", 0), c["faiss_index_id"]) for c in chunks]
+    missing = [i for i, key in enumerate(keys) if key not in archived]
+    fresh = embeddings.embed_documents([texts[i] for i in missing]) if missing else []
+    fresh_by_pos = dict(zip(missing, fresh))
+
+    vectors = np.array([
+        fresh_by_pos[i] if i in fresh_by_pos else archived[key]
+        for i, key in enumerate(keys)
+    ], dtype=np.float32)
+
+    vectorstore = FAISS.from_embeddings(
+        zip(texts, vectors.tolist()),
+        embeddings,
+        metadatas,
+        ids=[str(i) for i in range(len(chunks))]
+    )
+
+    # 1️⃣ Renumbered archive under a new generation, beside the live one
+    generation = max(
+        archive_generation(user_id),
+        staged_generation(user_id) or 0,
+        *(key[0] for key in keys)
+    ) + 1
+    stage_vectors(user_id, list(range(len(chunks))), vectors, generation)
+
+    # 2️⃣ Chunks point at the renumbered ids of that generation. If this stops
+    # halfway, each chunk's generation still says which numbering it uses.
+    chunks_col.bulk_write([
+        UpdateOne(
+            {"chunk_id": c["chunk_id"]},
+            {"$set": {"faiss_index_id": i, "archive_generation": generation}}
+        )
+        for i, group in enumerate(members)
+        for c in group
+    ])
 
-    vectorstore.save_local(f"faiss_index/{user_id}")
+    # 3️⃣ Index files for the new numbering; large libraries get an ANN index
+    maybe_migrate(vectorstore, user_id)
+    save_user_vectorstore(vectorstore, user_id)
+    # Every id was renumbered: index the chunks again from scratch
+    update_lexical_index(user_id, vectorstore, rebuild=True)
+    update_file_table(user_id, rebuild=True)
 
+    # 4️⃣ Done: the staged archive goes live (until here, a staged archive
+    # tells the index writer to finish this compaction first)
+    promote_staged_vectors(user_id)
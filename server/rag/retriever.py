@@ -1,7 +1,168 @@
-from rag.vectorstore import get_user_vectorstore
+import os
+import time
+import numpy as np
+from typing import Any
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from rag.vectorstore import get_user_vectorstore, docstore_positions, live_search_params
+from rag.embeddings import get_embedding_model
+from rag.lexical_index import get_lexical_index
+from rag.file_scope import get_file_table
+from rag.context_packing import CONTEXT_PACKING, CONTEXT_MAX_CHUNKS, pack_context
+from dotenv import load_dotenv
 
-def get_retriever(user_id: str, k: int = 3):
+load_dotenv()
+# hybrid: dense + BM25 fused with RRF; dense: FAISS only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "10"))
+LEXICAL_BUDGET_MS = float(os.getenv("LEXICAL_BUDGET_MS", "5"))
+
+# Standard reciprocal-rank-fusion constant
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = RRF_K) -> list[tuple[str, float]]:
+    """
+    Merge ranked id lists: score(id) = sum over lists of 1 / (k + rank).
+    Returns (id, score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense FAISS search fused with the user's BM25 index.
+
+    The lexical leg finds exact terms (course codes, formula names) that
+    embeddings blur. It gets at most budget_ms; if the index is busy being
+    updated or the budget runs out, the dense ranking is used as is.
+
+    With packing on, the fetch_k fused candidates go through
+    rag.context_packing (MMR, overlap merge, token budget) instead of
+    being cut at k.
+
+    A scope (rag.file_scope) restricts both legs to some documents inside
+    the search itself: no over-fetching and filtering afterwards.
+    """
+    vectorstore: Any
+    user_id: str
+    lexical: Any = None
+    k: int = 3
+    fetch_k: int = HYBRID_FETCH_K
+    budget_ms: float = LEXICAL_BUDGET_MS
+    pack: bool = CONTEXT_PACKING
+    max_chunks: int = CONTEXT_MAX_CHUNKS
+    scope: Any = None
+
+    def _dense_ids(self, vectors: np.ndarray) -> list[list[str]]:
+        """
+        Ranked docstore ids for each query row, from one FAISS search call.
+        """
+        index = self.vectorstore.index
+        if index.ntotal == 0:
+            return [[] for _ in vectors]
+        if self.scope is not None:
+            positions = self.scope.search(index, vectors, self.fetch_k)
+        else:
+            # Skips vectors of deleted documents not yet dropped from the index
+            params = live_search_params(self.vectorstore)
+            _, positions = index.search(vectors, min(self.fetch_k, index.ntotal), params=params)
+        id_map = self.vectorstore.index_to_docstore_id
+        return [[id_map[int(p)] for p in row if int(p) in id_map] for row in positions]
+
+    def _lexical_ids(self, query: str) -> list[str]:
+        if self.lexical is None:
+            return []
+        budget = self.budget_ms / 1000
+        deadline = time.perf_counter() + budget
+        # Busy syncing a fresh ingest: skip rather than wait
+        if not self.lexical.lock.acquire(timeout=budget):
+            return []
+        try:
+            allowed = self.scope.doc_ids if self.scope is not None else None
+            return self.lexical.search(query, self.fetch_k, deadline, allowed)
+        finally:
+            self.lexical.lock.release()
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        return self.fuse(self.rankings(query))
+
+    def rankings(self, query: str) -> list[list[str]]:
+        """
+        Dense and lexical rankings of one query. Rankings of several
+        phrasings of a question can be fused (and packed) together.
+        """
+        vector = np.array([get_embedding_model().embed_query(query)], dtype=np.float32)
+        return [self._dense_ids(vector)[0], self._lexical_ids(query)]
+
+    def retrieve_batch(self, queries: list[str], vectors: np.ndarray) -> list[list[Document]]:
+        """
+        Documents for many queries (vectors: their embeddings, one row each).
+        The dense leg is a single batched search; fusion and packing run per query.
+        """
+        dense = self._dense_ids(np.asarray(vectors, dtype=np.float32))
+        return [self.fuse([ids, self._lexical_ids(query)]) for query, ids in zip(queries, dense)]
+
+    def fuse(self, rankings: list[list[str]]) -> list[Document]:
+        """
+        Ranked docstore ids -> documents: RRF, then packing (or top k).
+        """
+        ranked = reciprocal_rank_fusion(rankings)
+
+        candidates = []
+        for doc_id, score in ranked[:self.fetch_k if self.pack else self.k]:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if isinstance(doc, Document):
+                candidates.append((doc_id, doc, score))
+
+        if not self.pack or not candidates:
+            return [doc for _, doc, _ in candidates]
+
+        top = candidates[0][2]
+        return pack_context(
+            [doc for _, doc, _ in candidates],
+            [score / top for _, _, score in candidates],
+            self._candidate_vectors([doc_id for doc_id, _, _ in candidates]),
+            max_chunks=self.max_chunks or self.k
+        )
+
+    def _candidate_vectors(self, doc_ids: list[str]) -> np.ndarray | None:
+        """
+        Stored vectors of the candidates, read back from FAISS (no re-embedding).
+        None if the index type cannot reconstruct them.
+        """
+        positions = docstore_positions(self.vectorstore, self.user_id)
+        try:
+            return np.vstack([
+                self.vectorstore.index.reconstruct(positions[doc_id]) for doc_id in doc_ids
+            ])
+        except (KeyError, RuntimeError):
+            return None
+
+
+def get_retriever(user_id: str, k: int = 3, file_ids: list[str] | None = None) -> HybridRetriever:
+    """
+    file_ids: only search these documents (None or empty: the whole library).
+    Scoped or not, a query gets the same kind of results for the mode.
+    """
     vectorstore = get_user_vectorstore(user_id)
-    return vectorstore.as_retriever(
-        search_kwargs={"k": k}
+    scope = get_file_table(user_id).scope(vectorstore, user_id, file_ids) if file_ids else None
+    return _hybrid_retriever(user_id, vectorstore, k, scope)
+
+
+def _hybrid_retriever(user_id: str, vectorstore, k: int, scope) -> HybridRetriever:
+    # dense: plain FAISS top-k, no lexical leg and no packing
+    dense = RETRIEVAL_MODE == "dense"
+    return HybridRetriever(
+        vectorstore=vectorstore,
+        user_id=user_id,
+        lexical=None if dense else get_lexical_index(user_id, vectorstore),
+        k=k,
+        fetch_k=max(HYBRID_FETCH_K, k),
+        pack=CONTEXT_PACKING and not dense,
+        scope=scope
     )
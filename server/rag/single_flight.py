@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import AsyncIterator, Callable
+from rag.embedding_cache import normalize_text
+
+
+def question_key(question: str) -> str:
+    """
+    Questions that differ only in case or whitespace share a flight.
+    """
+    return normalize_text(question).casefold()
+
+
+def history_digest(chat_history: list) -> str:
+    """
+    Short digest of (role, text) turns; answers depend on the history.
+    """
+    hasher = hashlib.sha256()
+    for role, text in chat_history:
+        hasher.update(f"{role}\0{text}\0".encode("utf-8"))
+    return hasher.hexdigest()[:16]
+
+
+class SingleFlight:
+    """
+    Blocking single-flight: concurrent calls with the same key share one
+    execution. The first caller runs fn; the rest wait for its result
+    (or its exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future
+        self.coalesced = 0
+
+    def do(self, key, fn: Callable, *args, **kwargs):
+        """
+        Returns (result, shared); shared is True when another caller ran fn.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+        return result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+
+class _Broadcast:
+    def __init__(self):
+        self.frames = []       # everything produced so far, replayed to late joiners
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task = None
+
+
+class StreamFanout:
+    """
+    Async single-flight for streams: one producer per key, its items are
+    fanned out to every subscriber. A subscriber joining mid-stream first
+    gets the items produced so far. The producer is cancelled once its
+    last subscriber leaves.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> _Broadcast
+        self.coalesced = 0
+
+    async def subscribe(self, key, make_stream: Callable[[], AsyncIterator]) -> AsyncIterator:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Broadcast()
+            flight.task = asyncio.create_task(self._pump(key, flight, make_stream()))
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                async with flight.changed:
+                    await flight.changed.wait_for(
+                        lambda: len(flight.frames) > sent or flight.done
+                    )
+                while sent < len(flight.frames):
+                    yield flight.frames[sent]
+                    sent += 1
+                if flight.done and sent == len(flight.frames):
+                    break
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more: stop paying for the LLM call.
+                # Unlisted first, so a request arriving before the task has
+                # unwound starts a new flight instead of joining this one.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _pump(self, key, flight: _Broadcast, stream: AsyncIterator) -> None:
+        try:
+            async for frame in stream:
+                async with flight.changed:
+                    flight.frames.append(frame)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            flight.error = e
+        finally:
+            # New requests start a fresh flight from here on
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            async with flight.changed:
+                flight.done = True
+                flight.changed.notify_all()
+            await stream.aclose()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._flights), "coalesced": self.coalesced}
+
+
+query_flights = SingleFlight()
+stream_flights = StreamFanout()
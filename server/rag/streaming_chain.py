@@ -1,42 +1,14 @@
-import os
-from langchain_google_genai import ChatGoogleGenerativeAI
+import json
+import asyncio
 from langchain_classic.chains.retrieval_qa.base import RetrievalQA
 from langchain_core.prompts import PromptTemplate
-from langchain_core.callbacks import BaseCallbackHandler
+from starlette.concurrency import run_in_threadpool
 from rag.retriever import get_retriever
-from dotenv import load_dotenv
-from queue import Queue
-from threading import Thread
+from rag.llm import get_text_chain, get_stuff_chain
 
-load_dotenv()
-MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-
-class StreamingCallbackHandler(BaseCallbackHandler):
-    """Callback handler for streaming tokens to a queue."""
-    
-    def __init__(self, queue: Queue):
-        self.queue = queue
-    
-    def on_llm_new_token(self, token: str, **kwargs):
-        self.queue.put(token)
-    
-    def on_llm_end(self, response, **kwargs):
-        self.queue.put(None)  # Signal end of stream
-
-
-def get_streaming_rag_chain(user_id: str):
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL,
-        temperature=0,
-        streaming=True,
-        google_api_key=GOOGLE_API_KEY
-    )
-
-    prompt = PromptTemplate(
-        input_variables=["context", "question"],
-        template="""
+STREAM_PROMPT = PromptTemplate(
+    input_variables=["context", "question"],
+    template="""
 Answer using ONLY the context.
 
 Context:
@@ -45,68 +17,73 @@ Context:
 Question:
 {question}
 """
-    )
-
-    retriever = get_retriever(user_id)
-
-    return RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt}
-    )
+)
 
 
-def stream_rag_response(user_id: str, question: str):
-    """Generator that yields tokens as they are generated."""
-    queue = Queue()
-    callback = StreamingCallbackHandler(queue)
-    
-    llm = ChatGoogleGenerativeAI(
-        model=MODEL,
-        temperature=0,
-        streaming=True,
-        callbacks=[callback]
-    )
-
-    prompt = PromptTemplate(
-        input_variables=["context", "question"],
-        template="""
-Answer using ONLY the context.
-
-Context:
-{context}
+def get_streaming_rag_chain(user_id: str):
+    retriever = get_retriever(user_id)
 
-Question:
-{question}
-"""
+    return RetrievalQA(
+        combine_documents_chain=get_stuff_chain(STREAM_PROMPT, streaming=True),
+        retriever=retriever
     )
 
-    retriever = get_retriever(user_id)
 
-    chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        retriever=retriever,
-        chain_type="stuff",
-        chain_type_kwargs={"prompt": prompt}
-    )
-    
-    def run_chain():
-        try:
-            chain.run(question)
-        except Exception as e:
-            queue.put(f"\n[ERROR]: {str(e)}")
-            queue.put(None)
-    
-    # Run chain in background thread
-    thread = Thread(target=run_chain)
-    thread.start()
-    
-    # Yield tokens as they come
-    while True:
-        token = queue.get()
-        if token is None:
-            break
-        yield token
-    
-    thread.join()
+def sse_event(data, event: str | None = None) -> str:
+    """
+    Format one Server-Sent Events frame (data is JSON-encoded).
+    """
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+
+async def stream_rag_response(
+    user_id: str,
+    question: str,
+    file_ids: list[str] | None = None
+):
+    """
+    Async generator of SSE frames:
+    one "sources" event, then one data frame per token, then [DONE].
+    A failure (retrieval or LLM) is sent as an "error" event before [DONE].
+    file_ids restricts retrieval to those documents.
+
+    Runs on the event loop (no thread per stream). If the client goes away
+    the generator is closed, which cancels the upstream Gemini call.
+    """
+    try:
+        retriever = await run_in_threadpool(get_retriever, user_id, file_ids=file_ids)
+        docs = await retriever.ainvoke(question)
+    except Exception as e:
+        # Headers are out already: report it in-stream, like an LLM failure
+        yield sse_event(str(e), event="error")
+        yield "data: [DONE]\n\n"
+        return
+
+    sources = [
+        {
+            "filename": doc.metadata.get("filename"),
+            "page": doc.metadata.get("page")
+        }
+        for doc in docs
+    ]
+    yield sse_event(sources, event="sources")
+
+    chain = get_text_chain(STREAM_PROMPT)
+
+    tokens = chain.astream({
+        "context": "\n\n".join(doc.page_content for doc in docs),
+        "question": question
+    })
+    try:
+        async for token in tokens:
+            yield sse_event(token)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        yield sse_event(str(e), event="error")
+    finally:
+        # Closing the stream aborts the in-flight LLM request
+        await tokens.aclose()
+
+    yield "data: [DONE]\n\n"
@@ -0,0 +1,6 @@
+# Rough English average; good enough for budgeting, no tokenizer needed
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
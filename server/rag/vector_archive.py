@@ -0,0 +1,174 @@
+import os
+import json
+import logging
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+VECTOR_ARCHIVE_DTYPE = os.getenv("VECTOR_ARCHIVE_DTYPE", "float32")  # float32 | float16
+
+logger = logging.getLogger(__name__)
+
+# Per-user append-only archive of chunk embeddings, stored next to the FAISS index:
+#   vectors.bin   raw rows of <dtype>[dim]
+#   vectors.ids   raw int64 faiss_index_id for each row (the offsets table)
+#   vectors.json  {"dim": ..., "dtype": ..., "generation": ...}
+# Rows of deleted chunks stay until the next compaction rewrites the archive.
+#
+# Compaction renumbers faiss_index_id. The archive ids are only meaningful
+# together with MongoDB's, so every chunk records the archive generation
+# its id refers to (archive_generation, 0 if absent). A compaction stages
+# the renumbered archive as *.next with a new generation, renumbers and
+# re-stamps the chunks, and only then promotes the staged files. A staged
+# archive left behind means a compaction was interrupted.
+
+
+def _archive_paths(user_id: str, staged: bool = False) -> tuple[str, str, str]:
+    base = f"faiss_index/{user_id}"
+    suffix = ".next" if staged else ""
+    return (
+        os.path.join(base, "vectors.bin" + suffix),
+        os.path.join(base, "vectors.ids" + suffix),
+        os.path.join(base, "vectors.json" + suffix)
+    )
+
+
+def _read_header(user_id: str, staged: bool = False) -> dict | None:
+    _, _, header_path = _archive_paths(user_id, staged)
+    if not os.path.exists(header_path):
+        return None
+    with open(header_path) as f:
+        return json.load(f)
+
+
+def archive_generation(user_id: str) -> int:
+    """
+    Generation of the live archive: the one new chunks' ids refer to.
+    """
+    header = _read_header(user_id)
+    return header.get("generation", 0) if header else 0
+
+
+def staged_generation(user_id: str) -> int | None:
+    """
+    Generation of an archive staged by a compaction that has not finished.
+    """
+    header = _read_header(user_id, staged=True)
+    return header.get("generation", 0) if header else None
+
+
+def append_vectors(user_id: str, faiss_ids: list[int], vectors) -> None:
+    """
+    Append embeddings for newly ingested chunks.
+    """
+    if not faiss_ids:
+        return
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vec_path, ids_path, header_path = _archive_paths(user_id)
+    os.makedirs(os.path.dirname(vec_path), exist_ok=True)
+
+    header = _read_header(user_id)
+    if header is None or header["dim"] != vectors.shape[1]:
+        # First write (or the embedding model changed): start a fresh archive
+        header = {
+            "dim": int(vectors.shape[1]),
+            "dtype": VECTOR_ARCHIVE_DTYPE,
+            "generation": header.get("generation", 0) if header else 0
+        }
+        _write_files(user_id, header, np.asarray(faiss_ids, dtype=np.int64), vectors)
+        return
+
+    with open(vec_path, "ab") as f:
+        f.write(vectors.astype(header["dtype"]).tobytes())
+    with open(ids_path, "ab") as f:
+        f.write(np.asarray(faiss_ids, dtype=np.int64).tobytes())
+
+
+def load_vectors(
+    user_id: str,
+    faiss_ids: list[int],
+    generation: int | None = None,
+    dim: int | None = None
+) -> dict[int, np.ndarray]:
+    """
+    Look up archived embeddings by faiss_index_id.
+    generation: the archive generation these ids refer to (None: the live
+    one). If no archive (live or staged) has it, or its vectors are not
+    `dim` wide, nothing is returned: the ids would resolve to wrong vectors.
+    Ids missing from the archive are simply absent from the result.
+    """
+    header, staged = _read_header(user_id), False
+    if generation is not None and (header or {}).get("generation", 0) != generation:
+        header, staged = _read_header(user_id, staged=True), True
+        if header is None or header.get("generation", 0) != generation:
+            return {}
+    if header is None or (dim is not None and header["dim"] != dim):
+        return {}
+
+    vec_path, ids_path, _ = _archive_paths(user_id, staged)
+    try:
+        ids = np.fromfile(ids_path, dtype=np.int64)
+        rows = np.memmap(vec_path, dtype=header["dtype"], mode="r")
+    except FileNotFoundError:
+        # Promotion of a staged archive was cut short: re-embed instead
+        return {}
+    # Guard against a torn append: only trust complete rows present in both files
+    n = min(len(ids), len(rows) // header["dim"])
+    if len(ids) != len(rows) // header["dim"]:
+        logger.warning(
+            f"Vector archive of user {user_id} has {len(ids)} ids for "
+            f"{len(rows) // header['dim']} rows; using the first {n}"
+        )
+    rows = rows[: n * header["dim"]].reshape(n, header["dim"])
+
+    # Later rows win, so re-used ids always resolve to their newest vector
+    row_of = {int(faiss_id): row for row, faiss_id in enumerate(ids[:n])}
+
+    found = {}
+    for faiss_id in faiss_ids:
+        row = row_of.get(int(faiss_id))
+        if row is not None:
+            found[int(faiss_id)] = np.asarray(rows[row], dtype=np.float32)
+    return found
+
+
+def stage_vectors(user_id: str, faiss_ids: list[int], vectors, generation: int) -> None:
+    """
+    Write the archive a compaction will switch to, as the given generation.
+    The live archive is untouched until promote_staged_vectors.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    header = {"dim": int(vectors.shape[1]), "dtype": VECTOR_ARCHIVE_DTYPE, "generation": generation}
+    _write_files(user_id, header, np.asarray(faiss_ids, dtype=np.int64), vectors, staged=True)
+
+
+def promote_staged_vectors(user_id: str) -> None:
+    """
+    Make the staged archive the live one (header last: it names the generation).
+    """
+    for staged, live in zip(_archive_paths(user_id, staged=True), _archive_paths(user_id)):
+        os.replace(staged, live)
+
+
+def _write_files(
+    user_id: str,
+    header: dict,
+    ids: np.ndarray,
+    vectors: np.ndarray,
+    staged: bool = False
+) -> None:
+    vec_path, ids_path, header_path = _archive_paths(user_id, staged)
+    os.makedirs(os.path.dirname(vec_path), exist_ok=True)
+
+    for path, payload in (
+        (vec_path, vectors.astype(header["dtype"]).tobytes()),
+        (ids_path, ids.tobytes())
+    ):
+        with open(path + ".tmp", "wb") as f:
+            f.write(payload)
+        os.replace(path + ".tmp", path)
+
+    with open(header_path + ".tmp", "w") as f:
+        json.dump(header, f)
+    os.replace(header_path + ".tmp", header_path)
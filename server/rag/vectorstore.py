@@ -1,24 +1,499 @@
 import os
+import time
+import shutil
+import threading
+import weakref
+import numpy as np
+from collections import OrderedDict
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from rag.embeddings import get_embedding_model
+from rag.ann_index import configure_index, index_bytes, index_kind, search_params
+from rag.mmap_store import (
+    LEGACY_FILE,
+    MmapDocstore,
+    PositionIds,
+    StoredDocs,
+    has_docstore_files,
+    read_header,
+    save_array,
+    write_docstore
+)
 from dotenv import load_dotenv
 
 load_dotenv()
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+VECTORSTORE_CACHE_MAX_BYTES = int(
+    os.getenv("VECTORSTORE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
 
-def get_embedding_model():
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+# Rough per-document overhead of the docstore (Document object, metadata dict, ids)
+DOCSTORE_OVERHEAD_BYTES = 600
+
+# Index types FAISS can memory-map on read (IVF would come back as
+# read-only on-disk inverted lists, which cannot be cloned or updated)
+MMAP_INDEX_KINDS = ("flat", "hnsw")
+
+# Each save writes index.faiss and the docstore files into a fresh
+# faiss_index/<user>/gen-<n>/ directory, then switches CURRENT (which
+# names it) with one rename. Older indexes keep the files in the user
+# directory itself and are moved over on their next save.
+# CURRENT also holds the index version: a counter bumped by every write
+# (a save, or mark_deleted), which caches of the index are tagged with.
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+# Generations kept besides the current one, for readers that resolved
+# CURRENT just before a save and have not opened the files yet
+KEEP_OLD_GENERATIONS = 1
+LOAD_ATTEMPTS = 3
+# Sorted positions of a generation's vectors deleted since it was saved
+# (mark_deleted): hidden from searches until the next save drops them
+DELETED_FILE = "deleted.npy"
+
+
+def get_user_index_path(user_id: str) -> str:
+    return f"faiss_index/{user_id}"
+
+
+def _read_current(base_path: str) -> tuple[str, int] | None:
+    """
+    (current generation, index version), or None without CURRENT.
+    """
+    try:
+        with open(os.path.join(base_path, CURRENT_FILE)) as f:
+            fields = f.read().split()
+    except FileNotFoundError:
+        return None
+    # Written before the version was recorded: the generation number
+    version = int(fields[1]) if len(fields) > 1 else int(fields[0][len(GENERATION_PREFIX):])
+    return fields[0], version
+
+
+def _write_current(base_path: str, generation: str) -> None:
+    current = _read_current(base_path)
+    # A new index (or one deleted and created again) starts from the clock,
+    # so no version is ever reused for different contents
+    version = current[1] + 1 if current else time.time_ns() // 1000
+    pointer = os.path.join(base_path, CURRENT_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(f"{generation} {version}")
+    os.replace(pointer + ".tmp", pointer)
+
+
+def get_index_dir(base_path: str) -> str:
+    """
+    Directory holding the current index.faiss and docstore files.
+    """
+    current = _read_current(base_path)
+    return os.path.join(base_path, current[0]) if current else base_path
+
+
+def get_index_version(user_id: str) -> int | None:
+    """
+    Version of the user's index on disk, from CURRENT (0 for older
+    indexes without it). None if the user has no saved index yet.
+    """
+    base_path = get_user_index_path(user_id)
+    current = _read_current(base_path)
+    if current is not None:
+        return current[1]
+    return 0 if os.path.exists(os.path.join(base_path, "index.faiss")) else None
+
+
+def estimate_vectorstore_bytes(vectorstore) -> int:
+    """
+    Approximate RAM held by a loaded FAISS vectorstore.
+    """
+    vector_bytes = index_bytes(vectorstore.index)
+    docstore = vectorstore.docstore
+    if isinstance(docstore, MmapDocstore):
+        # Mapped docstore files sit in the page cache; count what is on the heap
+        docs = docstore.pending
+        vector_bytes += docstore.stored.resident_bytes()
+    else:
+        docs = getattr(docstore, "_dict", {})
+    text_bytes = sum(len(doc.page_content) for doc in docs.values())
+    return vector_bytes + text_bytes + len(docs) * DOCSTORE_OVERHEAD_BYTES
+
+
+class VectorstoreCache:
+    """
+    LRU cache of loaded user vectorstores, bounded by an approximate byte budget.
+    Entries are tagged with the on-disk index version so a save from another
+    worker process is picked up on the next lookup.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # user_id -> (vectorstore, nbytes, version)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: str, version: int | None):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[2] != version:
+                if entry is not None:
+                    self._remove(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: str, vectorstore, version: int | None) -> None:
+        nbytes = estimate_vectorstore_bytes(vectorstore)
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+            if nbytes > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + nbytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._entries[user_id] = (vectorstore, nbytes, version)
+            self.current_bytes += nbytes
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            if user_id in self._entries:
+                self._remove(user_id)
+
+    def _remove(self, user_id: str) -> None:
+        _, nbytes, _ = self._entries.pop(user_id)
+        self.current_bytes -= nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+_cache = VectorstoreCache(VECTORSTORE_CACHE_MAX_BYTES)
 
 
 def get_user_vectorstore(user_id: str):
-    base_path = f"faiss_index/{user_id}"
+    base_path = get_user_index_path(user_id)
+    version = get_index_version(user_id)
+
+    cached = _cache.get(user_id, version)
+    if cached is not None:
+        return cached
+
+    embeddings = get_embedding_model()
+
+    if version is not None:
+        vectorstore = load_vectorstore(base_path, embeddings)
+        _cache.put(user_id, vectorstore, version)
+        return vectorstore
+    else:
+        return create_empty_vectorstore()
+
+
+def load_vectorstore(base_path: str, embeddings):
+    """
+    Open the current saved index. A save from another process can switch
+    generations (and drop old ones) while this reads: retry from CURRENT.
+    """
+    for attempt in range(LOAD_ATTEMPTS):
+        try:
+            return _load_index_dir(get_index_dir(base_path), embeddings)
+        except (OSError, RuntimeError, ValueError):
+            if attempt == LOAD_ATTEMPTS - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+def _load_index_dir(path: str, embeddings):
+    """
+    Memory-mapped docstore files when present, otherwise the pickled
+    docstore written by older versions.
+    """
+    index_path = os.path.join(path, "index.faiss")
+    if has_docstore_files(path):
+        mmap = read_header(path)["index_kind"] in MMAP_INDEX_KINDS
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP if mmap else 0)
+        stored = StoredDocs(path)
+        if stored.rows != index.ntotal:
+            raise ValueError(f"Docstore in {path} has {stored.rows} rows, index.faiss {index.ntotal}")
+        deleted_path = os.path.join(path, DELETED_FILE)
+        deleted = np.load(deleted_path) if os.path.exists(deleted_path) else None
+        vectorstore = _mapped_vectorstore(embeddings, index, stored, deleted)
+    else:
+        vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    vectorstore.index = configure_index(vectorstore.index)
+    return vectorstore
+
+
+def _mapped_vectorstore(embeddings, index, stored: StoredDocs, deleted: np.ndarray | None):
+    id_map = PositionIds(stored, deleted)
+    return FAISS(embeddings, index, MmapDocstore(stored, id_map.deleted.tolist()), id_map)
+
+
+def get_writable_vectorstore(user_id: str):
+    """
+    Private copy of the user's vectorstore for the index writer.
+    Queries keep using the cached (read-only, mapped) store until the
+    writer saves; the docstore copy only holds the changes.
+    """
+    vectorstore = get_user_vectorstore(user_id)
+    if get_index_version(user_id) is None:
+        return vectorstore  # fresh empty store, not shared
+
+    docstore = vectorstore.docstore
+    if isinstance(docstore, MmapDocstore):
+        docstore = docstore.copy()
+    else:
+        docstore = InMemoryDocstore(dict(docstore._dict))
+    return FAISS(
+        get_embedding_model(),
+        configure_index(faiss.clone_index(vectorstore.index)),
+        docstore,
+        vectorstore.index_to_docstore_id.copy()
+    )
+
+
+def create_empty_vectorstore():
+    """
+    Empty flat index, sized for the embedding model.
+    """
     embeddings = get_embedding_model()
+    index = faiss.IndexFlatL2(embeddings.get_dimension())
+    return FAISS(embeddings, index, InMemoryDocstore(), {})
+
+
+def can_mark_deleted(user_id: str, vectorstore) -> bool:
+    """
+    Whether mark_deleted works for this (saved, cached) store: mapped
+    files in a generation directory, numeric ids in position order.
+    """
+    id_map = vectorstore.index_to_docstore_id
+    return (
+        isinstance(id_map, PositionIds)
+        and id_map.stored.header["num_ids_sorted"]
+        and os.path.exists(os.path.join(get_user_index_path(user_id), CURRENT_FILE))
+    )
+
+
+def has_legacy_ids(vectorstore) -> bool:
+    """
+    Whether some chunks are stored under the UUIDs older indexes used.
+    """
+    id_map = vectorstore.index_to_docstore_id
+    if isinstance(id_map, PositionIds):
+        # Only written when every id is numeric (appends always are)
+        return not id_map.stored.header["num_ids_sorted"]
+    return any(not doc_id.isdigit() for doc_id in id_map.values())
+
+
+def deleted_count(vectorstore) -> int:
+    """
+    Vectors hidden by mark_deleted but still in the index.
+    """
+    return len(getattr(vectorstore.index_to_docstore_id, "deleted", ()))
+
+
+def mark_deleted(user_id: str, vectorstore, positions: np.ndarray):
+    """
+    Delete vectors without rewriting the index: their positions are added
+    to the current generation's deleted file and CURRENT is rewritten (a
+    new index version). The next save drops them for good. Cost grows
+    with the deleted vectors, not the library.
+    vectorstore: the saved store (can_mark_deleted). Returns the updated one.
+    """
+    base_path = get_user_index_path(user_id)
+    generation, _ = _read_current(base_path)
+    id_map = vectorstore.index_to_docstore_id
+    deleted = np.union1d(id_map.deleted, positions).astype(np.int64)
+    save_array(os.path.join(base_path, generation, DELETED_FILE), deleted)
+    _write_current(base_path, generation)
+
+    # Same mapped index and docstore files, fewer live positions
+    marked = _mapped_vectorstore(get_embedding_model(), vectorstore.index, id_map.stored, deleted)
+    _cache.put(user_id, marked, get_index_version(user_id))
+    return marked
+
+
+_live_params = weakref.WeakKeyDictionary()  # vectorstore -> (params, selectors it uses)
+
+
+def live_search_params(vectorstore):
+    """
+    Search parameters skipping the positions hidden by mark_deleted,
+    or None when nothing is hidden.
+    """
+    deleted = getattr(vectorstore.index_to_docstore_id, "deleted", None)
+    if deleted is None or not len(deleted):
+        return None
+    with _positions_lock:
+        cached = _live_params.get(vectorstore)
+        if cached is None:
+            # The wrappers hold raw pointers: keep the selectors alive with the params
+            batch = faiss.IDSelectorBatch(len(deleted), faiss.swig_ptr(deleted))
+            selector = faiss.IDSelectorNot(batch)
+            live = 1.0 - len(deleted) / max(vectorstore.index.ntotal, 1)
+            cached = (search_params(vectorstore.index, selector, live), selector, batch)
+            _live_params[vectorstore] = cached
+    return cached[0]
+
+
+def max_stable_id(vectorstore) -> int:
+    """
+    Largest numeric docstore id in the store (-1 if none).
+    Chunks are stored under str(faiss_index_id); older indexes used UUIDs.
+    """
+    id_map = vectorstore.index_to_docstore_id
+    if isinstance(id_map, PositionIds):
+        return id_map.max_numeric_id()
+    ids = [int(i) for i in id_map.values() if i.isdigit()]
+    return max(ids, default=-1)
+
+
+def update_doc_metadata(vectorstore, doc_id: str, updates: dict) -> None:
+    """
+    Replace a stored chunk's metadata. Documents are swapped, not mutated:
+    a mapped docstore builds a new Document on every lookup.
+    """
+    doc = vectorstore.docstore.search(doc_id)
+    vectorstore.docstore.delete([doc_id])
+    vectorstore.docstore.add({
+        doc_id: Document(id=doc_id, page_content=doc.page_content, metadata={**doc.metadata, **updates})
+    })
+
+
+_positions = weakref.WeakKeyDictionary()  # vectorstore -> (version, {docstore id: position})
+_positions_lock = threading.Lock()
 
-    if os.path.exists(base_path):
-        return FAISS.load_local(base_path, embeddings, allow_dangerous_deserialization=True)
+
+def docstore_positions(vectorstore, user_id: str) -> dict[str, int]:
+    """
+    Reverse of index_to_docstore_id (docstore id -> FAISS position),
+    rebuilt only when the user's index version changes.
+    """
+    version = get_index_version(user_id)
+    with _positions_lock:
+        cached = _positions.get(vectorstore)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+    id_map = vectorstore.index_to_docstore_id
+    if isinstance(id_map, PositionIds):
+        positions = id_map.positions()  # looked up in the mapped id column
     else:
-        return FAISS.from_texts(["start"], embeddings)
+        positions = {doc_id: pos for pos, doc_id in id_map.items()}
+    with _positions_lock:
+        _positions[vectorstore] = (version, positions)
+    return positions
+
+
+def positions_of_ids(vectorstore, user_id: str, ids) -> np.ndarray:
+    """
+    Sorted FAISS positions of numeric docstore ids; ids not in the store are skipped.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    id_map = vectorstore.index_to_docstore_id
+    if isinstance(id_map, PositionIds):
+        rows = id_map.positions_of_numeric(ids)
+        if rows is not None:
+            return np.unique(rows)
+
+    positions = docstore_positions(vectorstore, user_id)
+    found = [positions[str(i)] for i in ids.tolist() if str(i) in positions]
+    return np.unique(np.array(found, dtype=np.int64))
+
+
+def save_docstore(vectorstore, base_path: str) -> None:
+    """
+    Write the docstore in the mapped format, one row per FAISS position.
+    """
+    id_map = vectorstore.index_to_docstore_id
+    ids = [id_map[pos] for pos in range(vectorstore.index.ntotal)]
+    docs = [vectorstore.docstore.search(doc_id) for doc_id in ids]
+    missing = [doc_id for doc_id, doc in zip(ids, docs) if not isinstance(doc, Document)]
+    if missing:
+        raise ValueError(f"Docstore is missing ids referenced by the index: {missing[:5]}")
+    write_docstore(base_path, ids, docs, index_kind(vectorstore.index))
+
+
+def _generations(base_path: str) -> list[str]:
+    """
+    Generation directories under base_path, oldest first.
+    """
+    names = [
+        name for name in os.listdir(base_path)
+        if name.startswith(GENERATION_PREFIX) and name[len(GENERATION_PREFIX):].isdigit()
+    ]
+    return sorted(names, key=lambda name: int(name[len(GENERATION_PREFIX):]))
+
+
+def _new_generation(base_path: str) -> str:
+    os.makedirs(base_path, exist_ok=True)
+    existing = _generations(base_path)
+    n = int(existing[-1][len(GENERATION_PREFIX):]) + 1 if existing else 1
+    while True:
+        name = f"{GENERATION_PREFIX}{n}"
+        try:
+            os.mkdir(os.path.join(base_path, name))
+            return name
+        except FileExistsError:
+            n += 1  # another process saving at the same time
+
+
+def _remove_old_files(base_path: str, current: str) -> None:
+    """
+    Drop generations older than the kept ones, and files of the old
+    single-directory layout.
+    """
+    generations = [name for name in _generations(base_path) if name != current]
+    for name in generations[:max(0, len(generations) - KEEP_OLD_GENERATIONS)]:
+        shutil.rmtree(os.path.join(base_path, name), ignore_errors=True)
+
+    for name in os.listdir(base_path):
+        if name in ("index.faiss", LEGACY_FILE) or name.startswith("docs."):
+            try:
+                os.remove(os.path.join(base_path, name))
+            except FileNotFoundError:
+                pass
+
+
+def save_vectorstore(vectorstore, base_path: str) -> None:
+    """
+    Write index.faiss and the docstore files into a new generation, then
+    point CURRENT at it: a reader sees one complete generation, never
+    columns of one save next to the header or index of another.
+    """
+    generation = _new_generation(base_path)
+    path = os.path.join(base_path, generation)
+    save_docstore(vectorstore, path)
+    faiss.write_index(vectorstore.index, os.path.join(path, "index.faiss"))
+    _write_current(base_path, generation)
+    _remove_old_files(base_path, generation)
 
 
 def save_user_vectorstore(vectorstore, user_id: str):
-    vectorstore.save_local(f"faiss_index/{user_id}")
+    base_path = get_user_index_path(user_id)
+    save_vectorstore(vectorstore, base_path)
+    # The next query should see the saved store; reopen it mapped rather
+    # than keep the writer's copy (index clone + docstore overlay) around
+    _cache.put(user_id, load_vectorstore(base_path, get_embedding_model()), get_index_version(user_id))
+
+
+def invalidate_user_vectorstore(user_id: str):
+    _cache.invalidate(user_id)
+
+
+def get_vectorstore_cache_stats() -> dict:
+    return _cache.stats()
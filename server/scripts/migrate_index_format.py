@@ -0,0 +1,81 @@
+"""
+One-shot conversion of faiss_index/* from the pickled docstore (index.pkl)
+to the memory-mapped docstore files (see rag/mmap_store.py).
+
+index.faiss is left untouched, so the index version, the lexical index and any
+running server's caches stay valid. Indexes saved by the server are
+converted on their next write anyway; this does the rest up front.
+
+    cd server && python scripts/migrate_index_format.py
+    cd server && python scripts/migrate_index_format.py --user-id <id> --keep-pickle
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain_community.vectorstores import FAISS
+from rag.embeddings import get_embedding_model
+from rag.vectorstore import get_index_dir, get_user_index_path, save_docstore
+from rag.mmap_store import LEGACY_FILE, StoredDocs, has_docstore_files
+
+INDEX_ROOT = "faiss_index"
+
+
+def _docstore_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(path, name))
+        for name in os.listdir(path)
+        if name == LEGACY_FILE or name.startswith("docs.")
+    )
+
+
+def migrate_user(user_id: str, keep_pickle: bool = False) -> str:
+    path = get_user_index_path(user_id)
+    legacy = os.path.join(path, LEGACY_FILE)
+    if not os.path.exists(legacy):
+        return "already converted" if has_docstore_files(get_index_dir(path)) else "no index"
+
+    before = _docstore_bytes(path)
+    vectorstore = FAISS.load_local(path, get_embedding_model(), allow_dangerous_deserialization=True)
+    save_docstore(vectorstore, path)
+
+    # Read every row back before the pickle goes
+    stored = StoredDocs(path)
+    id_map = vectorstore.index_to_docstore_id
+    for row in range(stored.rows):
+        doc = vectorstore.docstore.search(id_map[row])
+        if stored.doc_id(row) != id_map[row] or stored.text(row) != doc.page_content \
+                or stored.metadata(row) != doc.metadata:
+            raise RuntimeError(f"Row {row} of user {user_id} did not round-trip")
+
+    if not keep_pickle:
+        os.remove(legacy)
+    return f"{stored.rows} chunks, docstore {before / 1e6:.1f} MB -> {_docstore_bytes(path) / 1e6:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", action="append", help="only these users (repeatable)")
+    parser.add_argument("--keep-pickle", action="store_true", help="leave index.pkl in place")
+    args = parser.parse_args()
+
+    if not os.path.isdir(INDEX_ROOT):
+        sys.exit(f"No {INDEX_ROOT}/ here: run from the server directory")
+
+    user_ids = args.user_id or sorted(
+        name for name in os.listdir(INDEX_ROOT) if os.path.isdir(os.path.join(INDEX_ROOT, name))
+    )
+    failed = 0
+    for user_id in user_ids:
+        try:
+            print(f"{user_id}: {migrate_user(user_id, args.keep_pickle)}")
+        except Exception as e:
+            failed += 1
+            print(f"{user_id}: FAILED ({e})")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
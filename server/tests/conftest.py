@@ -0,0 +1,107 @@
+import os
+import re
+import sys
+import uuid
+import hashlib
+
+import numpy as np
+import pytest
+
+# Tests import server modules as the app does (from the server directory)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+# Never reach for a real MongoDB, the model hub or the Gemini API
+os.environ["DB_BACKEND"] = "memory"
+os.environ["MEMORY_DB_LATENCY_MS"] = "0"
+os.environ["EMBEDDING_CACHE_MAX_ENTRIES"] = "0"
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+
+STUB_DIM = 32
+
+
+class StubEmbeddings:
+    """
+    Bag-of-words hashed into STUB_DIM buckets: deterministic, and texts
+    sharing words land close together.
+    """
+
+    calls = 0
+
+    def _vector(self, text: str) -> list[float]:
+        v = np.zeros(STUB_DIM, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            v[int(hashlib.md5(word.encode()).hexdigest(), 16) % STUB_DIM] += 1.0
+        norm = np.linalg.norm(v)
+        return (v / norm if norm else v).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        StubEmbeddings.calls += len(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        StubEmbeddings.calls += 1
+        return self._vector(text)
+
+
+@pytest.fixture
+def stub_embedder(monkeypatch):
+    """
+    The process-wide embedding engine, backed by StubEmbeddings.
+    """
+    from rag.embeddings import get_embedding_model
+
+    engine = get_embedding_model()
+    monkeypatch.setattr(engine, "_model", StubEmbeddings())
+    monkeypatch.setattr(engine, "dimension", STUB_DIM)
+    monkeypatch.setattr(engine, "cache", None)
+    return engine
+
+
+@pytest.fixture
+def ingest(workdir, stub_embedder, monkeypatch):
+    """
+    ingest(user_id, filename, *page_texts) -> document, run through the
+    background job (parsing stubbed out).
+    """
+    from db import mongo
+    from rag import ingest_jobs
+
+    parsed = {}
+    monkeypatch.setattr(
+        ingest_jobs,
+        "open_document_pages",
+        lambda file_path, filename: ("pdf", len(parsed[filename]), iter(parsed[filename]))
+    )
+
+    def run(user_id: str, filename: str, *texts: str) -> dict:
+        parsed[filename] = pages(*texts)
+        doc = mongo.insert_document(user_id, filename, "pdf", 0, status="queued", job_id=filename)
+        ingest_jobs.run_ingest_job(user_id, doc["file_id"], f"{filename}.missing", filename, filename)
+        return mongo.get_document_by_id(user_id, doc["file_id"])
+
+    return run
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Run in an empty directory: faiss_index/ and data/ are relative paths.
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def user_id():
+    # In-process caches and the memory backend are shared across tests
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+
+def pages(*texts: str) -> list[dict]:
+    return [{"page": n, "text": text} for n, text in enumerate(texts, start=1)]
+
+
+def long_text(topic: str, n: int = 60) -> str:
+    """
+    Text that splits into several chunks, each mentioning the topic.
+    """
+    return " ".join(f"{topic} sentence {i} talks about {topic} number {i}." for i in range(n))
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from rag import ann_index
+from rag.ann_index import MIN_POINTS_PER_LIST, build_index, index_kind, index_spec, ivf_nlist, min_ann_vectors
+
+
+@pytest.mark.parametrize("n", [624, 1000, 5000, 24336, 100000])
+def test_ivf_lists_always_get_enough_training_points(n):
+    assert n // ivf_nlist(n) >= MIN_POINTS_PER_LIST
+
+
+@pytest.mark.parametrize("index_type,compression", [
+    ("ivf", "none"), ("ivf", "sq8"), ("ivf", "pq"), ("hnsw", "pq"), ("hnsw", "sq8")
+])
+def test_smallest_ann_library_trains(monkeypatch, index_type, compression):
+    # Even with the threshold set below what training needs
+    monkeypatch.setattr(ann_index, "ANN_FLAT_MAX", 5)
+    n = min_ann_vectors(index_type, compression)
+
+    assert index_spec(n - 1, 32, index_type, compression) == "Flat"
+    spec = index_spec(n, 32, index_type, compression)
+    vectors = np.random.default_rng(0).random((n, 32), dtype=np.float32)
+    index = build_index(vectors, spec)
+    assert index_kind(index) == index_type and index.ntotal == n
@@ -0,0 +1,111 @@
+import asyncio
+import os
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import long_text
+from api import documents
+from db import mongo
+from rag import index_writer
+from rag.retriever import get_retriever
+from rag.vectorstore import (
+    DELETED_FILE,
+    get_index_dir,
+    get_index_version,
+    get_user_index_path,
+    get_user_vectorstore
+)
+
+
+def delete(user_id: str, file_id: str) -> dict:
+    return asyncio.run(documents.delete_user_document(file_id, user_id=user_id))
+
+
+def current_generation(user_id: str) -> str:
+    return os.path.basename(get_index_dir(get_user_index_path(user_id)))
+
+
+def found_files(user_id: str, query: str) -> set[str]:
+    return {doc.metadata["filename"] for doc in get_retriever(user_id, k=10).invoke(query)}
+
+
+@pytest.fixture
+def library(user_id, ingest, monkeypatch):
+    monkeypatch.setattr(index_writer, "MAX_DELETED_FRACTION", 0.5)
+    return [
+        ingest(user_id, name, long_text(topic))
+        for name, topic in [("bio.pdf", "mitosis"), ("chem.pdf", "enthalpy"), ("phys.pdf", "momentum")]
+    ]
+
+
+def test_delete_hides_vectors_without_rewriting_the_index(user_id, library):
+    generation = current_generation(user_id)
+    version = get_index_version(user_id)
+    ntotal = get_user_vectorstore(user_id).index.ntotal
+
+    result = delete(user_id, library[0]["file_id"])
+
+    assert result["vectors_removed"] > 0
+    assert current_generation(user_id) == generation
+    assert get_index_version(user_id) == version + 1
+    vectorstore = get_user_vectorstore(user_id)
+    assert vectorstore.index.ntotal == ntotal
+    assert len(vectorstore.index_to_docstore_id) == ntotal - result["vectors_removed"]
+    assert "bio.pdf" not in found_files(user_id, "mitosis sentence")
+    assert "chem.pdf" in found_files(user_id, "enthalpy sentence")
+
+
+def test_next_write_drops_hidden_vectors(user_id, library, ingest):
+    removed = delete(user_id, library[0]["file_id"])["vectors_removed"]
+    ntotal = get_user_vectorstore(user_id).index.ntotal
+
+    ingest(user_id, "math.pdf", long_text("integral"))
+
+    path = os.path.join(get_user_index_path(user_id), current_generation(user_id))
+    assert not os.path.exists(os.path.join(path, DELETED_FILE))
+    vectorstore = get_user_vectorstore(user_id)
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id)
+    assert vectorstore.index.ntotal > ntotal - removed
+    assert "bio.pdf" not in found_files(user_id, "mitosis sentence")
+
+
+def test_too_many_hidden_vectors_rewrite_the_index(user_id, library, monkeypatch):
+    monkeypatch.setattr(index_writer, "MAX_DELETED_FRACTION", 0.0)
+    generation = current_generation(user_id)
+
+    delete(user_id, library[0]["file_id"])
+
+    assert current_generation(user_id) != generation
+    vectorstore = get_user_vectorstore(user_id)
+    assert vectorstore.index.ntotal == len(vectorstore.index_to_docstore_id)
+
+
+def test_shared_vectors_are_kept_for_the_other_document(user_id, ingest):
+    first = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    ingest(user_id, "syl-copy.pdf", long_text("syllabus"))
+    ntotal = get_user_vectorstore(user_id).index.ntotal
+
+    assert delete(user_id, first["file_id"])["vectors_removed"] == 0
+
+    vectorstore = get_user_vectorstore(user_id)
+    assert len(vectorstore.index_to_docstore_id) == ntotal
+    # Re-labelled: results now cite the document that still exists
+    assert found_files(user_id, "syllabus sentence") == {"syl-copy.pdf"}
+
+
+def test_unknown_document_is_404(user_id, workdir):
+    with pytest.raises(HTTPException) as e:
+        delete(user_id, "no-such-file")
+    assert e.value.status_code == 404
+
+
+def test_delete_removes_the_uploaded_file(user_id, workdir, stub_embedder):
+    path = workdir / "syl.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    doc = mongo.insert_document(user_id, "syl.pdf", "pdf", 1, file_path=str(path))
+
+    delete(user_id, doc["file_id"])
+
+    assert not path.exists()
+    assert mongo.get_document_by_id(user_id, doc["file_id"]) is None
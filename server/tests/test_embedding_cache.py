@@ -0,0 +1,25 @@
+from rag.embedding_cache import EmbeddingCache
+
+
+def test_hits_do_not_write_but_still_count_for_eviction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=3)
+    cache.put_many({"a": [1.0], "b": [2.0], "c": [3.0]})
+    # Long unused, "a" the longest
+    cache._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(0, "a"), (1, "b"), (2, "c")])
+    cache._conn.commit()
+
+    writes = cache._conn.total_changes
+    assert cache.get_many(["a", "missing"]) == {"a": [1.0]}
+    assert cache._conn.total_changes == writes
+
+    # The hit on "a" is written before the put evicts
+    cache.put_many({"d": [4.0]})
+    kept = {key for (key,) in cache._conn.execute("SELECT key FROM embeddings")}
+    assert kept == {"a", "d"}
+
+
+def test_recent_hits_are_not_refreshed(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    cache.put_many({"a": [1.0]})
+    cache.get_many(["a"])
+    assert cache._touched == {}
@@ -0,0 +1,82 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from conftest import long_text
+from api.query import _check_scope
+from rag import file_scope
+from rag.file_scope import FileScope, get_file_table, invalidate_file_table
+from rag.retriever import get_retriever
+from rag.vectorstore import get_user_index_path
+
+
+def table_files(user_id: str) -> list[str]:
+    base = get_user_index_path(user_id)
+    return [name for name in (file_scope.FILE_TABLE, file_scope.FILE_TABLE_IDS)
+            if os.path.exists(os.path.join(base, name))]
+
+
+def test_query_path_rebuilds_a_missing_table_in_memory_only(user_id, ingest):
+    syl = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    for name in table_files(user_id):
+        os.remove(os.path.join(get_user_index_path(user_id), name))
+    invalidate_file_table(user_id)
+
+    table = get_file_table(user_id)
+    assert len(table.members[syl["file_id"]])
+    assert table_files(user_id) == []
+    # Cached: no second rebuild from MongoDB
+    assert get_file_table(user_id) is table
+
+    # The next write persists it, with both documents
+    notes = ingest(user_id, "notes.pdf", long_text("lecture"))
+    assert len(table_files(user_id)) == 2
+    invalidate_file_table(user_id)
+    assert set(get_file_table(user_id).members) == {syl["file_id"], notes["file_id"]}
+
+
+def retrieved_files(user_id: str, query: str, file_ids: list[str]) -> set[str]:
+    return {doc.metadata["filename"] for doc in get_retriever(user_id, k=10, file_ids=file_ids).invoke(query)}
+
+
+def test_scoped_queries_only_see_their_documents(user_id, ingest):
+    docs = {
+        name: ingest(user_id, f"{name}.pdf", long_text(name))["file_id"]
+        for name in ("syllabus", "lecture", "exam")
+    }
+
+    assert retrieved_files(user_id, "syllabus sentence", [docs["lecture"]]) == {"lecture.pdf"}
+    both = [docs["exam"], docs["syllabus"]]
+    assert retrieved_files(user_id, "lecture sentence", both) <= {"exam.pdf", "syllabus.pdf"}
+
+
+def test_selector_is_a_range_for_contiguous_positions(monkeypatch):
+    index = faiss.IndexFlatL2(4)
+    index.add(np.eye(4, dtype=np.float32).repeat(3, axis=0))
+    queries = np.eye(4, dtype=np.float32)
+
+    contiguous = FileScope(np.array([3, 4, 5]), {"3", "4", "5"}, index.ntotal)
+    scattered = FileScope(np.array([0, 6, 11]), {"0", "6", "11"}, index.ntotal)
+    assert isinstance(contiguous.selector, faiss.IDSelectorRange)
+    assert isinstance(scattered.selector, faiss.IDSelectorBitmap)
+
+    # Exact search for small scopes, the filtered FAISS search above SCOPE_EXACT_MAX
+    for exact_max in (2048, 0):
+        monkeypatch.setattr(file_scope, "SCOPE_EXACT_MAX", exact_max)
+        assert set(scattered.search(index, queries, 3)[2].tolist()) == {0, 6, 11}
+        assert scattered.search(index, queries, 3)[3][0] == 11
+        assert contiguous.search(index, queries, 1)[1].tolist() == [3]
+
+
+def test_scope_must_name_indexed_documents_of_the_user():
+    statuses = {"a": "indexed", "b": "embedding"}
+    _check_scope(("a",), statuses)
+    with pytest.raises(HTTPException) as e:
+        _check_scope(("a", "z"), statuses)
+    assert e.value.status_code == 404
+    with pytest.raises(HTTPException) as e:
+        _check_scope(("a", "b"), statuses)
+    assert e.value.status_code == 400
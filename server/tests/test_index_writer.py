@@ -0,0 +1,77 @@
+import pytest
+
+from conftest import long_text
+from db import mongo
+from rag import index_writer, ingest_jobs
+from rag.reindex import rebuild_user_faiss_index
+from rag.vectorstore import get_user_vectorstore
+
+
+def indexed_files(user_id: str) -> set[str]:
+    vectorstore = get_user_vectorstore(user_id)
+    return {
+        vectorstore.docstore.search(doc_id).metadata["filename"]
+        for doc_id in vectorstore.index_to_docstore_id.values()
+    }
+
+
+def test_failed_save_leaves_no_chunk_rows_for_compaction(user_id, ingest, monkeypatch):
+    save = index_writer.save_user_vectorstore
+    calls = []
+
+    def save_fails_once(vectorstore, uid):
+        calls.append(uid)
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return save(vectorstore, uid)
+
+    monkeypatch.setattr(index_writer, "save_user_vectorstore", save_fails_once)
+
+    failed = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    assert failed["status"] == "failed"
+    assert mongo.get_faiss_ids_by_file(user_id, failed["file_id"]) == []
+
+    ok = ingest(user_id, "notes.pdf", long_text("lecture"))
+    assert ok["status"] == "indexed"
+
+    rebuild_user_faiss_index(user_id)
+    assert indexed_files(user_id) == {"notes.pdf"}
+
+
+def test_failed_job_drops_rows_written_before_it_failed(user_id, ingest, monkeypatch):
+    # The index write succeeds; the job fails afterwards
+    update = ingest_jobs.update_document_status
+
+    def indexed_fails(file_id, status, **fields):
+        if status == "indexed":
+            raise RuntimeError("lost the database")
+        return update(file_id, status, **fields)
+
+    monkeypatch.setattr(ingest_jobs, "update_document_status", indexed_fails)
+    failed = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    monkeypatch.setattr(ingest_jobs, "update_document_status", update)
+
+    assert mongo.get_faiss_ids_by_file(user_id, failed["file_id"]) == []
+    ingest(user_id, "notes.pdf", long_text("lecture"))
+
+    rebuild_user_faiss_index(user_id)
+    assert indexed_files(user_id) == {"notes.pdf"}
+
+
+def test_writes_queued_behind_the_writer_are_applied_as_one_batch(user_id, ingest):
+    syl = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    notes = ingest(user_id, "notes.pdf", long_text("lecture"))
+    futures = []
+
+    def queue_deletes():
+        for doc in (syl, notes):
+            mongo.delete_chunks_by_file(user_id, doc["file_id"])
+            futures.append(index_writer.index_writer.submit_delete(user_id, doc["file_id"], []))
+        assert not any(f.done() for f in futures)
+
+    index_writer.index_writer.run_exclusive(user_id, queue_deletes)
+
+    results = [f.result(timeout=10) for f in futures]
+    assert [r["coalesced"] for r in results] == [2, 2]
+    assert all(r["vectors_removed"] for r in results)
+    assert len(get_user_vectorstore(user_id).index_to_docstore_id) == 0
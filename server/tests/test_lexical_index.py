@@ -0,0 +1,100 @@
+import json
+import os
+from types import SimpleNamespace
+
+from rag import lexical_index
+from rag.lexical_index import LEXICAL_HEADER, _load, get_lexical_index, invalidate_lexical_index, update_lexical_index
+from rag.vectorstore import get_user_index_path
+
+
+class FakeVectorstore:
+    """
+    Just what the lexical index reads: position -> id, and the docstore.
+    """
+
+    def __init__(self, texts: dict[str, str]):
+        self.texts = dict(texts)
+
+    @property
+    def index_to_docstore_id(self):
+        return dict(enumerate(self.texts))
+
+    @property
+    def docstore(self):
+        return SimpleNamespace(search=lambda doc_id: SimpleNamespace(page_content=self.texts[doc_id]))
+
+
+def header(user_id: str) -> dict:
+    with open(os.path.join(get_user_index_path(user_id), LEXICAL_HEADER)) as f:
+        return json.load(f)
+
+
+def snapshot(index) -> tuple:
+    return index.postings, index.doc_len, index.total_len
+
+
+def test_saves_append_only_the_change_and_load_replays_them(workdir, user_id):
+    vectorstore = FakeVectorstore({"0": "CS-101 syllabus", "1": "grading policy", "2": "exam dates"})
+    update_lexical_index(user_id, vectorstore)
+
+    del vectorstore.texts["1"]
+    vectorstore.texts["3"] = "CS-101 office hours"
+    update_lexical_index(user_id, vectorstore)
+
+    segments = header(user_id)["segments"]
+    assert [(s["rows"], s["removed"]) for s in segments] == [(3, 0), (1, 1)]
+
+    live = get_lexical_index(user_id, vectorstore)
+    loaded = _load(user_id)
+    assert snapshot(loaded) == snapshot(live)
+    assert loaded.search("cs101", 5) == live.search("cs101", 5)
+    assert set(loaded.search("cs101", 5)) == {"0", "3"}
+
+
+def test_segments_are_merged(workdir, user_id, monkeypatch):
+    monkeypatch.setattr(lexical_index, "LEXICAL_MAX_SEGMENTS", 2)
+    vectorstore = FakeVectorstore({})
+    for i in range(4):
+        vectorstore.texts[str(i)] = f"chunk {i}"
+        update_lexical_index(user_id, vectorstore)
+
+    assert len(header(user_id)["segments"]) == 2
+    names = os.listdir(get_user_index_path(user_id))
+    assert not any(name.startswith(("lexical.0.", "lexical.1.")) for name in names)
+    assert set(_load(user_id).doc_len) == {"0", "1", "2", "3"}
+
+
+def test_stale_copy_never_appends_to_another_writers_segments(workdir, user_id):
+    vectorstore = FakeVectorstore({"0": "first"})
+    update_lexical_index(user_id, vectorstore)
+    stale = _load(user_id)
+
+    # Another worker saves meanwhile
+    vectorstore.texts["1"] = "second"
+    update_lexical_index(user_id, vectorstore)
+
+    vectorstore.texts["2"] = "third"
+    with stale.lock:
+        stale.sync(vectorstore)
+        lexical_index._save(user_id, stale, rebuild=False)
+    assert len(header(user_id)["segments"]) == 1
+    assert set(_load(user_id).doc_len) == {"0", "1", "2"}
+
+
+def test_legacy_pickle_is_never_loaded(workdir, user_id):
+    base = get_user_index_path(user_id)
+    os.makedirs(base)
+    with open(os.path.join(base, "lexical.pkl"), "wb") as f:
+        f.write(b"not a pickle")
+    invalidate_lexical_index(user_id)
+
+    index = get_lexical_index(user_id, FakeVectorstore({"0": "syllabus"}))
+    assert index.search("syllabus", 1) == ["0"]
+
+
+def test_rrf_rewards_ids_both_rankings_agree_on():
+    from rag.retriever import reciprocal_rank_fusion
+
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "a"]], k=60)
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b", "d"]
+    assert fused[0][1] == 1 / 61 + 1 / 63
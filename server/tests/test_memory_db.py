@@ -0,0 +1,230 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, InsertOne, UpdateOne, DeleteMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from db.memory import AsyncMemoryDatabase, MemoryCollection, MemoryDatabase
+
+
+@pytest.fixture
+def col():
+    col = MemoryCollection("docs")
+    for i in range(5):
+        col.insert_one({"user_id": f"u{i % 2}", "n": i, "tag": "even" if i % 2 == 0 else "odd"})
+    col.insert_one({"user_id": "u0", "n": 9})  # no tag
+    return col
+
+
+def ns(docs) -> list[int]:
+    return sorted(d["n"] for d in docs)
+
+
+# Filters
+
+def test_equality_and_in(col):
+    assert ns(col.find({"user_id": "u1"})) == [1, 3]
+    assert ns(col.find({"n": {"$in": [0, 3, 7]}})) == [0, 3]
+
+
+def test_comparisons(col):
+    assert ns(col.find({"n": {"$gt": 1, "$lt": 4}})) == [2, 3]
+    assert ns(col.find({"n": {"$gte": 1, "$lte": 3}})) == [1, 2, 3]
+
+
+def test_ne_matches_missing_fields(col):
+    assert ns(col.find({"tag": {"$ne": "even"}})) == [1, 3, 9]
+
+
+def test_exists(col):
+    assert ns(col.find({"tag": {"$exists": False}})) == [9]
+    assert ns(col.find({"tag": {"$exists": True}})) == [0, 1, 2, 3, 4]
+
+
+def test_or(col):
+    query = {"user_id": "u0", "$or": [{"tag": {"$exists": False}}, {"n": {"$lt": 1}}]}
+    assert ns(col.find(query)) == [0, 9]
+
+
+def test_unsupported_operator_is_an_error(col):
+    with pytest.raises(NotImplementedError):
+        list(col.find({"n": {"$regex": "1"}}))
+
+
+# Projection, sort, limit
+
+def test_projection(col):
+    doc = col.find_one({"n": 1}, {"_id": 0, "n": 1})
+    assert doc == {"n": 1}
+    doc = col.find_one({"n": 1}, {"_id": 0})
+    assert "_id" not in doc and doc["tag"] == "odd"
+
+
+def test_results_are_copies(col):
+    col.find_one({"n": 1})["n"] = 100
+    assert col.count_documents({"n": 100}) == 0
+
+
+def test_sort_and_limit(col):
+    newest = list(col.find({"user_id": "u0"}).sort("n", DESCENDING).limit(2))
+    assert [d["n"] for d in newest] == [9, 4]
+    by_tag = list(col.find({}).sort([("tag", ASCENDING), ("n", DESCENDING)]))
+    # Missing field sorts lowest
+    assert [d["n"] for d in by_tag] == [9, 4, 2, 0, 3, 1]
+
+
+def test_find_one_sort(col):
+    assert col.find_one({"user_id": "u1"}, sort=[("n", DESCENDING)])["n"] == 3
+
+
+# Updates
+
+def test_set_update(col):
+    result = col.update_many({"user_id": "u1"}, {"$set": {"tag": "x"}})
+    assert result.matched_count == 2
+    assert ns(col.find({"tag": "x"})) == [1, 3]
+
+
+def test_update_one_touches_one(col):
+    assert col.update_one({"user_id": "u1"}, {"$set": {"tag": "x"}}).matched_count == 1
+    assert col.count_documents({"tag": "x"}) == 1
+
+
+def test_upsert_seeds_from_the_query(col):
+    result = col.update_one(
+        {"user_id": "u7", "n": {"$lt": 5}},
+        {"$set": {"summary": "s"}},
+        upsert=True
+    )
+    assert result.upserted_id is not None
+    assert col.find_one({"user_id": "u7"}, {"_id": 0}) == {"user_id": "u7", "summary": "s"}
+
+
+def test_only_set_is_supported(col):
+    with pytest.raises(NotImplementedError):
+        col.update_one({"n": 1}, {"$inc": {"n": 1}})
+
+
+# Unique indexes
+
+def test_unique_index_on_insert():
+    col = MemoryCollection("users")
+    col.create_index([("email", ASCENDING)], unique=True)
+    col.insert_one({"email": "a@x"})
+    with pytest.raises(DuplicateKeyError):
+        col.insert_one({"email": "a@x"})
+    assert col.count_documents({}) == 1
+
+
+def test_unique_index_on_update_and_upsert():
+    col = MemoryCollection("summaries")
+    col.create_index("user_id", unique=True)
+    col.insert_one({"user_id": "a"})
+    col.insert_one({"user_id": "b"})
+    with pytest.raises(DuplicateKeyError):
+        col.update_one({"user_id": "b"}, {"$set": {"user_id": "a"}})
+    # The conditional upsert save_chat_summary does when a newer one exists
+    with pytest.raises(DuplicateKeyError):
+        col.update_one({"user_id": "a", "v": {"$lt": 1}}, {"$set": {"v": 1}}, upsert=True)
+
+
+def test_duplicate_id():
+    col = MemoryCollection("chat")
+    _id = ObjectId()
+    col.insert_one({"_id": _id})
+    with pytest.raises(DuplicateKeyError):
+        col.insert_one({"_id": _id})
+
+
+def test_delete_frees_the_id():
+    col = MemoryCollection("chat")
+    _id = col.insert_one({"x": 1}).inserted_id
+    assert col.delete_one({"_id": _id}).deleted_count == 1
+    col.insert_one({"_id": _id})
+
+
+# insert_many / BulkWriteError (what the chat writer relies on)
+
+def test_insert_many_adds_ids_to_the_callers_dicts():
+    col = MemoryCollection("chat")
+    records = [{"n": 1}, {"n": 2}]
+    result = col.insert_many(records)
+    assert [r["_id"] for r in records] == result.inserted_ids
+
+
+def test_unordered_insert_many_skips_duplicates_and_reports_them():
+    col = MemoryCollection("chat")
+    stored = {"_id": ObjectId(), "n": 1}
+    col.insert_one(dict(stored))
+    batch = [dict(stored), {"_id": ObjectId(), "n": 2}, {"_id": ObjectId(), "n": 3}]
+
+    with pytest.raises(BulkWriteError) as e:
+        col.insert_many(batch, ordered=False)
+
+    details = e.value.details
+    assert [(err["index"], err["code"]) for err in details["writeErrors"]] == [(0, 11000)]
+    assert details["writeConcernErrors"] == []
+    assert details["nInserted"] == 2
+    assert ns(col.find({})) == [1, 2, 3]
+
+
+def test_ordered_insert_many_stops_at_the_first_duplicate():
+    col = MemoryCollection("chat")
+    _id = ObjectId()
+    col.insert_one({"_id": _id, "n": 1})
+
+    with pytest.raises(BulkWriteError) as e:
+        col.insert_many([{"n": 2}, {"_id": _id, "n": 1}, {"n": 3}])
+
+    assert e.value.details["nInserted"] == 1
+    assert ns(col.find({})) == [1, 2]
+
+
+def test_retried_chat_batch_is_stored_once():
+    from db.mongo import _chat_record, chat_history_col, insert_chat_records
+
+    chat_history_col.delete_many({})
+    records = []
+    for i in range(3):
+        record = _chat_record("u1", f"q{i}", "a", [], datetime(2026, 1, 1) + timedelta(seconds=i))
+        record["_id"] = ObjectId()
+        records.append(record)
+
+    # First attempt stored part of the batch before failing
+    insert_chat_records(records[:2])
+    assert insert_chat_records(records) == 1
+    assert chat_history_col.count_documents({"user_id": "u1"}) == 3
+
+
+# bulk_write
+
+def test_bulk_write():
+    col = MemoryCollection("chunks")
+    col.insert_many([{"file_id": "a", "n": 1}, {"file_id": "b", "n": 2}])
+    result = col.bulk_write([
+        UpdateOne({"n": 1}, {"$set": {"n": 10}}),
+        InsertOne({"file_id": "c", "n": 3}),
+        DeleteMany({"file_id": "b"})
+    ])
+    assert (result.matched_count, result.inserted_count, result.deleted_count) == (1, 1, 1)
+    assert ns(col.find({})) == [3, 10]
+
+
+# Async facade
+
+def test_async_facade_shares_the_data():
+    database = MemoryDatabase()
+    async_database = AsyncMemoryDatabase(database)
+
+    async def scenario():
+        await async_database["docs"].insert_one({"n": 1})
+        database["docs"].insert_one({"n": 2})
+        found = await async_database["docs"].find({}, {"_id": 0}).sort("n", DESCENDING).to_list(None)
+        one = await async_database["docs"].find_one({"n": 1}, {"_id": 0})
+        return found, one
+
+    found, one = asyncio.run(scenario())
+    assert found == [{"n": 2}, {"n": 1}]
+    assert one == {"n": 1}
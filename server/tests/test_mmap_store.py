@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from conftest import long_text
+from rag import vectorstore as vectorstore_module
+from rag.mmap_store import MmapDocstore, PositionIds, StoredDocs, write_docstore
+from rag.vectorstore import (
+    CURRENT_FILE,
+    get_index_dir,
+    get_index_version,
+    get_user_index_path,
+    get_user_vectorstore
+)
+
+
+def docs() -> list[Document]:
+    return [
+        Document(page_content="CS-101 syllabus", metadata={"file_id": "a", "page": 1, "filename": "syl.pdf"}),
+        Document(page_content="grading: 40% exam ✓", metadata={"file_id": "a", "page": 2, "filename": None}),
+        Document(page_content="", metadata={"file_id": "b", "page": 1}),
+    ]
+
+
+def test_round_trip(tmp_path):
+    ids = ["3", "5", "9"]
+    write_docstore(str(tmp_path), ids, docs(), "flat")
+    stored = StoredDocs(str(tmp_path))
+    docstore = MmapDocstore(stored)
+
+    for doc_id, doc in zip(ids, docs()):
+        found = docstore.search(doc_id)
+        assert (found.page_content, found.metadata) == (doc.page_content, doc.metadata)
+    assert "4" not in docstore
+    assert dict(PositionIds(stored)) == {0: "3", 1: "5", 2: "9"}
+    np.testing.assert_array_equal(PositionIds(stored).positions_of_numeric(np.array([9, 4, 3])), [2, 0])
+
+
+def test_uuid_ids_are_looked_up_too(tmp_path):
+    ids = ["5f0c-a", "17", "0a9e-b"]
+    write_docstore(str(tmp_path), ids, docs(), "flat")
+    stored = StoredDocs(str(tmp_path))
+
+    assert not stored.header["num_ids_sorted"]
+    assert [stored.row_of(doc_id) for doc_id in ids] == [0, 1, 2]
+    assert PositionIds(stored).positions_of_numeric(np.array([17])) is None
+
+
+def test_overlay_hides_and_adds_until_the_next_save(tmp_path):
+    write_docstore(str(tmp_path), ["0", "1", "2"], docs(), "flat")
+    docstore = MmapDocstore(StoredDocs(str(tmp_path)), deleted_rows=[2])
+    copy = docstore.copy()
+    copy.delete(["0"])
+    copy.add({"7": Document(page_content="new")})
+
+    assert "0" in docstore and "7" not in docstore
+    assert "0" not in copy and copy.search("7").page_content == "new"
+    assert "2" not in docstore and "2" not in copy
+
+
+def test_each_save_is_a_generation_named_by_current(user_id, ingest):
+    base = get_user_index_path(user_id)
+    versions = []
+    for n, topic in enumerate(["syllabus", "lecture", "exam"], start=1):
+        ingest(user_id, f"{topic}.pdf", long_text(topic))
+        assert get_index_dir(base) == os.path.join(base, f"gen-{n}")
+        versions.append(get_index_version(user_id))
+    # One version per save, however close together
+    assert versions == [versions[0], versions[0] + 1, versions[0] + 2]
+
+    # The current generation and KEEP_OLD_GENERATIONS before it
+    kept = sorted(name for name in os.listdir(base) if name.startswith("gen-"))
+    assert kept == ["gen-2", "gen-3"]
+    assert not os.path.exists(os.path.join(base, "index.faiss"))
+
+
+def test_current_written_before_versions_reads_as_its_generation(user_id, ingest):
+    ingest(user_id, "syl.pdf", long_text("syllabus"))
+    base = get_user_index_path(user_id)
+    with open(os.path.join(base, CURRENT_FILE), "w") as f:
+        f.write("gen-1")
+
+    assert get_index_version(user_id) == 1
+    ingest(user_id, "notes.pdf", long_text("lecture"))
+    assert (get_index_dir(base), get_index_version(user_id)) == (os.path.join(base, "gen-2"), 2)
+
+
+def test_reloaded_store_matches_the_saved_one(user_id, ingest):
+    ingest(user_id, "syl.pdf", long_text("syllabus"))
+    saved = get_user_vectorstore(user_id)
+    vectorstore_module.invalidate_user_vectorstore(user_id)
+    loaded = get_user_vectorstore(user_id)
+
+    assert loaded is not saved
+    assert isinstance(loaded.docstore, MmapDocstore)
+    assert dict(loaded.index_to_docstore_id) == dict(saved.index_to_docstore_id)
+    for doc_id in loaded.index_to_docstore_id.values():
+        assert loaded.docstore.search(doc_id) == saved.docstore.search(doc_id)
@@ -0,0 +1,40 @@
+import asyncio
+
+from rag.single_flight import StreamFanout
+
+
+def counting_stream(started: list):
+    async def stream():
+        started.append(1)
+        for i in range(3):
+            await asyncio.sleep(0)
+            yield i
+
+    return stream
+
+
+def test_subscribers_share_one_stream():
+    fanout, started = StreamFanout(), []
+
+    async def collect():
+        return [frame async for frame in fanout.subscribe("q", counting_stream(started))]
+
+    async def scenario():
+        return await asyncio.gather(collect(), collect())
+
+    assert asyncio.run(scenario()) == [[0, 1, 2], [0, 1, 2]]
+    assert len(started) == 1 and fanout.coalesced == 1
+
+
+def test_request_after_the_last_subscriber_left_starts_a_new_stream():
+    fanout, started = StreamFanout(), []
+
+    async def scenario():
+        first = fanout.subscribe("q", counting_stream(started))
+        assert await first.__anext__() == 0
+        # Leaves mid-stream; the producer is cancelled but has not unwound yet
+        await first.aclose()
+        return [frame async for frame in fanout.subscribe("q", counting_stream(started))]
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+    assert len(started) == 2 and fanout.coalesced == 0
@@ -0,0 +1,77 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import UploadFile
+from pymongo.errors import DuplicateKeyError
+
+from api import documents
+from db import async_mongo, mongo
+
+PDF = b"%PDF-1.4 syllabus"
+
+
+@pytest.fixture
+def upload(workdir, monkeypatch):
+    """
+    upload(user_id) -> response of POST /documents/upload for PDF, with
+    the hash lookup before the insert always missing (as for two uploads
+    racing past it) and no ingest job started.
+    """
+    mongo.init_db()
+    monkeypatch.setattr(documents, "UPLOAD_DIR", str(workdir))
+    monkeypatch.setattr(documents.ingest_queue, "submit", lambda **kwargs: None)
+    lookup = documents.get_document_by_hash
+    calls = []
+
+    async def racing_lookup(*args):
+        calls.append(args)
+        # The pre-check misses; the lookup after a DuplicateKeyError is real
+        return None if len(calls) % 2 else await lookup(*args)
+
+    def run(user_id: str) -> dict:
+        calls.clear()
+        file = UploadFile(io.BytesIO(PDF), filename="syl.pdf")
+        return asyncio.run(documents.upload_document(file=file, user_id=user_id))
+
+    monkeypatch.setattr(documents, "get_document_by_hash", racing_lookup)
+    return run
+
+
+def test_only_one_of_two_racing_uploads_is_queued(user_id, upload):
+    first = upload(user_id)
+    second = upload(user_id)
+
+    assert first["duplicate"] is False
+    assert second["duplicate"] is True and second["file_id"] == first["file_id"]
+    assert len(mongo.get_user_documents(user_id)) == 1
+
+
+def test_failed_documents_release_their_content(user_id, upload):
+    first = upload(user_id)
+    mongo.update_document_status(first["file_id"], "failed", error="parse error")
+
+    again = upload(user_id)
+    assert again["duplicate"] is False and again["file_id"] != first["file_id"]
+
+
+def test_upload_replaces_a_job_orphaned_by_a_dead_process(user_id, upload):
+    orphan = upload(user_id)
+    mongo.documents_col.update_one(
+        {"file_id": orphan["file_id"]},
+        {"$set": {"updated_at": datetime.utcnow() - timedelta(days=1)}}
+    )
+
+    again = upload(user_id)
+    assert again["duplicate"] is False
+    assert mongo.get_document_by_id(user_id, orphan["file_id"])["status"] == "failed"
+
+
+def test_live_hash_index_is_partial(user_id):
+    mongo.init_db()
+    mongo.insert_document(user_id, "a.pdf", "pdf", 1, status="failed", content_hash="h")
+    mongo.insert_document(user_id, "b.pdf", "pdf", 1, status="failed", content_hash="h")
+    mongo.insert_document(user_id, "c.pdf", "pdf", 1, content_hash="h")
+    with pytest.raises(DuplicateKeyError):
+        asyncio.run(async_mongo.insert_document(user_id, "d.pdf", "pdf", 1, status="queued", content_hash="h"))
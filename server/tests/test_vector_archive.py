@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from conftest import STUB_DIM, StubEmbeddings, long_text
+from db import mongo
+from rag import reindex
+from rag.reindex import rebuild_user_faiss_index
+from rag.vector_archive import (
+    append_vectors,
+    archive_generation,
+    load_vectors,
+    stage_vectors,
+    promote_staged_vectors,
+    staged_generation
+)
+from rag.vectorstore import get_user_vectorstore
+
+
+def vectors(n: int, start: int = 0) -> np.ndarray:
+    return np.arange(start, start + n * STUB_DIM, dtype=np.float32).reshape(n, STUB_DIM)
+
+
+def chunks_resolve_to_their_text(user_id: str) -> bool:
+    vectorstore = get_user_vectorstore(user_id)
+    return all(
+        vectorstore.docstore.search(str(c["faiss_index_id"])).page_content == c["text"]
+        for c in mongo.chunks_col.find({"user_id": user_id})
+    )
+
+
+def test_appends_are_looked_up_by_id(workdir, user_id):
+    append_vectors(user_id, [3, 7], vectors(2))
+    append_vectors(user_id, [9], vectors(1, start=1000))
+
+    found = load_vectors(user_id, [7, 9, 42], dim=STUB_DIM)
+    assert set(found) == {7, 9}
+    np.testing.assert_array_equal(found[9], vectors(1, start=1000)[0])
+    # Another model's width: the ids would resolve to wrong vectors
+    assert load_vectors(user_id, [7], dim=STUB_DIM * 2) == {}
+
+
+def test_ids_only_resolve_in_their_generation(workdir, user_id):
+    append_vectors(user_id, [0, 1], vectors(2))
+    stage_vectors(user_id, [0], vectors(1, start=500), generation=1)
+
+    assert staged_generation(user_id) == 1
+    np.testing.assert_array_equal(load_vectors(user_id, [0], generation=0)[0], vectors(1)[0])
+    np.testing.assert_array_equal(load_vectors(user_id, [0], generation=1)[0], vectors(1, start=500)[0])
+
+    promote_staged_vectors(user_id)
+    assert (archive_generation(user_id), staged_generation(user_id)) == (1, None)
+    assert load_vectors(user_id, [0], generation=0) == {}
+
+
+def test_compaction_reuses_archived_vectors(user_id, ingest):
+    syl = ingest(user_id, "syl.pdf", long_text("syllabus"))
+    ingest(user_id, "notes.pdf", long_text("lecture"))
+    mongo.delete_document(user_id, syl["file_id"])
+    mongo.delete_chunks_by_file(user_id, syl["file_id"])
+
+    calls = StubEmbeddings.calls
+    rebuild_user_faiss_index(user_id)
+
+    assert StubEmbeddings.calls == calls
+    assert archive_generation(user_id) == 1
+    assert {c["archive_generation"] for c in mongo.chunks_col.find({"user_id": user_id})} == {1}
+    assert chunks_resolve_to_their_text(user_id)
+
+
+def test_interrupted_compaction_is_finished_by_the_next_write(user_id, ingest, monkeypatch):
+    ingest(user_id, "syl.pdf", long_text("syllabus"))
+
+    def crash(uid):
+        raise OSError("killed")
+
+    # Chunks renumbered and the index saved, but the staged archive never went live
+    monkeypatch.setattr(reindex, "promote_staged_vectors", crash)
+    with pytest.raises(OSError):
+        rebuild_user_faiss_index(user_id)
+    assert staged_generation(user_id) == 1
+    monkeypatch.setattr(reindex, "promote_staged_vectors", promote_staged_vectors)
+
+    ingest(user_id, "notes.pdf", long_text("lecture"))
+
+    assert staged_generation(user_id) is None
+    assert archive_generation(user_id) == 2
+    files = {c["filename"] for c in mongo.chunks_col.find({"user_id": user_id})}
+    assert files == {"syl.pdf", "notes.pdf"}
+    assert chunks_resolve_to_their_text(user_id)